@@ -1,15 +1,88 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import Error, transaction
 
 # Register your models here.
 
-from django.contrib import admin
-from .models import Problem, Schema, Solution
+from .models import DataSource, Problem, Schema, Solution, Submission
+from .grading import refresh_expected_result
+from .result_cache import invalidate_problem
+from .sandbox import build_problem_schema, prebuilt_schemas_enabled
 
-# This line tells the admin site to display the Problem model
-admin.site.register(Problem)
 
-# This line does the same for the Schema model
-admin.site.register(Schema)
+def rebuild_problem_data(request, problem, build_schema=True):
+    """
+    Keep the pre-built schema (if `build_schema`) and expected result in sync after
+    a change in the admin. This runs once the change is committed: the expected
+    result is computed on the sandbox connection, which can't see it before.
+    A failure is shown as an error message, like seed_problems reports it, and
+    clears the problem's source_hash so the next seed_problems run rebuilds it.
+    """
+    invalidate_problem(problem.pk)
+    if build_schema and not prebuilt_schemas_enabled():
+        return
 
-# And this one for the Solution model
-admin.site.register(Solution)
\ No newline at end of file
+    def rebuild():
+        try:
+            if build_schema:
+                build_problem_schema(problem)
+            if hasattr(problem, 'solution'):
+                refresh_expected_result(problem.solution)
+        except (Error, OSError) as e:
+            type(problem).objects.filter(pk=problem.pk).update(source_hash='')
+            messages.error(request, f"Could not build data schema or expected result for '{problem.title}': {e}")
+
+    transaction.on_commit(rebuild)
+
+
+# This tells the admin site to display the Problem model; cached results of an
+# edited problem are dropped (its engine or limits may have changed)
+@admin.register(Problem)
+class ProblemAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_problem(obj.pk)
+
+
+# The Schema admin rebuilds the problem's tables whenever a script is saved or removed
+@admin.register(Schema)
+class SchemaAdmin(admin.ModelAdmin):
+    list_display = ('problem', 'order')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rebuild_problem_data(request, obj.problem)
+
+    def delete_model(self, request, obj):
+        problem = obj.problem
+        super().delete_model(request, obj)
+        rebuild_problem_data(request, problem)
+
+
+# Data sources rebuild the problem's tables the same way
+@admin.register(DataSource)
+class DataSourceAdmin(SchemaAdmin):
+    list_display = ('problem', 'table', 'kind', 'order')
+
+
+# The Solution admin recomputes the stored expected result on every save
+@admin.register(Solution)
+class SolutionAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rebuild_problem_data(request, obj.problem, build_schema=False)
+
+
+# The submission history is written by the app (see history.py); the admin only reads it
+@admin.register(Submission)
+class SubmissionAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'problem', 'user', 'action', 'verdict', 'duration_ms', 'row_count', 'error_class')
+    list_filter = ('action', 'verdict', 'problem')
+    list_select_related = ('problem', 'user')
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('user',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,317 @@
+# practice/api.py
+#
+# JSON endpoints behind the editor's Run / Submit buttons:
+#   POST /api/problems/<id>/run     {"query": "...", "offset": 0}
+#   POST /api/problems/<id>/submit  {"query": "..."}
+#   POST /api/problems/<id>/explain {"query": "..."}
+#   POST /api/problems/<id>/export  {"query": "...", "format": "csv", "gzip": true}
+#
+# The views are async. Served through ASGI (project/asgi.py) they run queries on
+# asyncpg (see async_sandbox.py); under WSGI they fall back to the synchronous
+# execution path in a worker thread (or the execution worker pool, see
+# workers.py), so the API works either way.
+
+import json
+import datetime
+import math
+import time
+from decimal import Decimal
+from uuid import UUID
+
+import asyncpg
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import Error
+from django.http import JsonResponse, StreamingHttpResponse
+
+from . import result_cache
+from .async_sandbox import async_supported, explain_query_async, grade_query_async, run_query_async
+from .classifier import classify
+from .export import (
+    EXPORT_CSV, EXPORT_FORMATS, aencode, closing_chunks, encode, open_result, open_result_async, text_value,
+)
+from .history import (
+    ACTION_RUN, ACTION_SUBMIT, VERDICT_CORRECT, VERDICT_INCORRECT, VERDICT_OK, error_verdict, record_attempt,
+)
+from .metrics import count_error, count_verdict, label_problem, phase, traced
+from .models import Problem
+from .sandbox import SandboxBusy, prefetch_problem_data
+from .workers import execution_service
+
+
+# What a user query can fail with, on either driver. asyncpg raises InterfaceError
+# for queries it refuses client-side, e.g. one using $1 (no arguments are passed)
+QUERY_ERRORS = (Error, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+
+def error_response(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def busy_response():
+    """Fast 503 when this process is already running as many queries as it's allowed to."""
+    response = error_response("The server is busy running other queries right now. Please try again in a few seconds.", 503)
+    response['Retry-After'] = '2'
+    return response
+
+
+def json_cell(value):
+    """
+    A result value JsonResponse (DjangoJSONEncoder) can serialize. Types it has
+    no encoding for (bytea as memoryview/bytes, inet, ranges, geometric types,
+    ...) become their text, as in exports; NaN/Infinity become strings, as
+    JSON has no literal for them.
+    """
+    if value is None or isinstance(value, (str, bool, int, Decimal, datetime.date, datetime.time, datetime.timedelta, UUID)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else str(value)
+    if isinstance(value, (list, tuple)):
+        return [json_cell(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): json_cell(item) for key, item in value.items()}
+    return text_value(value)
+
+
+def page_payload(page):
+    return {
+        'columns': page.columns,
+        'rows': [[json_cell(value) for value in row] for row in page.rows],
+        'offset': page.offset,
+        'first_row': page.first_row,
+        'last_row': page.last_row,
+        'total_rows': page.total_rows,
+        'total_rows_capped': page.total_rows_capped,
+        'has_more': page.has_more,
+        'byte_limited': page.byte_limited,
+        'cached': page.cached,
+        'stats': page.stats.as_dict() if page.stats else None,
+    }
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = {}
+        return data if isinstance(data, dict) else {}
+    return request.POST
+
+
+def parse_request(request):
+    """Read the query (and offset) from a JSON body, or from form fields."""
+    data = request_data(request)
+    try:
+        offset = max(int(data.get('offset') or 0), 0)
+    except (TypeError, ValueError):
+        offset = 0
+    return str(data.get('query') or data.get('user_query') or '').strip(), offset
+
+
+async def load_problem(problem_id):
+    try:
+        problem = await Problem.objects.select_related('solution').aget(pk=problem_id)
+    except Problem.DoesNotExist:
+        return None
+    label_problem(problem)
+    # Legacy mode: the schema scripts and data sources, once (see sandbox.prefetch_problem_data)
+    await sync_to_async(prefetch_problem_data)([problem])
+    return problem
+
+
+async def record(request, problem, action, user_query, started, verdict, row_count=None, error=None):
+    """Add this Run/Submit to the history (buffered, see history.py)."""
+    user = await request.auser()
+    record_attempt(
+        problem, action, user_query, verdict, (time.perf_counter() - started) * 1000,
+        user_id=user.pk if user.is_authenticated else None,
+        session_key=request.session.session_key, row_count=row_count, error=error,
+    )
+
+
+def use_async_driver(request, problem):
+    return isinstance(request, ASGIRequest) and async_supported(problem)
+
+
+async def prepare(request, problem_id):
+    """Shared validation. Returns (problem, query, offset, error_response)."""
+    if request.method != 'POST':
+        return None, '', 0, error_response("Use POST.", 405)
+    with phase('load_problem'):
+        problem = await load_problem(problem_id)
+    if problem is None:
+        return None, '', 0, error_response("Problem not found.", 404)
+    user_query, offset = parse_request(request)
+    if not user_query:
+        return problem, '', 0, error_response("Cannot execute an empty query.", 400)
+    classification = classify(user_query)
+    if not classification.allowed:
+        return problem, user_query, offset, error_response(classification.reason, 400)
+    return problem, user_query, offset, None
+
+
+@traced('run')
+async def api_run(request, problem_id):
+    started = time.perf_counter()
+    problem, user_query, offset, error = await prepare(request, problem_id)
+    if error:
+        return error
+
+    query_started = time.perf_counter()
+    try:
+        if use_async_driver(request, problem):
+            # The synchronous path checks the result cache in CachedExecution
+            key, page = await sync_to_async(result_cache.lookup)('run', problem, user_query, offset)
+            if page is not None:
+                page.cached = True
+            else:
+                page = await run_query_async(problem, user_query, offset)
+                await sync_to_async(result_cache.store)(key, problem, page)
+        else:
+            page = await sync_to_async(execution_service().run_query)(problem, user_query, offset)
+    except SandboxBusy as e:
+        count_error(e)
+        return busy_response()
+    except QUERY_ERRORS as e:
+        count_error(e)
+        await record(request, problem, ACTION_RUN, user_query, query_started, error_verdict(e), error=e)
+        return error_response(str(e), 400)
+    await record(request, problem, ACTION_RUN, user_query, query_started, VERDICT_OK, row_count=page.row_count)
+
+    payload = page_payload(page)
+    payload['timings'] = {'total_ms': round((time.perf_counter() - started) * 1000, 2)}
+    return JsonResponse(payload)
+
+
+@traced('submit')
+async def api_submit(request, problem_id):
+    started = time.perf_counter()
+    problem, user_query, offset, error = await prepare(request, problem_id)
+    if error:
+        return error
+    if not hasattr(problem, 'solution') or not problem.solution.query:
+        return error_response("This problem does not have a solution configured yet.", 409)
+
+    query_started = time.perf_counter()
+    try:
+        result = None
+        if use_async_driver(request, problem):
+            key, result = await sync_to_async(result_cache.lookup)('submit', problem, user_query)
+            if result is not None:
+                result[1].cached = True
+            else:
+                result = await grade_query_async(problem, user_query)
+                if result is not None:
+                    await sync_to_async(result_cache.store)(key, problem, result)
+        if result is None:
+            result = await sync_to_async(execution_service().grade_query)(problem, user_query)
+    except SandboxBusy as e:
+        count_error(e)
+        return busy_response()
+    except QUERY_ERRORS as e:
+        count_error(e)
+        await record(request, problem, ACTION_SUBMIT, user_query, query_started, error_verdict(e), error=e)
+        return error_response(str(e), 400)
+
+    comparison, page = result
+    count_verdict(comparison.correct)
+    await record(request, problem, ACTION_SUBMIT, user_query, query_started,
+                 VERDICT_CORRECT if comparison.correct else VERDICT_INCORRECT, row_count=comparison.row_count)
+    payload = page_payload(page)
+    payload.update({
+        'verdict': 'correct' if comparison.correct else 'incorrect',
+        'message': 'Correct! Your solution is accurate.' if comparison.correct
+                   else f'Incorrect. The results did not match the expected solution. {comparison.reason}',
+        'reason': comparison.reason,
+        'diff': comparison.diff.as_dict() if comparison.diff else None,
+        'timings': {'total_ms': round((time.perf_counter() - started) * 1000, 2)},
+    })
+    return JsonResponse(payload)
+
+
+@traced('explain')
+async def api_explain(request, problem_id):
+    started = time.perf_counter()
+    problem, user_query, offset, error = await prepare(request, problem_id)
+    if error:
+        return error
+
+    try:
+        if use_async_driver(request, problem):
+            stats = await explain_query_async(problem, user_query)
+        else:
+            stats = await sync_to_async(execution_service().explain_query)(problem, user_query)
+    except SandboxBusy as e:
+        count_error(e)
+        return busy_response()
+    except QUERY_ERRORS as e:
+        count_error(e)
+        return error_response(str(e), 400)
+
+    return JsonResponse({
+        'stats': stats.as_dict(),
+        'timings': {'total_ms': round((time.perf_counter() - started) * 1000, 2)},
+    })
+
+
+def export_options(request):
+    """(format, gzip) of an export request; the format is None if it isn't one we know."""
+    data = request_data(request)
+    fmt = str(data.get('format') or EXPORT_CSV).lower()
+    compress = str(data.get('gzip') or '').lower() in ('1', 'true', 'on', 'yes')
+    return (fmt if fmt in EXPORT_FORMATS else None), compress
+
+
+async def iterate_in_thread(iterator):
+    """An async iterator over a synchronous one whose every step must run in the same thread."""
+    done = object()
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (item := await step(iterator, done)) is not done:
+            yield item
+    finally:
+        # Stopped early: close it (and what it reads from) in its thread too
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+@traced('export')
+async def api_export(request, problem_id):
+    problem, user_query, offset, error = await prepare(request, problem_id)
+    if error:
+        return error
+    fmt, compress = export_options(request)
+    if fmt is None:
+        return error_response(f"Unknown export format; use one of: {', '.join(EXPORT_FORMATS)}.", 400)
+
+    try:
+        # A result the cache holds in full is sent from there
+        key, page = await sync_to_async(result_cache.lookup)('run', problem, user_query, 0)
+        if page is not None and not page.has_more and not page.byte_limited:
+            chunks = encode(page.columns, [page.rows], fmt, compress)
+        elif use_async_driver(request, problem):
+            columns, batches, close = await open_result_async(problem, user_query)
+            chunks = closing_chunks(aencode(columns, batches, fmt, compress), close)
+        else:
+            # The cursor must be read (and closed) in the thread that opened it: the
+            # request's own under WSGI, the request's sync thread under ASGI, where
+            # the response is closed too
+            columns, batches, close = await sync_to_async(open_result, thread_sensitive=True)(problem, user_query)
+            chunks = encode(columns, batches, fmt, compress)
+            if isinstance(request, ASGIRequest):
+                chunks = iterate_in_thread(chunks)
+            chunks = closing_chunks(chunks, close)
+    except SandboxBusy as e:
+        count_error(e)
+        return busy_response()
+    except QUERY_ERRORS as e:
+        count_error(e)
+        return error_response(str(e), 400)
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    filename = f"problem-{problem.pk}-result.{extension}"
+    if compress:
+        content_type, filename = 'application/gzip', filename + '.gz'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
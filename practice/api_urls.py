@@ -0,0 +1,12 @@
+# practice/api_urls.py
+from django.urls import path
+from . import api
+
+app_name = 'practice_api'
+
+urlpatterns = [
+    path('problems/<int:problem_id>/run', api.api_run, name='run'),
+    path('problems/<int:problem_id>/submit', api.api_submit, name='submit'),
+    path('problems/<int:problem_id>/explain', api.api_explain, name='explain'),
+    path('problems/<int:problem_id>/export', api.api_export, name='export'),
+]
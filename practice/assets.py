@@ -0,0 +1,161 @@
+# practice/assets.py
+#
+# The editor's JavaScript and CSS (CodeMirror 5, vendored under practice/assets/,
+# plus the Pygments styles for highlighted code blocks) are served by the app
+# itself as two bundles, instead of half a dozen files from a CDN:
+#
+#   /assets/editor.<hash>.js    CodeMirror, its SQL mode and addons
+#   /assets/editor.<hash>.css   CodeMirror and its theme, code block highlighting
+#
+# A bundle is the concatenation of its sources, minified when rjsmin/rcssmin are
+# installed. It is built once per process, the first time a page needs its URL.
+# The URL contains a hash of the content, so a bundle can be cached by browsers
+# and proxies forever (Cache-Control: immutable): changing any source changes
+# the URL. The gzip and brotli (if the Brotli package is installed) encodings of
+# a bundle are also computed once, on its first request, and served to the
+# clients that accept them.
+
+import gzip
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:
+    rcssmin = rjsmin = None
+
+ASSETS_DIR = Path(__file__).resolve().parent / 'assets'
+
+# Served as "Cache-Control: public, max-age=..., immutable"
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Pygments style of the code blocks in descriptions and explanations (see rendering.py)
+PYGMENTS_STYLE = 'default'
+
+
+def pygments_css():
+    from pygments.formatters import HtmlFormatter
+
+    from .rendering import HIGHLIGHT_CSS_CLASS
+
+    return HtmlFormatter(style=PYGMENTS_STYLE).get_style_defs(f'.{HIGHLIGHT_CSS_CLASS}')
+
+
+# bundle name -> its sources, in order: paths under ASSETS_DIR, or functions returning the text
+BUNDLES = {
+    'editor.js': [
+        'codemirror/lib/codemirror.js',
+        'codemirror/mode/sql/sql.js',
+        'codemirror/addon/edit/matchbrackets.js',
+        'codemirror/addon/edit/closebrackets.js',
+        'codemirror/addon/selection/active-line.js',
+        'codemirror/addon/display/placeholder.js',
+    ],
+    'editor.css': [
+        'codemirror/lib/codemirror.css',
+        'codemirror/theme/dracula.css',
+        pygments_css,
+    ],
+}
+
+CONTENT_TYPES = {
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+}
+
+
+@dataclass
+class Bundle:
+    name: str                   # editor.js
+    hashed_name: str            # editor.0123456789ab.js
+    content: bytes
+    content_type: str
+    _encoded: dict = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def encoded(self, encoding):
+        """The content in `encoding` ('br', 'gzip' or 'identity'), compressed once."""
+        if encoding == 'identity':
+            return self.content
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    if encoding == 'br':
+                        data = brotli.compress(self.content, quality=11)
+                    else:
+                        data = gzip.compress(self.content, compresslevel=9, mtime=0)
+                    self._encoded[encoding] = data
+        return data
+
+
+def minify(name, text):
+    if rjsmin is None:
+        return text
+    return rjsmin.jsmin(text) if name.endswith('.js') else rcssmin.cssmin(text)
+
+
+def build_bundle(name):
+    parts = []
+    for source in BUNDLES[name]:
+        parts.append(source() if callable(source) else (ASSETS_DIR / source).read_text(encoding='utf-8'))
+    # Each source ends its own statements: the ; keeps a missing one from joining two files
+    separator = '\n;\n' if name.endswith('.js') else '\n'
+    content = minify(name, separator.join(parts)).encode('utf-8')
+    stem, extension = name.rsplit('.', 1)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return Bundle(name, f"{stem}.{digest}.{extension}", content, CONTENT_TYPES[f'.{extension}'])
+
+
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+
+def get_bundle(name):
+    """This process's build of bundle `name` (a KeyError if there is no such bundle)."""
+    bundle = _bundles.get(name)
+    if bundle is None:
+        with _bundles_lock:
+            bundle = _bundles.get(name)
+            if bundle is None:
+                bundle = _bundles[name] = build_bundle(name)
+    return bundle
+
+
+def find_bundle(hashed_name):
+    """The bundle served as `hashed_name`, or None (also for a stale hash)."""
+    for name in BUNDLES:
+        stem, extension = name.rsplit('.', 1)
+        if hashed_name.startswith(f'{stem}.') and hashed_name.endswith(f'.{extension}'):
+            bundle = get_bundle(name)
+            return bundle if bundle.hashed_name == hashed_name else None
+    return None
+
+
+def preferred_encoding(accept_encoding):
+    """The best encoding we have that the client accepts: 'br', 'gzip' or 'identity'."""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return 'identity'
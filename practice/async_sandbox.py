@@ -0,0 +1,286 @@
+# practice/async_sandbox.py
+#
+# The asyncio counterpart of execution.py, used by the JSON API (api.py) when
+# the app is served through ASGI.
+#
+# Queries run on asyncpg connections from a per-process pool, so a slow student
+# query only costs a coroutine while Postgres works on it, not a whole thread.
+# The same ExecutionPolicy, schema pinning, paging (PageBuilder) and grading
+# (ExpectedMatcher) as the synchronous path are applied.
+
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+from django.conf import settings
+from django.db import connections
+
+from .engines import ENGINE_SQLITE
+from .execution import PageBuilder, comparison_page, count_rows_limit, count_total_rows, result_page_size
+from .grading import ExpectedMatcher, compare_options, load_expected_result
+from .metrics import phase, record_phase
+from .result_diff import RowDiffer, column_diff, diff_max_rows
+from .routers import mark_unavailable
+from .sandbox import SandboxBusy, execution_policy, limit_error, prebuilt_settings, read_alias, sandbox_alias
+from .stats import EXPLAIN_PREFIX, QueryStats, explain_runs, log_query_stats, single_statement, stats_from_explain
+
+# One pool per event loop and database alias (the primary's, and the read
+# replica's if there is one), one admission gate per event loop
+_pools = {}
+_gates = {}
+
+
+def async_supported(problem):
+    """
+    Only problems with a pre-built schema can run without executing their DDL
+    scripts; SQLite problems (see sqlite_engine.py) don't use Postgres at all.
+    """
+    return (bool(problem.data_schema) and getattr(settings, 'PRACTICE_PREBUILT_SCHEMAS', True)
+            and problem.engine != ENGINE_SQLITE)
+
+
+class AsyncAdmissionGate:
+    """asyncio version of sandbox.AdmissionGate: bounded concurrency, bounded queue, fast rejection."""
+
+    def __init__(self, max_concurrent, max_waiting, wait_timeout):
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._slots.locked():
+            if self._waiting >= self.max_waiting:
+                raise SandboxBusy("Too many queries are queued.")
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise SandboxBusy("Timed out waiting for a free query slot.")
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+def _pool_size():
+    return getattr(settings, 'PRACTICE_ASYNC_POOL_SIZE', 20)
+
+
+async def init_connection(conn):
+    """
+    Decode values the way Django's psycopg2 connections do, so a result hashes
+    the same on both drivers (see grading.canonical_value) and async grading
+    agrees with the expected results computed on psycopg2:
+
+    - float4 is read from its text form, not widened from the binary float
+      (1.1, not 1.100000023841858).
+    - json is parsed into dicts/lists; Django only turns that off for jsonb,
+      which both drivers return as text.
+    - record (e.g. ROW(1, 2)) and bit strings have no psycopg2 typecaster, so
+      they come back as their text ('(1,2)', '101') instead of a Record/BitString.
+
+    Ranges are decoded into each driver's own Range class; canonical_value
+    treats both alike. Multiranges, composite types created by a problem's
+    schema and arrays of bit strings still differ between the drivers.
+    """
+    await conn.set_type_codec('float4', encoder=str, decoder=float, schema='pg_catalog', format='text')
+    await conn.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog', format='text')
+    for name in ('record', 'bit', 'varbit'):
+        await conn.set_type_codec(name, encoder=str, decoder=str, schema='pg_catalog', format='text')
+
+
+async def get_pool(alias):
+    key = (asyncio.get_running_loop(), alias)
+    if key not in _pools:
+        # The connection's settings, not settings.DATABASES: under test they point at the test database
+        db = connections[alias].settings_dict
+        _pools[key] = asyncio.ensure_future(asyncpg.create_pool(
+            host=db.get('HOST') or None,
+            port=db.get('PORT') or None,
+            user=db.get('USER') or None,
+            password=db.get('PASSWORD') or None,
+            database=db.get('NAME') or None,
+            min_size=min(2, _pool_size()),
+            max_size=_pool_size(),
+            # User queries are one-offs; don't keep their prepared statements around
+            statement_cache_size=0,
+            init=init_connection,
+            # Like Django's connections (TIME_ZONE = 'UTC'), for timestamptz and its text form
+            server_settings={'TimeZone': 'UTC'},
+        ))
+    try:
+        return await _pools[key]
+    except Exception:
+        # Don't cache a failed pool; the next request tries again
+        _pools.pop(key, None)
+        raise
+
+
+async def close_pools():
+    """Close this event loop's pools (e.g. at shutdown, or before a test database is dropped)."""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _pools if key[0] is loop]:
+        try:
+            pool = await _pools.pop(key)
+        except Exception:
+            continue
+        await pool.close()
+
+
+def get_gate():
+    loop = asyncio.get_running_loop()
+    if loop not in _gates:
+        _gates[loop] = AsyncAdmissionGate(
+            max_concurrent=_pool_size(),
+            max_waiting=getattr(settings, 'PRACTICE_ASYNC_MAX_WAITING', 200),
+            wait_timeout=getattr(settings, 'PRACTICE_SANDBOX_WAIT_TIMEOUT', 2),
+        )
+    return _gates[loop]
+
+
+@asynccontextmanager
+async def problem_connection(problem):
+    """
+    Yield an asyncpg connection inside a read-only transaction pinned to the
+    problem's pre-built schema, with its ExecutionPolicy applied.
+    """
+    policy = execution_policy(problem)
+    config = policy.settings()
+    config.update(prebuilt_settings(problem))
+    args = [item for name_value in config.items() for item in name_value]
+    placeholders = ", ".join(f"set_config(${i}, ${i + 1}, true)" for i in range(1, len(args), 2))
+
+    started = time.perf_counter()
+    alias = read_alias()
+    try:
+        pool = await get_pool(alias)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        if alias == sandbox_alias():
+            raise
+        # The read replica can't be reached: use the primary until it's back (see routers.py)
+        mark_unavailable(alias, e)
+        alias = sandbox_alias()
+        pool = await get_pool(alias)
+    try:
+        async with get_gate().slot(), pool.acquire() as conn, conn.transaction():
+            record_phase('acquire', time.perf_counter() - started)
+            with phase('schema_setup'):
+                await conn.execute(f"SELECT {placeholders}", *args)
+            yield conn
+    except asyncpg.PostgresError as e:
+        error = limit_error(e.sqlstate, policy)
+        if error is None:
+            raise
+        raise error from e
+    except OSError as e:
+        if alias != sandbox_alias():
+            mark_unavailable(alias, e)
+        raise
+
+
+async def run_query_async(problem, user_query, offset=0):
+    """Async `execution.run_query`: one page of the user's result."""
+    builder = PageBuilder(offset)
+    async with problem_connection(problem) as conn:
+        started = time.perf_counter()
+        with phase('user_query'):
+            statement = await conn.prepare(user_query)
+            cursor = await statement.cursor()
+            if offset:
+                await cursor.forward(offset)
+            while builder.wanted():
+                rows = await cursor.fetch(builder.wanted())
+                if not rows:
+                    break
+                builder.add([tuple(row) for row in rows])
+            # Bounded, like execution.fetch_page
+            rows_after = await cursor.forward(count_rows_limit() + 1) if count_total_rows() else None
+            columns = [attribute.name for attribute in statement.get_attributes()]
+            page = builder.finish(columns, rows_after)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if explain_runs():
+            with phase('explain'):
+                page.stats = await _explain(conn, user_query, elapsed_ms)
+        else:
+            page.stats = QueryStats(elapsed_ms=round(elapsed_ms, 2), rows=page.row_count)
+    log_query_stats(problem, 'run', page.stats, user_query)
+    return page
+
+
+async def _explain(conn, user_query, elapsed_ms=0.0):
+    return stats_from_explain(await conn.fetchval(EXPLAIN_PREFIX + single_statement(user_query)), elapsed_ms)
+
+
+async def explain_query_async(problem, user_query):
+    """Async `execution.explain_query`."""
+    async with problem_connection(problem) as conn:
+        started = time.perf_counter()
+        with phase('explain'):
+            stats = await _explain(conn, user_query)
+        stats.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    log_query_stats(problem, 'explain', stats, user_query)
+    return stats
+
+
+async def grade_query_async(problem, user_query):
+    """
+    Async `execution.grade_query` against the stored expected result. Returns None
+    when there is no usable stored result (the caller then grades synchronously).
+    """
+    solution = problem.solution
+    with phase('load_expected'):
+        expected_result = load_expected_result(solution)
+    if expected_result is None:
+        return None
+
+    options = compare_options(solution)
+    matcher = ExpectedMatcher(expected_result, options, keep_rows=result_page_size())
+    async with problem_connection(problem) as conn:
+        with phase('user_query'):
+            statement = await conn.prepare(user_query)
+            cursor = await statement.cursor()
+        with phase('compare'):
+            while True:
+                rows = await cursor.fetch(options.batch_size)
+                if not rows or not matcher.feed([tuple(row) for row in rows]):
+                    break
+        comparison = matcher.finish([attribute.name for attribute in statement.get_attributes()])
+        if not comparison.correct and diff_max_rows():
+            with phase('diff'):
+                comparison.diff = await _diff(conn, user_query, solution, comparison, options, expected_result)
+    return comparison, comparison_page(comparison)
+
+
+async def _diff(conn, user_query, solution, comparison, options, expected):
+    """Async `execution.diff_with_solution`."""
+    diff = column_diff(comparison, expected.columns, options)
+    if diff is not None or not comparison.complete:
+        return diff
+    differ = RowDiffer(comparison, options, expected)
+    try:
+        # A savepoint, so a failure (e.g. a timeout) doesn't abort the surrounding transaction
+        async with conn.transaction():
+            solution_statement = await conn.prepare(solution.query)
+            user_statement = await conn.prepare(user_query)
+            solution_cursor, user_cursor = await solution_statement.cursor(), await user_statement.cursor()
+            while True:
+                solution_rows = await solution_cursor.fetch(options.batch_size)
+                user_rows = await user_cursor.fetch(options.batch_size)
+                if not solution_rows and not user_rows:
+                    break
+                differ.feed_expected([tuple(row) for row in solution_rows])
+                differ.feed_actual([tuple(row) for row in user_rows])
+    except (asyncpg.PostgresError, asyncpg.InterfaceError):
+        return None
+    return differ.finish(
+        [attribute.name for attribute in solution_statement.get_attributes()],
+        [attribute.name for attribute in user_statement.get_attributes()],
+    )
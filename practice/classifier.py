@@ -0,0 +1,196 @@
+# practice/classifier.py
+#
+# Deciding, before any database round-trip, whether a user query may run.
+#
+# The query is split into tokens (words, quoted strings and identifiers,
+# dollar-quoted bodies, nested /* */ comments, ...) so keywords inside literals
+# and comments are never mistaken for SQL. A query is allowed when it is:
+#
+#   - a single statement (a trailing ; is fine),
+#   - starting with SELECT or WITH (after any comments and parentheses),
+#   - without a data-modifying statement anywhere, e.g. WITH x AS (DELETE ...)
+#     or WITH x AS (...) DELETE ...,
+#   - without SELECT ... INTO (which creates a table) or FOR UPDATE/SHARE,
+#   - calling none of UNSAFE_FUNCTIONS (session settings, sequences, locks,
+#     server files, other backends, ...).
+#
+# Everything allowed is therefore read-only, and may run on a read replica
+# (see routers.py). The READ ONLY sandbox transaction stays the real guard;
+# this only turns bad queries away early, with a clear message.
+#
+# Verdicts are kept in an in-process LRU cache keyed by a hash of the query
+# (PRACTICE_SQL_CLASSIFIER_CACHE_SIZE entries), since the same queries are
+# classified over and over (every Run, then Submit).
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .metrics import Counter
+
+CLASSIFIER_CACHE = Counter(
+    'practice_sql_classifier_cache_total', "SQL classifier cache lookups, by outcome (hit, miss).", ['result'])
+
+SELECT_ONLY_MESSAGE = "Only SELECT queries (including those starting with WITH) are allowed."
+
+READ_STATEMENTS = {'select', 'with'}
+DATA_MODIFYING = {'insert', 'update', 'delete', 'merge'}
+UNSAFE_FUNCTIONS = {
+    'set_config', 'nextval', 'setval', 'txid_current', 'pg_current_xact_id', 'pg_notify',
+    'pg_advisory_lock', 'pg_advisory_lock_shared', 'pg_advisory_xact_lock', 'pg_advisory_xact_lock_shared',
+    'pg_try_advisory_lock', 'pg_try_advisory_lock_shared', 'pg_try_advisory_xact_lock',
+    'pg_try_advisory_xact_lock_shared', 'pg_cancel_backend', 'pg_terminate_backend', 'pg_reload_conf',
+    'pg_rotate_logfile', 'pg_switch_wal', 'pg_create_restore_point', 'pg_read_file', 'pg_read_binary_file',
+    'pg_ls_dir', 'pg_stat_file', 'lo_import', 'lo_export', 'lo_unlink', 'lo_create', 'lo_from_bytea',
+    'lo_put', 'dblink', 'dblink_exec', 'dblink_connect', 'load_extension',
+    # These run the SQL in their string argument
+    'query_to_xml', 'query_to_xml_and_xmlschema', 'query_to_xmlschema', 'cursor_to_xml', 'cursor_to_xmlschema',
+}
+
+_TOKEN = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*)
+    | (?P<string>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*')
+    | (?P<ident>"(?:[^"]|"")*")
+    | (?P<dollar>(?P<tag>\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$).*?(?P=tag))
+    | (?P<word>[^\W\d][\w$]*)
+    | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+    | (?P<param>\$\d+)
+    | (?P<punct>::|[(),;\[\].])
+    | (?P<op>[-+*/<>=~!@#%^&|`?:]+)
+""", re.VERBOSE | re.DOTALL)
+
+
+class TokenizeError(ValueError):
+    pass
+
+
+def tokenize(sql):
+    """Yield (kind, text) for every token of `sql`, comments and whitespace included."""
+    position = 0
+    while position < len(sql):
+        if sql.startswith('/*', position):
+            # Block comments nest in Postgres
+            depth, end = 0, position
+            while end < len(sql):
+                if sql.startswith('/*', end):
+                    depth, end = depth + 1, end + 2
+                elif sql.startswith('*/', end):
+                    depth, end = depth - 1, end + 2
+                    if not depth:
+                        break
+                else:
+                    end += 1
+            if depth:
+                raise TokenizeError("The query has an unterminated /* comment.")
+            yield 'comment', sql[position:end]
+            position = end
+            continue
+        match = _TOKEN.match(sql, position)
+        if match is None:
+            raise TokenizeError(f"The query has an unterminated quoted string or identifier (at character {position + 1}).")
+        yield match.lastgroup if match.lastgroup != 'tag' else 'dollar', match.group()
+        position = match.end()
+
+
+@dataclass(frozen=True)
+class Classification:
+    allowed: bool
+    reason: str = ''            # why not, for the user
+    statement: str = ''         # the leading keyword: select, with, ...
+
+    @property
+    def read_only(self):
+        """Safe to run on a read replica."""
+        return self.allowed
+
+
+def _rejected(reason, statement=''):
+    return Classification(False, reason, statement)
+
+
+def classify_sql(sql):
+    """Classify `sql` (uncached; see `classify`)."""
+    try:
+        tokens = [(kind, text) for kind, text in tokenize(sql) if kind not in ('space', 'comment')]
+    except TokenizeError as e:
+        return _rejected(str(e))
+    # One statement, optionally followed by semicolons
+    while tokens and tokens[-1] == ('punct', ';'):
+        tokens.pop()
+    if not tokens:
+        return _rejected("Cannot execute an empty query.")
+    if ('punct', ';') in tokens:
+        return _rejected("Only one statement can be run at a time.")
+
+    first = next((text.lower() for kind, text in tokens if kind != 'punct' or text != '('), '')
+    if first not in READ_STATEMENTS:
+        return _rejected(SELECT_ONLY_MESSAGE, first)
+
+    words = [(kind, text.lower() if kind == 'word' else text) for kind, text in tokens]
+    for index, (kind, text) in enumerate(words):
+        previous = words[index - 1][1] if index else ''
+        following = words[index + 1][1] if index + 1 < len(words) else ''
+        if kind == 'ident':
+            # A quoted name is only looked at as a function name
+            text = text[1:-1].replace('""', '"')
+            if following == '(' and text in UNSAFE_FUNCTIONS:
+                return _rejected(f"The function {text}() is not allowed.", first)
+            continue
+        if kind != 'word':
+            continue
+        # A statement head: inside a CTE's parentheses, or after the last CTE's closing one
+        if text in DATA_MODIFYING and previous in ('(', ')'):
+            return _rejected("Data-modifying statements (INSERT, UPDATE, DELETE, MERGE) are not allowed, "
+                             "including inside WITH.", first)
+        if text == 'into':
+            return _rejected("SELECT ... INTO (which creates a table) is not allowed.", first)
+        if text == 'for' and following in ('update', 'share', 'no', 'key'):
+            return _rejected("Locking clauses (FOR UPDATE / FOR SHARE) are not allowed.", first)
+        if following == '(' and text in UNSAFE_FUNCTIONS:
+            return _rejected(f"The function {text}() is not allowed.", first)
+    return Classification(True, statement=first)
+
+
+class ClassificationCache:
+    """In-process LRU of query hash -> Classification."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def classify(self, sql):
+        key = hashlib.blake2b(sql.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        with self._lock:
+            classification = self._entries.get(key)
+            if classification is not None:
+                self._entries.move_to_end(key)
+        if classification is not None:
+            CLASSIFIER_CACHE.inc(result='hit')
+            return classification
+        CLASSIFIER_CACHE.inc(result='miss')
+        classification = classify_sql(sql)
+        with self._lock:
+            self._entries[key] = classification
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return classification
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def classify(sql):
+    """The Classification of `sql`, from this process's cache when it was seen before."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ClassificationCache(getattr(settings, 'PRACTICE_SQL_CLASSIFIER_CACHE_SIZE', 4096))
+    return _cache.classify(sql)
@@ -0,0 +1,254 @@
+# practice/dataload.py
+#
+# Bulk data for problems with realistic table sizes.
+#
+# Next to its schema*.sql files, a problem folder may hold a `data/` folder:
+#
+#   data/<table>.csv     loaded with COPY ... (FORMAT csv, HEADER)
+#   data/<table>.tsv     the same, tab-separated
+#   data/<table>.json    a generator spec, loaded with one set-based
+#                        INSERT ... SELECT ... FROM generate_series(...)
+#
+# and indexes*.sql files, which run after all the data is in (one index build
+# over every row is much cheaper than maintaining the index row by row).
+#
+# All of this happens ONCE, when the problem's pre-built schema is built (see
+# sandbox.build_problem_schema), followed by ANALYZE, so the planner knows how
+# big the tables are from the very first Run. Without a pre-built schema
+# (PRACTICE_PREBUILT_SCHEMAS off, or a problem not built yet) such problems
+# can't be queried: sandbox.problem_cursor refuses them instead of reloading
+# their data on every request.
+#
+# A generator spec looks like:
+#
+#   {
+#     "rows": 1000000,
+#     "seed": 42,
+#     "columns": {
+#       "id":          {"type": "sequence"},
+#       "customer_id": {"type": "int", "min": 1, "max": 50000, "distribution": "skewed", "skew": 3},
+#       "amount":      {"type": "numeric", "min": 1, "max": 500, "distribution": "normal", "scale": 2},
+#       "order_date":  {"type": "date", "min": "2023-01-01", "max": "2023-12-31"},
+#       "status":      {"type": "choice", "values": ["paid", "refunded"], "weights": [95, 5]},
+#       "note":        {"type": "text", "prefix": "note ", "null_fraction": 0.8}
+#     }
+#   }
+#
+# Column types: sequence (start), int / numeric (scale) / float (min, max,
+# distribution), date / timestamp (min, max, distribution), choice (values,
+# weights), text (prefix, followed by the row number), bool (probability).
+# Distributions: uniform (default), normal (mean, stddev; clamped to min..max)
+# and skewed (power law towards min; skew, default 3). Every column may set a
+# null_fraction. The same spec and seed always give the same rows.
+
+import csv
+from pathlib import Path
+
+from django.conf import settings
+
+DATA_KIND_CSV = 'csv'
+DATA_KIND_TSV = 'tsv'
+DATA_KIND_GENERATOR = 'generator'
+
+DATA_KIND_CHOICES = [
+    (DATA_KIND_CSV, 'CSV file'),
+    (DATA_KIND_TSV, 'TSV file'),
+    (DATA_KIND_GENERATOR, 'Generator spec'),
+]
+
+# data/<table>.<extension> -> kind
+DATA_FILE_KINDS = {'.csv': DATA_KIND_CSV, '.tsv': DATA_KIND_TSV, '.json': DATA_KIND_GENERATOR}
+
+PROBLEMS_DIR = Path(__file__).resolve().parent / 'problems'
+
+DISTRIBUTIONS = ('uniform', 'normal', 'skewed')
+
+
+def quote_name(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_maintenance_work_mem():
+    """Memory for the one-off index builds after loading (a SET LOCAL while building)."""
+    return getattr(settings, 'PRACTICE_BUILD_MAINTENANCE_WORK_MEM', '256MB')
+
+
+# --- Generator specs -> one INSERT ... SELECT ---
+
+def _number(column, key, default=None):
+    value = column.get(key, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError(f"'{key}' must be a number")
+    return value
+
+
+def _fraction(column):
+    """SQL for a value in [0, 1) drawn from the column's distribution (uniform or skewed)."""
+    distribution = column.get('distribution', 'uniform')
+    if distribution == 'uniform':
+        return 'random()', []
+    if distribution == 'skewed':
+        return 'power(random(), %s)', [_number(column, 'skew', 3)]
+    raise ValueError(f"distribution '{distribution}' isn't supported for this type")
+
+
+def _numeric_column(column):
+    low, high = _number(column, 'min'), _number(column, 'max')
+    if low > high:
+        raise ValueError("min is greater than max")
+    kind = column['type']
+
+    if column.get('distribution') == 'normal':
+        mean = _number(column, 'mean', (low + high) / 2)
+        stddev = _number(column, 'stddev', (high - low) / 6)
+        # Box-Muller, clamped to min..max
+        value = ('greatest(%s, least(%s, %s + %s * sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random())))',
+                 [low, high, mean, stddev])
+        if kind == 'int':
+            return f'round({value[0]})::bigint', value[1]
+        if kind == 'numeric':
+            return f'round(({value[0]})::numeric, %s)', [*value[1], int(column.get('scale', 2))]
+        return value
+
+    fraction, params = _fraction(column)
+    if kind == 'int':
+        return f'(%s + floor({fraction} * %s))::bigint', [int(low), *params, int(high) - int(low) + 1]
+    if kind == 'numeric':
+        return f'round((%s + {fraction} * %s)::numeric, %s)', [low, *params, high - low, int(column.get('scale', 2))]
+    return f'(%s + {fraction} * %s)', [low, *params, high - low]
+
+
+def _time_column(column):
+    low, high = column.get('min'), column.get('max')
+    if not isinstance(low, str) or not isinstance(high, str):
+        raise ValueError("'min' and 'max' must be date/time strings")
+    fraction, params = _fraction(column)
+    if column['type'] == 'date':
+        return f'(%s::date + floor({fraction} * (%s::date - %s::date + 1))::int)', [low, *params, high, low]
+    return (f"date_trunc('second', %s::timestamp + {fraction} * (%s::timestamp - %s::timestamp))",
+            [low, *params, high, low])
+
+
+def _choice_column(column):
+    values = column.get('values')
+    if not isinstance(values, list) or not values:
+        raise ValueError("'values' must be a non-empty list")
+    weights = column.get('weights', [1] * len(values))
+    if (not isinstance(weights, list) or len(weights) != len(values)
+            or any(not isinstance(w, (int, float)) or w < 0 for w in weights) or not sum(weights)):
+        raise ValueError("'weights' must be one non-negative number per value")
+    # Lower bound of each value's slice of [0, 1); width_bucket() picks the slice random() falls in
+    bounds, total = [], 0
+    for weight in weights:
+        bounds.append(total / sum(weights))
+        total += weight
+    return '(%s)[width_bucket(random(), %s::float8[])]', [values, bounds]
+
+
+def _column_expression(name, column):
+    if not isinstance(column, dict):
+        raise ValueError("must be an object")
+    kind = column.get('type')
+    if kind == 'sequence':
+        expression = ('(g.n + %s)', [int(column.get('start', 1)) - 1])
+    elif kind in ('int', 'numeric', 'float'):
+        expression = _numeric_column(column)
+    elif kind in ('date', 'timestamp'):
+        expression = _time_column(column)
+    elif kind == 'choice':
+        expression = _choice_column(column)
+    elif kind == 'text':
+        expression = ('(%s || g.n)', [str(column.get('prefix', f'{name} '))])
+    elif kind == 'bool':
+        expression = ('(random() < %s)', [_number(column, 'probability', 0.5)])
+    else:
+        raise ValueError(f"unknown type '{kind}'")
+    if column.get('distribution', 'uniform') not in DISTRIBUTIONS:
+        raise ValueError(f"unknown distribution '{column['distribution']}'")
+
+    null_fraction = column.get('null_fraction')
+    if null_fraction:
+        sql, params = expression
+        return f'CASE WHEN random() < %s THEN NULL ELSE {sql} END', [_number(column, 'null_fraction'), *params]
+    return expression
+
+
+def generator_sql(table, spec):
+    """
+    The INSERT ... SELECT (and its parameters) producing the rows of a generator
+    spec. Raises ValueError for an invalid spec, so seed_problems can report it
+    before anything is written.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("the spec must be a JSON object")
+    rows = spec.get('rows')
+    if not isinstance(rows, int) or isinstance(rows, bool) or rows < 0:
+        raise ValueError("'rows' must be a non-negative integer")
+    columns = spec.get('columns')
+    if not isinstance(columns, dict) or not columns:
+        raise ValueError("'columns' must be a non-empty object")
+
+    expressions, params = [], []
+    for name, column in columns.items():
+        try:
+            sql, column_params = _column_expression(name, column)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"column '{name}': {e}") from e
+        expressions.append(sql)
+        params.extend(column_params)
+    sql = (
+        f"INSERT INTO {quote_name(table)} ({', '.join(map(quote_name, columns))}) "
+        f"SELECT {', '.join(expressions)} FROM generate_series(1, %s) AS g(n)"
+    )
+    return sql, [*params, rows]
+
+
+def seed_value(spec):
+    """setseed() takes a value in [-1, 1]."""
+    return (int(spec.get('seed', 0)) % 2**31) / 2**31
+
+
+# --- Loading ---
+
+def copy_file(cursor, table, path, kind):
+    """COPY a CSV/TSV file (with a header line naming the columns) into `table`."""
+    delimiter = '\t' if kind == DATA_KIND_TSV else ','
+    with open(path, encoding='utf-8', newline='') as data:
+        header = next(csv.reader(data, delimiter=delimiter), None)
+        if not header:
+            return
+        data.seek(0)
+        options = "FORMAT csv, HEADER true" + (", DELIMITER E'\\t'" if kind == DATA_KIND_TSV else '')
+        cursor.copy_expert(
+            f"COPY {quote_name(table)} ({', '.join(quote_name(name.strip()) for name in header)}) FROM STDIN WITH ({options})",
+            data,
+        )
+
+
+def generate_rows(cursor, table, spec):
+    sql, params = generator_sql(table, spec)
+    # A fixed seed, and no parallel workers (each would have its own random() sequence)
+    cursor.execute("SELECT setseed(%s), set_config('max_parallel_workers_per_gather', '0', true)", [seed_value(spec)])
+    cursor.execute(sql, params)
+
+
+def load_data_source(cursor, source):
+    if source.kind == DATA_KIND_GENERATOR:
+        generate_rows(cursor, source.table, source.spec)
+    else:
+        copy_file(cursor, source.table, PROBLEMS_DIR / source.path, source.kind)
+
+
+def load_problem_data(cursor, schemas, data_sources):
+    """
+    Fill the current search_path: the table scripts first, then the bulk data,
+    then the scripts that run after the data (indexes, constraints).
+    """
+    for schema in schemas:
+        if not schema.runs_after_data:
+            cursor.execute(schema.script.strip())
+    for source in data_sources:
+        load_data_source(cursor, source)
+    for schema in schemas:
+        if schema.runs_after_data:
+            cursor.execute(schema.script.strip())
@@ -0,0 +1,13 @@
+# practice/engines.py
+#
+# Where a problem's user queries run (Problem.engine). Kept out of models.py so
+# the execution modules can use them without importing the models: worker
+# processes import those modules before django.setup() (see workers.py).
+
+ENGINE_POSTGRES = 'postgres'
+ENGINE_SQLITE = 'sqlite'
+
+ENGINE_CHOICES = [
+    (ENGINE_POSTGRES, 'PostgreSQL'),
+    (ENGINE_SQLITE, 'SQLite (in-memory snapshot)'),
+]
@@ -0,0 +1,270 @@
+# practice/execution.py
+#
+# The two things a user can do with a query — Run it or Submit it — without any
+# HTTP in the way. Views call `run_query` / `grade_query` and only deal with
+# rendering their results.
+#
+# Results are always read through a server-side cursor and capped (rows AND
+# bytes), so a runaway `CROSS JOIN` never gets materialized in the web worker.
+# Further pages are fetched on demand by re-running the query and skipping ahead
+# with MOVE.
+#
+# Every Run also records what it cost (see stats.py).
+#
+# Problems with engine='sqlite' run on a private in-memory SQLite copy of their
+# data instead (see sqlite_engine.py).
+#
+# A wrong Submit also gets a row-level diff against the solution (see result_diff.py).
+
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from . import sqlite_engine
+from .grading import compare_cursors, compare_options, compare_with_expected, load_expected_result
+from .metrics import phase
+from .result_diff import column_diff, diff_cursors, diff_max_rows
+from .sandbox import problem_cursor, streaming_cursor
+from .stats import QueryStats, explain_analyze, explain_runs, log_query_stats
+
+
+def result_page_size():
+    return getattr(settings, 'PRACTICE_RESULT_PAGE_SIZE', 100)
+
+
+def result_byte_limit():
+    return getattr(settings, 'PRACTICE_RESULT_BYTE_LIMIT', 1024 * 1024)
+
+
+@dataclass
+class ResultPage:
+    """One page of a query's result, as shown under the editor."""
+    columns: list = field(default_factory=list)
+    rows: list = field(default_factory=list)
+    offset: int = 0
+    total_rows: Optional[int] = None    # None when the total wasn't counted
+    total_rows_capped: bool = False     # counting stopped early: there are more than total_rows rows
+    has_more: bool = False
+    byte_limited: bool = False          # the page was cut short by PRACTICE_RESULT_BYTE_LIMIT
+    stats: Optional[QueryStats] = None
+    cached: bool = False                # served from the result cache (see result_cache.py)
+
+    @property
+    def row_count(self):
+        """The exact number of rows of the result, or None if it isn't known."""
+        return None if self.total_rows_capped else self.total_rows
+
+    @property
+    def first_row(self):
+        return self.offset + 1 if self.rows else self.offset
+
+    @property
+    def last_row(self):
+        return self.offset + len(self.rows)
+
+    @property
+    def next_offset(self):
+        return self.last_row
+
+    @property
+    def previous_offset(self):
+        return max(self.offset - result_page_size(), 0)
+
+
+def approximate_row_size(row):
+    return sum(len(str(value)) for value in row)
+
+
+class PageBuilder:
+    """
+    Collects one ResultPage from batches of rows, whatever driver they come from.
+    Ask `wanted()` how many rows to fetch next (0 = the page is full).
+    """
+
+    def __init__(self, offset=0, page_size=None, byte_limit=None):
+        self.page_size = page_size or result_page_size()
+        self.byte_limit = byte_limit or result_byte_limit()
+        self.page = ResultPage(offset=offset)
+        self.fetched = 0
+        self.page_bytes = 0
+
+    def wanted(self):
+        if self.page.byte_limited:
+            return 0
+        return min(self.page_size - self.fetched, 50)
+
+    def add(self, rows):
+        page = self.page
+        self.fetched += len(rows)
+        for row in rows:
+            self.page_bytes += approximate_row_size(row)
+            if self.page_bytes > self.byte_limit and page.rows:
+                page.byte_limited = True
+                break
+            page.rows.append(row)
+
+    def finish(self, columns, rows_after=None):
+        """
+        `rows_after` is how many rows follow the page, or None if they weren't
+        counted. Count at most count_rows_limit() + 1 of them: more than the
+        limit is shown as "more than <limit>".
+        """
+        page = self.page
+        page.columns = columns
+        if rows_after is not None:
+            limit = count_rows_limit()
+            page.total_rows_capped = rows_after > limit
+            page.total_rows = page.offset + self.fetched + min(max(rows_after, 0), limit)
+            page.has_more = page.total_rows_capped or page.last_row < page.total_rows
+        else:
+            page.has_more = page.byte_limited or self.fetched == self.page_size
+        return page
+
+
+def count_total_rows():
+    return getattr(settings, 'PRACTICE_COUNT_TOTAL_ROWS', True)
+
+
+def count_rows_limit():
+    return getattr(settings, 'PRACTICE_COUNT_ROWS_LIMIT', 100_000)
+
+
+def fetch_page(cursor, stream, offset=0, page_size=None, byte_limit=None):
+    """
+    Read one page from the server-side cursor `stream`, starting `offset` rows in.
+    `cursor` is the plain cursor of the same transaction, used to count the rows
+    left after the page (up to count_rows_limit()) without transferring them.
+    """
+    builder = PageBuilder(offset, page_size, byte_limit)
+
+    with cursor.db.wrap_database_errors:
+        if offset:
+            stream.scroll(offset)
+
+    while builder.wanted():
+        rows = stream.fetchmany(builder.wanted())
+        if not rows:
+            break
+        builder.add(rows)
+
+    columns = [col[0] for col in stream.description] if stream.description else []
+
+    rows_after = None
+    if count_total_rows():
+        # Bounded: counting a huge result would run into the statement timeout
+        cursor.execute(f"MOVE FORWARD {count_rows_limit() + 1} IN {cursor.db.ops.quote_name(stream.name)}")
+        rows_after = cursor.rowcount
+    return builder.finish(columns, rows_after)
+
+
+def run_query(problem, user_query, offset=0):
+    """Run a user's query against the problem's data and return one page of it."""
+    if sqlite_engine.sqlite_supported(problem):
+        with phase('user_query'):
+            page = sqlite_engine.run_query(problem, user_query, offset)
+        log_query_stats(problem, 'run', page.stats, user_query)
+        return page
+
+    with problem_cursor(problem) as cursor, streaming_cursor(cursor) as stream:
+        started = time.perf_counter()
+        with phase('user_query'):
+            stream.execute(user_query)
+            page = fetch_page(cursor, stream, offset)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if explain_runs():
+            with phase('explain'):
+                page.stats = explain_analyze(cursor, user_query, elapsed_ms)
+        else:
+            page.stats = QueryStats(elapsed_ms=round(elapsed_ms, 2), rows=page.row_count)
+    log_query_stats(problem, 'run', page.stats, user_query)
+    return page
+
+
+def explain_query(problem, user_query):
+    """EXPLAIN ANALYZE a user's query against the problem's data. Returns its QueryStats."""
+    if sqlite_engine.sqlite_supported(problem):
+        with phase('explain'):
+            stats = sqlite_engine.explain_query(problem, user_query)
+    else:
+        with problem_cursor(problem) as cursor:
+            started = time.perf_counter()
+            with phase('explain'):
+                stats = explain_analyze(cursor, user_query)
+            stats.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    log_query_stats(problem, 'explain', stats, user_query)
+    return stats
+
+
+def grade_query(problem, user_query):
+    """
+    Compare a user's query with the problem's solution. Returns the Comparison and
+    a ResultPage holding the first page of the user's rows.
+    """
+    if sqlite_engine.sqlite_supported(problem):
+        with phase('compare'):
+            return sqlite_engine.grade_query(problem, user_query)
+
+    solution = problem.solution
+    options = compare_options(solution)
+    # The solution's result is normally precomputed at seed time (see grading.py)
+    with phase('load_expected'):
+        expected_result = load_expected_result(solution)
+    keep_rows = result_page_size()
+
+    # Rows are only fetched while comparing, so most of the query time lands in 'compare'
+    with problem_cursor(problem) as cursor, streaming_cursor(cursor) as user_cursor:
+        with phase('user_query'):
+            user_cursor.execute(user_query)
+        if expected_result is not None:
+            with phase('compare'):
+                comparison = compare_with_expected(user_cursor, expected_result, options, keep_rows=keep_rows)
+        else:
+            # No stored result yet: stream the official solution query alongside
+            with streaming_cursor(cursor) as solution_cursor:
+                with phase('solution_query'):
+                    solution_cursor.execute(solution.query)
+                with phase('compare'):
+                    comparison = compare_cursors(user_cursor, solution_cursor, options, keep_rows=keep_rows)
+
+        if not comparison.correct and diff_max_rows():
+            with phase('diff'):
+                comparison.diff = diff_with_solution(cursor, user_query, solution, comparison, options, expected_result)
+
+    return comparison, comparison_page(comparison)
+
+
+def diff_with_solution(cursor, user_query, solution, comparison, options, expected=None):
+    """
+    The row-level diff of a wrong submission: re-runs both queries on `cursor`'s
+    transaction. Returns None if that fails (the verdict stands either way), or
+    if grading stopped reading early.
+    """
+    if expected is not None:
+        diff = column_diff(comparison, expected.columns, options)
+        if diff is not None:
+            return diff
+    if not comparison.complete:
+        # Grading stopped early (far too many rows, an out-of-order row): diffing
+        # would read both results in full, which could take far longer
+        return None
+    try:
+        # A savepoint, so a failure (e.g. a timeout) doesn't abort the surrounding transaction
+        with transaction.atomic(using=cursor.db.alias), \
+                streaming_cursor(cursor) as user_cursor, streaming_cursor(cursor) as solution_cursor:
+            solution_cursor.execute(solution.query)
+            user_cursor.execute(user_query)
+            return diff_cursors(user_cursor, solution_cursor, comparison, options, expected)
+    except DatabaseError:
+        return None
+
+
+def comparison_page(comparison):
+    """The user's rows kept by a Comparison, as a (single) ResultPage."""
+    return ResultPage(
+        columns=comparison.columns,
+        rows=comparison.rows,
+        total_rows=comparison.row_count if comparison.complete else None,
+    )
@@ -0,0 +1,334 @@
+# practice/export.py
+#
+# Downloading a query's whole result (POST /api/problems/<id>/export), as CSV or
+# newline-delimited JSON, optionally gzipped.
+#
+# The query is executed again through a server-side cursor (asyncpg under ASGI,
+# psycopg2 otherwise, or the problem's SQLite snapshot) and its rows are encoded
+# and sent FETCH_SIZE at a time, in CHUNK_BYTES chunks, so memory use doesn't
+# depend on the size of the result. A result the result cache (see
+# result_cache.py) already holds in full is sent from there without touching the
+# database. At most PRACTICE_EXPORT_MAX_ROWS rows are exported.
+#
+# The cursor holds a sandbox slot and a transaction until the export ends. The
+# response closes it when it is done, whether every row was sent, the client
+# went away halfway, or streaming never started (see closing_chunks).
+#
+# Values are written the same way in both formats:
+#   NULL                    CSV: an empty, unquoted field (an empty string is "")
+#                           JSON: null
+#   numeric                 every digit, never through a float (JSON: a number)
+#   timestamp/date/time     ISO 8601 (with the UTC offset for timestamptz)
+#   boolean                 true / false
+#   bytea                   \x followed by hex digits, like Postgres prints it
+#   arrays, json            JSON
+
+import json
+import math
+import sys
+import zlib
+from contextlib import AsyncExitStack, ExitStack
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+from .async_sandbox import problem_connection
+from .sandbox import problem_cursor, streaming_cursor
+from .sqlite_engine import get_snapshot, sqlite_connection, sqlite_supported
+
+EXPORT_CSV = 'csv'
+EXPORT_NDJSON = 'ndjson'
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    EXPORT_CSV: ('text/csv; charset=utf-8', 'csv'),
+    EXPORT_NDJSON: ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+
+# Rows per FETCH, and bytes per chunk sent to the client
+FETCH_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+
+
+def export_max_rows():
+    return getattr(settings, 'PRACTICE_EXPORT_MAX_ROWS', 1_000_000)
+
+
+# --- Encoding values ---
+
+def _json_safe(value):
+    """Arrays / json values with Decimals, timestamps, ... in them, for json.dumps."""
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _json_safe(item) for key, item in value.items()}
+    if isinstance(value, Decimal):
+        return float(value) if value.is_finite() else str(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return text_value(value)
+
+
+def text_value(value):
+    """A non-NULL value as text (CSV fields, and JSON values that are strings)."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, Decimal):
+        return format(value, 'f') if value.is_finite() else str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(_json_safe(value), ensure_ascii=False)
+    return str(value)
+
+
+def json_value(value):
+    """A value as JSON text. Numerics are written digit for digit."""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else json.dumps(str(value))
+    if isinstance(value, Decimal):
+        return format(value, 'f') if value.is_finite() else json.dumps(str(value))
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(json_value(item) for item in value) + ']'
+    if isinstance(value, dict):
+        return json.dumps(_json_safe(value), ensure_ascii=False)
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    return json.dumps(text_value(value), ensure_ascii=False)
+
+
+def csv_field(value):
+    """One CSV field; like Postgres' COPY ... CSV, NULL is the only unquoted empty field."""
+    if value is None:
+        return ''
+    text = text_value(value)
+    if not text or any(char in text for char in ',"\r\n') or text[0].isspace() or text[-1].isspace():
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+class CsvEncoder:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def header(self):
+        return ','.join(csv_field(str(column)) for column in self.columns) + '\n'
+
+    def rows(self, rows):
+        return ''.join(','.join(csv_field(value) for value in row) + '\n' for row in rows)
+
+
+class NdjsonEncoder:
+    """One JSON object per row. Repeated column names get a suffix (a, a_2, ...)."""
+
+    def __init__(self, columns):
+        keys, seen = [], {}
+        for column in columns:
+            name = str(column)
+            seen[name] = seen.get(name, 0) + 1
+            keys.append(json.dumps(name if seen[name] == 1 else f"{name}_{seen[name]}", ensure_ascii=False) + ':')
+        self.keys = keys
+
+    def header(self):
+        return ''
+
+    def rows(self, rows):
+        return ''.join(
+            '{' + ','.join(key + json_value(value) for key, value in zip(self.keys, row)) + '}\n' for row in rows
+        )
+
+
+ENCODERS = {EXPORT_CSV: CsvEncoder, EXPORT_NDJSON: NdjsonEncoder}
+
+
+class ChunkWriter:
+    """Collects encoded text into CHUNK_BYTES chunks of bytes, gzipped if asked to."""
+
+    def __init__(self, compress):
+        # wbits=31: a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text):
+        """Returns a chunk to send once enough has been written, else None."""
+        if text:
+            data = text.encode('utf-8')
+            if self.compressor:
+                data = self.compressor.compress(data)
+            self.buffer.append(data)
+            self.size += len(data)
+        if self.size >= CHUNK_BYTES:
+            return self._take()
+        return None
+
+    def finish(self):
+        if self.compressor:
+            self.buffer.append(self.compressor.flush())
+        return self._take()
+
+    def _take(self):
+        chunk = b''.join(self.buffer)
+        self.buffer, self.size = [], 0
+        return chunk
+
+
+def encode(columns, batches, fmt, compress):
+    """Bytes chunks of the export of `batches` (lists of rows)."""
+    encoder = ENCODERS[fmt](columns)
+    writer = ChunkWriter(compress)
+    writer.write(encoder.header())
+    try:
+        for rows in batches:
+            chunk = writer.write(encoder.rows(rows))
+            if chunk:
+                yield chunk
+    finally:
+        # Closed early (the client went away): release the cursor now, in this thread
+        if hasattr(batches, 'close'):
+            batches.close()
+    chunk = writer.finish()
+    if chunk:
+        yield chunk
+
+
+async def aencode(columns, batches, fmt, compress):
+    """`encode` for an async iterator of batches."""
+    encoder = ENCODERS[fmt](columns)
+    writer = ChunkWriter(compress)
+    writer.write(encoder.header())
+    try:
+        async for rows in batches:
+            chunk = writer.write(encoder.rows(rows))
+            if chunk:
+                yield chunk
+    finally:
+        await batches.aclose()
+    chunk = writer.finish()
+    if chunk:
+        yield chunk
+
+
+# --- Reading the result ---
+
+def _capped(rows, exported):
+    return rows[:max(export_max_rows() - exported, 0)]
+
+
+def open_result(problem, user_query):
+    """
+    Execute `user_query` and read its first batch, so errors surface before the
+    response starts. Returns (columns, iterator of row batches, close). The
+    cursor (and its sandbox slot) stays open until the iterator is exhausted or
+    `close()` is called, which may be before iterating at all. Both must happen
+    in this same thread.
+    """
+    stack = ExitStack()
+    try:
+        if sqlite_supported(problem):
+            conn = stack.enter_context(sqlite_connection(problem, get_snapshot(problem).image))
+            cursor = conn.execute(user_query)
+        else:
+            cursor = stack.enter_context(streaming_cursor(stack.enter_context(problem_cursor(problem))))
+            cursor.execute(user_query)
+        first = cursor.fetchmany(FETCH_SIZE)
+        # Server-side cursors only have a description after the first fetch
+        columns = [col[0] for col in cursor.description or []]
+    except BaseException:
+        # Let the context managers see (and translate) the error
+        if not stack.__exit__(*sys.exc_info()):
+            raise
+        raise
+
+    def batches():
+        try:
+            rows, exported = first, 0
+            while rows:
+                rows = _capped(rows, exported)
+                if not rows:
+                    break
+                exported += len(rows)
+                yield rows
+                rows = cursor.fetchmany(FETCH_SIZE)
+        except BaseException:
+            if not stack.__exit__(*sys.exc_info()):
+                raise
+        else:
+            stack.close()
+
+    return columns, batches(), stack.close
+
+
+async def open_result_async(problem, user_query):
+    """
+    `open_result` on asyncpg (problems with a pre-built schema, under ASGI).
+    `close()` is synchronous, for StreamingHttpResponse, and must be called
+    from a worker thread (sync_to_async), not the event loop.
+    """
+    stack = AsyncExitStack()
+    try:
+        conn = await stack.enter_async_context(problem_connection(problem))
+        statement = await conn.prepare(user_query)
+        cursor = await statement.cursor()
+        first = [tuple(row) for row in await cursor.fetch(FETCH_SIZE)]
+        columns = [attribute.name for attribute in statement.get_attributes()]
+    except BaseException:
+        if not await stack.__aexit__(*sys.exc_info()):
+            raise
+        raise
+
+    async def batches():
+        try:
+            rows, exported = first, 0
+            while rows:
+                rows = _capped(rows, exported)
+                if not rows:
+                    break
+                exported += len(rows)
+                yield rows
+                rows = [tuple(row) for row in await cursor.fetch(FETCH_SIZE)]
+        except BaseException:
+            if not await stack.__aexit__(*sys.exc_info()):
+                raise
+        else:
+            await stack.aclose()
+
+    return columns, batches(), async_to_sync(stack.aclose)
+
+
+class _ClosingChunks:
+    def __init__(self, chunks, close):
+        self.chunks = chunks
+        self.close = close
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class _AsyncClosingChunks(_ClosingChunks):
+    __iter__ = None
+
+    def __aiter__(self):
+        return aiter(self.chunks)
+
+
+def closing_chunks(chunks, close):
+    """
+    `chunks` (an iterator or async iterator) for StreamingHttpResponse, which
+    calls `close()` once the response is over, sent in full or not.
+    """
+    return (_AsyncClosingChunks if hasattr(chunks, '__aiter__') else _ClosingChunks)(chunks, close)
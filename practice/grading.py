@@ -0,0 +1,351 @@
+# practice/grading.py
+#
+# Grading compares a user's result set against the solution's.
+#
+# Instead of keeping both result sets around and sorting them, every row is
+# reduced to a 64-bit hash of its canonical form. The SUM of those hashes is an
+# order-independent fingerprint of the whole result (a multiset hash), so two
+# results match when they have the same row count and the same fingerprint.
+# A second, chained hash covers problems where row order matters.
+#
+# Rows are pulled from server-side cursors in `fetchmany` batches, so memory use
+# stays flat no matter how many rows either query returns, and comparison stops
+# at the first row-count (or, for ordered problems, row) mismatch.
+#
+# The solution's fingerprint is computed once, when the problem is seeded or
+# edited in the admin, and stored on the Solution row (`expected_result`).
+#
+# Rows are also spread over DIFF_BUCKETS buckets by hash, each with its own count
+# and fingerprint. When a submission is wrong, the buckets that differ tell
+# result_diff.py which rows to look at, so the row-level diff never has to hold
+# either result set in memory.
+
+import hashlib
+import json
+import zlib
+from dataclasses import asdict, dataclass, field, fields
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, localcontext
+from typing import Optional
+
+from .sandbox import problem_cursor, streaming_cursor
+
+HASH_MODULUS = 2 ** 64
+DIFF_BUCKETS = 256
+
+
+@dataclass(frozen=True)
+class CompareOptions:
+    ordered: bool = False                 # rows must come back in the solution's order
+    float_digits: Optional[int] = None    # round numbers to this many decimal places before comparing
+    check_column_names: bool = False      # column names must match the solution's
+    batch_size: int = 1000                # rows per fetchmany() round-trip
+
+
+def compare_options(solution):
+    return CompareOptions(
+        ordered=solution.ordered,
+        float_digits=solution.float_digits,
+        check_column_names=solution.check_column_names,
+    )
+
+
+def canonical_value(value, float_digits=None):
+    """
+    Map a database value to a JSON-friendly, type-tagged form, so equal values
+    hash equally no matter which Python type the driver returned
+    (e.g. 100.5, Decimal('100.50') and Decimal('100.500') are all "n:100.5").
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return f"b:{int(value)}"
+    if isinstance(value, (int, float, Decimal)):
+        number = Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+        if not number.is_finite():
+            return f"n:{number}"
+        # Enough precision for every digit (the default 28 would round large
+        # numerics, and make quantize raise InvalidOperation)
+        with localcontext() as context:
+            context.prec = max(context.prec, len(number.as_tuple().digits), number.adjusted() + 1 + (float_digits or 0))
+            if float_digits is not None:
+                number = number.quantize(Decimal(1).scaleb(-float_digits))
+            number = number.normalize()
+        return "n:0" if number.is_zero() else f"n:{number:f}"
+    if isinstance(value, (datetime, date, time)):
+        return f"t:{value.isoformat()}"
+    if isinstance(value, timedelta):
+        return f"i:{value.total_seconds()!r}"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"x:{bytes(value).hex()}"
+    if isinstance(value, (list, tuple)):
+        return [canonical_value(item, float_digits) for item in value]
+    if _is_range(value):
+        # psycopg2.extras.Range and asyncpg.Range have the same attributes
+        if value.isempty:
+            return "r:empty"
+        bounds = ('[' if value.lower_inc else '(') + (']' if value.upper_inc else ')')
+        return [f"r:{bounds}", canonical_value(value.lower, float_digits), canonical_value(value.upper, float_digits)]
+    return f"s:{value}"
+
+
+def _is_range(value):
+    return all(hasattr(value, name) for name in ('lower', 'upper', 'lower_inc', 'upper_inc', 'isempty'))
+
+
+def row_hash(row, float_digits=None):
+    payload = json.dumps([canonical_value(value, float_digits) for value in row], separators=(',', ':'), default=str)
+    return int.from_bytes(hashlib.blake2b(payload.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def iter_batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def describe(cursor):
+    """The result's column names."""
+    return [col[0] for col in cursor.description or []]
+
+
+@dataclass
+class ResultSummary:
+    """Everything grading needs to know about a result set, without the rows."""
+    columns: list
+    row_count: int
+    fingerprint: int
+    ordered_fingerprint: int = 0
+    # What the summary was computed against; used to detect stale stored results
+    data_schema: str = ''
+    query_hash: str = ''
+    float_digits: Optional[int] = None
+    # Row count and fingerprint per hash bucket (empty in results stored before buckets existed)
+    bucket_counts: list = field(default_factory=list)
+    bucket_sums: list = field(default_factory=list)
+
+    def to_bytes(self):
+        return zlib.compress(json.dumps(asdict(self), separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data):
+        stored = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+        # A result stored by another version of this code may hold fields this one doesn't know
+        names = {item.name for item in fields(cls)}
+        return cls(**{name: value for name, value in stored.items() if name in names})
+
+
+class Fingerprinter:
+    """Accumulates a ResultSummary one row at a time, in constant memory."""
+
+    def __init__(self, options):
+        self.options = options
+        self.row_count = 0
+        self.fingerprint = 0
+        self._ordered = hashlib.blake2b(digest_size=8)
+        self.bucket_counts = [0] * DIFF_BUCKETS
+        self.bucket_sums = [0] * DIFF_BUCKETS
+
+    def add(self, row):
+        digest = row_hash(row, self.options.float_digits)
+        self.row_count += 1
+        self.fingerprint = (self.fingerprint + digest) % HASH_MODULUS
+        self._ordered.update(digest.to_bytes(8, 'big'))
+        bucket = digest % DIFF_BUCKETS
+        self.bucket_counts[bucket] += 1
+        self.bucket_sums[bucket] += digest
+        return digest
+
+    def summary(self, columns):
+        return ResultSummary(
+            columns=columns,
+            row_count=self.row_count,
+            fingerprint=self.fingerprint,
+            ordered_fingerprint=int.from_bytes(self._ordered.digest(), 'big'),
+            float_digits=self.options.float_digits,
+            bucket_counts=list(self.bucket_counts),
+            bucket_sums=[total % HASH_MODULUS for total in self.bucket_sums],
+        )
+
+
+def differing_buckets(actual, expected):
+    """The hash buckets where two ResultSummaries differ, or None if either has no buckets."""
+    if not actual.bucket_counts or not expected.bucket_counts:
+        return None
+    return [
+        bucket for bucket in range(DIFF_BUCKETS)
+        if actual.bucket_counts[bucket] != expected.bucket_counts[bucket]
+        or actual.bucket_sums[bucket] != expected.bucket_sums[bucket]
+    ]
+
+
+@dataclass
+class Comparison:
+    correct: bool
+    reason: str = ''
+    columns: list = field(default_factory=list)
+    rows: list = field(default_factory=list)    # the first `keep_rows` user rows, for display
+    row_count: int = 0                          # user rows read
+    complete: bool = True                       # False if reading stopped early on a mismatch
+    differing_buckets: Optional[list] = None    # hash buckets that differ, when every row was read
+    diff: Optional[object] = None               # result_diff.ResultDiff, for wrong submissions
+
+
+def summarize_cursor(cursor, options):
+    fingerprinter = Fingerprinter(options)
+    for rows in iter_batches(cursor, options.batch_size):
+        for row in rows:
+            fingerprinter.add(row)
+    return fingerprinter.summary(describe(cursor))
+
+
+def check_columns(user_columns, expected_columns, options):
+    if len(user_columns) != len(expected_columns):
+        return f"Expected {len(expected_columns)} columns, got {len(user_columns)}."
+    if options.check_column_names and user_columns != expected_columns:
+        return f"Expected columns {', '.join(expected_columns)}; got {', '.join(user_columns)}."
+    return ''
+
+
+class ExpectedMatcher:
+    """
+    Checks batches of user rows against a stored ResultSummary. Driver-agnostic:
+    `feed()` returns False as soon as the verdict is known (too many rows), so the
+    caller can stop fetching; `finish()` returns the Comparison.
+    """
+
+    def __init__(self, expected, options, keep_rows=0):
+        self.expected = expected
+        self.options = options
+        self.keep_rows = keep_rows
+        self.fingerprinter = Fingerprinter(options)
+        self.comparison = Comparison(correct=False)
+
+    def feed(self, rows):
+        comparison = self.comparison
+        comparison.rows.extend(rows[:max(self.keep_rows - len(comparison.rows), 0)])
+        for row in rows:
+            self.fingerprinter.add(row)
+        comparison.row_count = self.fingerprinter.row_count
+        if self.fingerprinter.row_count > self.expected.row_count:
+            comparison.complete = False
+            comparison.reason = f"Expected {self.expected.row_count} rows, got more than that."
+            return False
+        return True
+
+    def finish(self, columns):
+        comparison, expected, options = self.comparison, self.expected, self.options
+        comparison.columns = columns
+        if not comparison.complete:
+            return comparison
+        actual = self.fingerprinter.summary(columns)
+        comparison.differing_buckets = differing_buckets(actual, expected)
+
+        comparison.reason = check_columns(columns, expected.columns, options)
+        if comparison.reason:
+            return comparison
+        if actual.row_count != expected.row_count:
+            comparison.reason = f"Expected {expected.row_count} rows, got {actual.row_count}."
+            return comparison
+        if options.ordered:
+            comparison.correct = actual.ordered_fingerprint == expected.ordered_fingerprint
+            comparison.reason = '' if comparison.correct else "The rows or their order differ from the expected result."
+        else:
+            comparison.correct = actual.fingerprint == expected.fingerprint
+            comparison.reason = '' if comparison.correct else "The rows differ from the expected result."
+        return comparison
+
+
+def compare_with_expected(cursor, expected, options, keep_rows=0):
+    """Stream the user's cursor against a stored ResultSummary."""
+    matcher = ExpectedMatcher(expected, options, keep_rows)
+    for rows in iter_batches(cursor, options.batch_size):
+        if not matcher.feed(rows):
+            break
+    return matcher.finish(describe(cursor))
+
+
+def compare_cursors(user_cursor, solution_cursor, options, keep_rows=0):
+    """Stream two live cursors side by side (used when no stored result is available)."""
+    user_fp, solution_fp = Fingerprinter(options), Fingerprinter(options)
+    comparison = Comparison(correct=False)
+
+    while True:
+        user_rows = user_cursor.fetchmany(options.batch_size)
+        solution_rows = solution_cursor.fetchmany(options.batch_size)
+
+        if not comparison.columns:
+            comparison.columns = describe(user_cursor)
+            comparison.reason = check_columns(comparison.columns, describe(solution_cursor), options)
+            if comparison.reason:
+                comparison.rows = user_rows[:keep_rows]
+                comparison.row_count = len(user_rows)
+                comparison.complete = len(user_rows) < options.batch_size
+                return comparison
+
+        comparison.rows.extend(user_rows[:max(keep_rows - len(comparison.rows), 0)])
+        for user_row, solution_row in zip(user_rows, solution_rows):
+            user_hash, solution_hash = user_fp.add(user_row), solution_fp.add(solution_row)
+            if options.ordered and user_hash != solution_hash:
+                comparison.row_count = user_fp.row_count
+                comparison.complete = False
+                comparison.reason = f"Row {user_fp.row_count} differs from the expected result."
+                return comparison
+
+        if len(user_rows) != len(solution_rows):
+            # One side ran out first, so the row counts can't match
+            comparison.row_count = user_fp.row_count + max(len(user_rows) - len(solution_rows), 0)
+            comparison.complete = len(user_rows) < options.batch_size
+            more_or_fewer = 'more' if len(user_rows) > len(solution_rows) else 'fewer'
+            comparison.reason = f"Your query returned {more_or_fewer} rows than the expected result."
+            return comparison
+        if not user_rows:
+            break
+
+    comparison.row_count = user_fp.row_count
+    comparison.correct = user_fp.fingerprint == solution_fp.fingerprint
+    comparison.reason = '' if comparison.correct else "The rows differ from the expected result."
+    if not comparison.correct:
+        comparison.differing_buckets = differing_buckets(
+            user_fp.summary([]), solution_fp.summary([]))
+    return comparison
+
+
+def query_hash(query):
+    return hashlib.sha256(query.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def compute_expected_result(solution):
+    """Run the solution query against its problem's data and summarize the result."""
+    problem = solution.problem
+    options = compare_options(solution)
+    with problem_cursor(problem) as cursor, streaming_cursor(cursor) as solution_cursor:
+        solution_cursor.execute(solution.query)
+        summary = summarize_cursor(solution_cursor, options)
+    summary.data_schema = problem.data_schema
+    summary.query_hash = query_hash(solution.query)
+    return summary
+
+
+def refresh_expected_result(solution):
+    """Recompute and store the solution's expected result (only for pre-built problems)."""
+    if not solution.problem.data_schema:
+        return None
+    summary = compute_expected_result(solution)
+    solution.expected_result = summary.to_bytes()
+    type(solution).objects.filter(pk=solution.pk).update(expected_result=solution.expected_result)
+    return summary
+
+
+def load_expected_result(solution):
+    """The stored expected result, or None if it's missing or out of date."""
+    if not solution.expected_result:
+        return None
+    summary = ResultSummary.from_bytes(solution.expected_result)
+    if (summary.data_schema != solution.problem.data_schema
+            or summary.query_hash != query_hash(solution.query)
+            or summary.float_digits != solution.float_digits):
+        return None
+    return summary
@@ -0,0 +1,226 @@
+# practice/history.py
+#
+# Every Run and Submit is recorded as a Submission (who, which problem, the
+# query, the verdict, how long it took, how many rows, which error), for "my
+# recent attempts" and per-problem solve rates.
+#
+# Recording must not slow the request down, so nothing is inserted while the
+# user waits: `record_attempt` only appends an unsaved Submission to this
+# process's write-behind buffer. A background thread writes the buffer with
+# one bulk_create whenever it holds PRACTICE_HISTORY_BATCH_SIZE submissions, or
+# every PRACTICE_HISTORY_FLUSH_INTERVAL seconds, and once more at exit.
+#
+# The buffer holds at most PRACTICE_HISTORY_MAX_PENDING submissions; if the
+# database can't keep up (or is down), the oldest are dropped rather than
+# letting memory grow. Written and dropped submissions are counted in
+# practice_history_writes_total. The history is therefore best-effort and may
+# lag a few seconds behind.
+
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import Error, close_old_connections
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from .metrics import Counter
+
+logger = logging.getLogger('practice.history')
+
+ACTION_RUN = 'run'
+ACTION_SUBMIT = 'submit'
+
+ACTION_CHOICES = [
+    (ACTION_RUN, 'Run'),
+    (ACTION_SUBMIT, 'Submit'),
+]
+
+VERDICT_CORRECT = 'correct'
+VERDICT_INCORRECT = 'incorrect'
+VERDICT_OK = 'ok'                # a Run that returned rows
+VERDICT_ERROR = 'error'
+VERDICT_TIMEOUT = 'timeout'      # stopped by a timeout or resource limit
+
+VERDICT_CHOICES = [
+    (VERDICT_CORRECT, 'Correct'),
+    (VERDICT_INCORRECT, 'Incorrect'),
+    (VERDICT_OK, 'Ran'),
+    (VERDICT_ERROR, 'Error'),
+    (VERDICT_TIMEOUT, 'Timed out'),
+]
+
+HISTORY_WRITES = Counter(
+    'practice_history_writes_total', "Submissions recorded in the history, by result (written, dropped).", ['result'])
+
+
+def history_enabled():
+    return getattr(settings, 'PRACTICE_SUBMISSION_HISTORY', True)
+
+
+# --- The write-behind buffer ---
+
+class WriteBehindBuffer:
+    """Unsaved Submissions, written in batches by a background thread."""
+
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()      # one bulk_create at a time
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, submission):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.pop(0)
+                HISTORY_WRITES.inc(result='dropped')
+            self._pending.append(submission)
+            full = len(self._pending) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # A forked child (e.g. a preloading server) doesn't inherit the thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='practice-history', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            # This thread's connection is reused between flushes, up to CONN_MAX_AGE
+            close_old_connections()
+
+    def flush(self):
+        """Write every pending submission now. Returns how many were written."""
+        from .models import Submission
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                Submission.objects.bulk_create(batch, batch_size=self.batch_size)
+            except Error:
+                logger.exception("Could not write %d submissions to the history", len(batch))
+                HISTORY_WRITES.inc(len(batch), result='dropped')
+                return 0
+            HISTORY_WRITES.inc(len(batch), result='written')
+            return len(batch)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def submission_buffer():
+    """This process's write-behind buffer (its thread starts on the first submission)."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(
+                    batch_size=getattr(settings, 'PRACTICE_HISTORY_BATCH_SIZE', 200),
+                    flush_interval=getattr(settings, 'PRACTICE_HISTORY_FLUSH_INTERVAL', 2.0),
+                    max_pending=getattr(settings, 'PRACTICE_HISTORY_MAX_PENDING', 10000),
+                )
+    return _buffer
+
+
+# --- Recording ---
+
+def error_verdict(exc):
+    from .sandbox import QueryLimitError
+
+    return VERDICT_TIMEOUT if isinstance(exc, QueryLimitError) else VERDICT_ERROR
+
+
+def record_attempt(problem, action, query, verdict, duration_ms, user_id=None, session_key='', row_count=None, error=None):
+    """Queue one Run/Submit for the history. Never touches the database itself."""
+    if not history_enabled():
+        return
+    from .models import Submission
+
+    submission_buffer().add(Submission(
+        problem_id=problem.pk,
+        user_id=user_id,
+        session_key=session_key or '',
+        action=action,
+        query=query,
+        verdict=verdict,
+        duration_ms=round(duration_ms, 3),
+        row_count=row_count,
+        error_class=type(error).__name__ if error is not None else '',
+        created_at=timezone.now(),
+    ))
+
+
+# --- Reading ---
+
+def recent_attempts(user_id=None, session_key='', problem_id=None, limit=10):
+    """
+    The latest submissions of a user (or, when not logged in, of a session),
+    newest first; served by the (user, created_at) / (session_key, created_at) indexes.
+    """
+    from .models import Submission
+
+    if user_id is not None:
+        attempts = Submission.objects.filter(user_id=user_id)
+    elif session_key:
+        attempts = Submission.objects.filter(session_key=session_key)
+    else:
+        return Submission.objects.none()
+    if problem_id is not None:
+        attempts = attempts.filter(problem_id=problem_id)
+    return attempts.order_by('-created_at')[:limit]
+
+
+def solve_counts(problem_ids):
+    """
+    {problem id: (Submits, correct Submits)} for the catalog. Counts come from
+    the cache (for PRACTICE_CATALOG_CACHE_TIMEOUT seconds); the missing ones are
+    computed together in one grouped query over the (problem, action, verdict) index.
+    """
+    from .models import Submission
+
+    keys = {f"practice:solve-counts:{problem_id}": problem_id for problem_id in problem_ids}
+    counts = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [problem_id for problem_id in problem_ids if problem_id not in counts]
+    if missing:
+        rows = (Submission.objects.filter(problem_id__in=missing, action=ACTION_SUBMIT).values('problem_id')
+                .annotate(attempts=Count('id'), solved=Count('id', filter=Q(verdict=VERDICT_CORRECT))))
+        computed = {problem_id: (0, 0) for problem_id in missing}
+        computed.update({row['problem_id']: (row['attempts'], row['solved']) for row in rows})
+        cache.set_many({f"practice:solve-counts:{problem_id}": value for problem_id, value in computed.items()},
+                       getattr(settings, 'PRACTICE_CATALOG_CACHE_TIMEOUT', 60))
+        counts.update(computed)
+    return counts
+
+
+def solved_by(user_id, session_key=''):
+    """An Exists() for Problem querysets: has this user (or session) submitted a correct solution?"""
+    from .models import Submission
+
+    correct = Submission.objects.filter(problem=OuterRef('pk'), action=ACTION_SUBMIT, verdict=VERDICT_CORRECT)
+    return Exists(correct.filter(user_id=user_id) if user_id is not None else correct.filter(session_key=session_key))
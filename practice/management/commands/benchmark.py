@@ -0,0 +1,351 @@
+# --- START OF FILE practice/management/commands/benchmark.py ---
+#
+# Load test for the Run/Submit path of `problem_detail`.
+#
+#   python manage.py seed_problems
+#   python manage.py benchmark --requests 500 --concurrency 16 --output bench.json
+#   python manage.py benchmark --compare bench.json    # later, on another commit
+#
+# Requests are built from a seeded random mix of actions (run/submit) and query
+# kinds (cheap, heavy, error) over the selected problems, so two runs with the
+# same options send the same requests. By default they go through Django's test
+# client in this process (full middleware stack, real database). With --url
+# they go over HTTP to a running server instead.
+#
+# The report (requests/s, p50/p95/p99 latency per action and kind, status
+# counts, peak memory) is printed and, with --output, saved as JSON. A run where
+# fewer than MIN_SUCCESS_RATE of the requests got a 2xx answer measured error
+# pages, not Run/Submit: the command fails instead of saving or comparing it.
+
+import json
+import platform
+import queue
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.cookiejar import CookieJar
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from practice import workers
+from practice.models import Problem
+
+# What each query kind sends. `cheap` is the problem's own solution query.
+HEAVY_QUERY = "SELECT count(*) FROM generate_series(1, {rows}) a CROSS JOIN generate_series(1, 1000) b"
+ERROR_QUERY = "SELECT * FROM no_such_table_for_benchmark"
+
+# Share of 2xx responses below which a run is reported as broken (SQL errors are rendered with 200)
+MIN_SUCCESS_RATE = 0.5
+
+
+def parse_mix(text, allowed):
+    """'run=70,submit=30' -> {'run': 70, 'submit': 30}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in allowed:
+            raise CommandError(f"Unknown mix entry '{name}'; expected one of: {', '.join(allowed)}.")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f"Bad weight in '{part}'.")
+    return mix
+
+
+def success_rate(samples):
+    succeeded = sum(1 for sample in samples if isinstance(sample['status'], int) and 200 <= sample['status'] < 300)
+    return succeeded / len(samples) if samples else 1.0
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample['ms'] for sample in samples)
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample['status'])] = statuses.get(str(sample['status']), 0) + 1
+    return {
+        'requests': len(samples),
+        'requests_per_s': round(len(samples) / elapsed, 2) if elapsed else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else None,
+        'statuses': statuses,
+    }
+
+
+def process_peak_mb(pid):
+    """Peak RSS (VmHWM) of another process; Linux only, None elsewhere."""
+    try:
+        for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def peak_memory_mb():
+    """Peak RSS of this process and of the largest execution worker process, if any."""
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    worker_peaks = [
+        process_peak_mb(worker.process.pid)
+        for worker in getattr(workers.execution_service(), 'workers', [])
+    ]
+    worker_peaks = [peak for peak in worker_peaks if peak is not None]
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'workers': max(worker_peaks) if worker_peaks else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(settings.BASE_DIR),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class InProcessTarget:
+    """Sends requests through django.test.Client; one client per thread."""
+
+    def __init__(self):
+        # The test client's host ('testserver') isn't in ALLOWED_HOSTS outside tests,
+        # and with DEBUG off an empty ALLOWED_HOSTS rejects every host with a 400
+        if 'testserver' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        self.local = threading.local()
+
+    def post(self, path, data):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+        return self.local.client.post(path, data).status_code
+
+    def close_thread(self):
+        # Each thread opened its own database connections
+        connections.close_all()
+
+
+class HttpTarget:
+    """Sends requests to a running server; fetches a CSRF token per thread first."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def _session(self, path):
+        if not hasattr(self.local, 'opener'):
+            jar = CookieJar()
+            self.local.opener = build_opener(HTTPCookieProcessor(jar))
+            self.local.opener.open(self.base_url + path).read()
+            self.local.csrf = next((cookie.value for cookie in jar if cookie.name == settings.CSRF_COOKIE_NAME), '')
+        return self.local.opener, self.local.csrf
+
+    def post(self, path, data):
+        opener, csrf = self._session(path)
+        request = Request(
+            self.base_url + path,
+            data=urlencode({**data, 'csrfmiddlewaretoken': csrf}).encode(),
+            headers={'X-CSRFToken': csrf, 'Referer': self.base_url + path},
+        )
+        try:
+            with opener.open(request) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+    def close_thread(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks Run/Submit on problem_detail: throughput, latency percentiles and peak memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests to send, after warm-up (default: 200).")
+        parser.add_argument('--warmup', type=int, default=10, help="Requests sent first and not measured (default: 10).")
+        parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight at once (default: 8).")
+        parser.add_argument('--actions', default='run=50,submit=50', help="Weighted action mix (default: run=50,submit=50).")
+        parser.add_argument('--mix', default='cheap=80,heavy=10,error=10', help="Weighted query mix (default: cheap=80,heavy=10,error=10).")
+        parser.add_argument('--heavy-rows', type=int, default=2000,
+                            help="Size of the heavy query: it counts heavy-rows x 1000 generated rows (default: 2000).")
+        parser.add_argument('--problems', nargs='*', default=None,
+                            help="Problem ids or titles to benchmark (default: every problem with a solution).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the request mix (default: 0).")
+        parser.add_argument('--url', default=None, help="Base URL of a running server (e.g. http://localhost:8000). Default: in-process.")
+        parser.add_argument('--no-result-cache', action='store_true',
+                            help="Turn the result cache off (in-process only), so every request runs its query.")
+        parser.add_argument('--output', default=None, help="Write the report to this JSON file.")
+        parser.add_argument('--compare', default=None, help="A previous JSON report to compare this run with.")
+
+    def handle(self, *args, **options):
+        problems = self.select_problems(options['problems'])
+        actions = parse_mix(options['actions'], ('run', 'submit'))
+        kinds = parse_mix(options['mix'], ('cheap', 'heavy', 'error'))
+        rng = random.Random(options['seed'])
+        if options['no_result_cache']:
+            # The same few queries are sent over and over: most would be cache hits
+            settings.PRACTICE_RESULT_CACHE_BACKEND = ''
+
+        def make_job():
+            problem = rng.choice(problems)
+            action = rng.choices(list(actions), weights=list(actions.values()))[0]
+            kind = rng.choices(list(kinds), weights=list(kinds.values()))[0]
+            query = {
+                'cheap': problem.solution.query,
+                'heavy': HEAVY_QUERY.format(rows=options['heavy_rows']),
+                'error': ERROR_QUERY,
+            }[kind]
+            path = reverse('practice:problem_detail', args=[problem.pk])
+            return {'problem': problem.pk, 'action': action, 'kind': kind, 'path': path,
+                    'data': {'user_query': query, 'action': action}}
+
+        warmup_jobs = [make_job() for _ in range(options['warmup'])]
+        jobs = [make_job() for _ in range(options['requests'])]
+        target = HttpTarget(options['url']) if options['url'] else InProcessTarget()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Benchmarking {len(jobs)} requests over {len(problems)} problem(s), concurrency {options['concurrency']}"
+            f" ({'HTTP ' + options['url'] if options['url'] else 'in-process'})..."
+        ))
+        self.drive(target, warmup_jobs, options['concurrency'])
+        started = time.perf_counter()
+        samples = self.drive(target, jobs, options['concurrency'])
+        elapsed = time.perf_counter() - started
+
+        report = self.build_report(samples, elapsed, problems, options)
+        self.print_report(report)
+        rate = success_rate(samples)
+        if rate < MIN_SUCCESS_RATE:
+            raise CommandError(
+                f"Only {rate:.0%} of the requests got a 2xx response (statuses: {report['overall']['statuses']}); "
+                f"not saving or comparing this run. Check the server's log (or ALLOWED_HOSTS / --url)."
+            )
+        if options['compare']:
+            self.print_comparison(report, options['compare'])
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2), encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def select_problems(self, selectors):
+        problems = list(Problem.objects.select_related('solution').exclude(solution__query='').order_by('pk'))
+        if selectors:
+            wanted = {selector.lower() for selector in selectors}
+            problems = [p for p in problems if str(p.pk) in wanted or p.title.lower() in wanted]
+        if not problems:
+            raise CommandError("No problems with a solution to benchmark. Run seed_problems first.")
+        return problems
+
+    def drive(self, target, jobs, concurrency):
+        """Send `jobs` from `concurrency` threads; returns one sample per job."""
+        pending = queue.SimpleQueue()
+        for job in jobs:
+            pending.put(job)
+        samples = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        job = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        status = target.post(job['path'], job['data'])
+                    except Exception as e:
+                        status = type(e).__name__
+                    ms = round((time.perf_counter() - started) * 1000, 3)
+                    with lock:
+                        samples.append({'problem': job['problem'], 'action': job['action'], 'kind': job['kind'],
+                                        'status': status, 'ms': ms})
+            finally:
+                target.close_thread()
+
+        threads = [threading.Thread(target=worker) for _ in range(max(concurrency, 1))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples
+
+    def build_report(self, samples, elapsed, problems, options):
+        groups = {}
+        for sample in samples:
+            groups.setdefault(f"{sample['action']}/{sample['kind']}", []).append(sample)
+            groups.setdefault(f"problem {sample['problem']}", []).append(sample)
+        memory = peak_memory_mb() if not options['url'] else None
+        return {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'target': options['url'] or 'in-process',
+            'options': {name: options[name] for name in (
+                'requests', 'warmup', 'concurrency', 'actions', 'mix', 'heavy_rows', 'seed')},
+            'settings': {name: getattr(settings, name, None) for name in (
+                'PRACTICE_PREBUILT_SCHEMAS', 'PRACTICE_SANDBOX_MAX_CONCURRENT', 'PRACTICE_EXECUTION_WORKERS',
+                'PRACTICE_EXPLAIN_RUNS', 'PRACTICE_RESULT_PAGE_SIZE', 'PRACTICE_RESULT_CACHE_BACKEND')},
+            'problems': {problem.pk: problem.title for problem in problems},
+            'elapsed_s': round(elapsed, 3),
+            'overall': summarize(samples, elapsed),
+            'groups': {name: summarize(group, elapsed) for name, group in sorted(groups.items())},
+            'peak_memory_mb': memory,
+        }
+
+    def print_report(self, report):
+        overall = report['overall']
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{overall['requests']} requests in {report['elapsed_s']}s: {overall['requests_per_s']} req/s, "
+            f"p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms, p99 {overall['p99_ms']} ms"
+        ))
+        self.stdout.write(f"  statuses: {overall['statuses']}")
+        for name, group in report['groups'].items():
+            self.stdout.write(
+                f"  {name:<20} n={group['requests']:<5} p50 {group['p50_ms']} ms, p95 {group['p95_ms']} ms, "
+                f"p99 {group['p99_ms']} ms  {group['statuses']}"
+            )
+        if report['peak_memory_mb']:
+            memory = report['peak_memory_mb']
+            line = f"  peak memory: {memory['self']} MB (this process)"
+            if memory['workers'] is not None:
+                line += f", {memory['workers']} MB (largest execution worker)"
+            self.stdout.write(line)
+
+    def print_comparison(self, report, path):
+        try:
+            previous = json.loads(Path(path).read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nCompared with {path} (commit {previous.get('commit')}):"))
+        for key in ('requests_per_s', 'p50_ms', 'p95_ms', 'p99_ms'):
+            before, after = previous['overall'].get(key), report['overall'].get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            # More requests/s is better; more latency is worse
+            worse = change < 0 if key == 'requests_per_s' else change > 0
+            style = self.style.WARNING if worse and abs(change) >= 5 else self.style.SUCCESS
+            self.stdout.write(style(f"  {key:<15} {before} -> {after} ({change:+.1f}%)"))
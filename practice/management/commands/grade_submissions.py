@@ -0,0 +1,229 @@
+# practice/management/commands/grade_submissions.py
+#
+# Offline, parallel grading of many submissions at once (classroom or contest
+# exports), without going through problem_detail one POST at a time.
+#
+#   python manage.py grade_submissions submissions.jsonl --workers 8 --output graded.jsonl
+#   python manage.py grade_submissions submissions.csv --timeout 5 > graded.jsonl
+#
+# Input is JSONL (one {"problem": ..., "query": ..., "submitter": ...} object
+# per line) or CSV with a header naming the same columns; `problem` is a
+# problem id or title. '-' reads JSONL from stdin.
+#
+# Jobs are graded by an ExecutionPool (see workers.py) of --workers processes,
+# with the same grading code as the Submit button and a per-job --timeout: a
+# job running past it has its backend cancelled, and its worker replaced if
+# need be. Identical submissions are answered from the result cache (see
+# result_cache.py). Only a few jobs per worker are read ahead, so any number of
+# submissions fits in memory.
+#
+# One JSON object per submission is streamed to --output (default stdout) as
+# soon as it is graded, so the order isn't the input order; `line` says which
+# input line it belongs to. The summary (per-problem throughput and latency)
+# goes to stderr.
+
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import Error
+from practice.classifier import classify
+from practice.management.commands.benchmark import percentile
+from practice.models import Problem
+from practice.rendering import RENDERED_FIELDS
+from practice.sandbox import QueryLimitError, SandboxBusy, prefetch_problem_data
+from practice.workers import CachedExecution, ExecutionPool, InProcessExecution
+
+VERDICT_CORRECT = 'correct'
+VERDICT_INCORRECT = 'incorrect'
+VERDICT_ERROR = 'error'          # the query failed (syntax error, missing table, ...)
+VERDICT_TIMEOUT = 'timeout'      # stopped by a statement timeout / the --timeout deadline
+VERDICT_INVALID = 'invalid'      # not gradable: unknown problem, empty or non-SELECT query, bad input line
+
+# Jobs read ahead per worker
+READ_AHEAD = 4
+
+
+def read_submissions(stream, fmt):
+    """Yield one dict (line, problem, query, submitter, error) per input submission."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        missing = {'problem', 'query'} - set(reader.fieldnames or [])
+        if missing:
+            raise CommandError(f"The CSV header must name the columns problem, query (and submitter); missing: {', '.join(sorted(missing))}.")
+        for row in reader:
+            yield {'line': reader.line_num, 'problem': row.get('problem'), 'query': row.get('query'),
+                   'submitter': row.get('submitter'), 'error': ''}
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield {'line': line_number, 'problem': None, 'query': None, 'submitter': None, 'error': f"Bad JSON: {e}"}
+            continue
+        yield {'line': line_number, 'problem': data.get('problem'), 'query': data.get('query'),
+               'submitter': data.get('submitter'), 'error': ''}
+
+
+def input_format(path, requested):
+    if requested != 'auto':
+        return requested
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+class ProblemStats:
+    """Per-problem tally for the summary."""
+
+    def __init__(self):
+        self.verdicts = {}
+        self.latencies = []
+
+    def add(self, record):
+        self.verdicts[record['verdict']] = self.verdicts.get(record['verdict'], 0) + 1
+        self.latencies.append(record['elapsed_ms'])
+
+
+class Command(BaseCommand):
+    help = 'Grades a JSONL/CSV file of (problem, query, submitter) submissions in parallel and streams the verdicts as JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="JSONL or CSV file of submissions ('-' for JSONL on stdin).")
+        parser.add_argument('--format', choices=['auto', 'jsonl', 'csv'], default='auto',
+                            help="Input format (default: from the file extension, JSONL unless .csv).")
+        parser.add_argument('--output', default=None, help="Write the graded JSONL here (default: stdout).")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Grading processes (default: one per CPU). 0 grades in this process, one at a time.")
+        parser.add_argument('--timeout', type=float, default=getattr(settings, 'PRACTICE_EXECUTION_DEADLINE', 15),
+                            help="Seconds a job may run before it is stopped (default: PRACTICE_EXECUTION_DEADLINE). "
+                                 "Never shorter than the problem's own statement timeout.")
+        parser.add_argument('--with-diff', action='store_true',
+                            help="Also compute the row-level diff of wrong submissions (slower: both queries run again).")
+        parser.add_argument('--no-result-cache', action='store_true',
+                            help="Grade every submission, even identical ones.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 0:
+            raise CommandError("--workers can't be negative.")
+        if not options['with_diff']:
+            # Worker processes read their settings from the environment (see project/settings.py)
+            os.environ['PRACTICE_DIFF_MAX_ROWS'] = '0'
+            settings.PRACTICE_DIFF_MAX_ROWS = 0
+        if options['no_result_cache']:
+            settings.PRACTICE_RESULT_CACHE_BACKEND = ''
+
+        # The markdown is never needed here, and every job sends its problem to a worker
+        self.problems = {}
+        problems = list(Problem.objects.select_related('solution').defer(*RENDERED_FIELDS, *RENDERED_FIELDS.values()))
+        prefetch_problem_data(problems)
+        for problem in problems:
+            self.problems[str(problem.pk)] = problem
+            self.problems[problem.title.strip().lower()] = problem
+
+        if options['workers']:
+            pool = ExecutionPool(size=options['workers'], deadline=options['timeout'],
+                                 max_waiting=options['workers'], wait_timeout=options['timeout'])
+        else:
+            pool = InProcessExecution()
+        self.service = CachedExecution(pool)
+
+        stream = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8', newline='')
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else self.stdout
+        fmt = 'jsonl' if options['input'] == '-' else input_format(options['input'], options['format'])
+        stats = {}
+        started = time.perf_counter()
+        try:
+            self.stderr.write(self.style.MIGRATE_HEADING(
+                f"Grading {options['input']} with {options['workers'] or 'no'} worker process(es), timeout {options['timeout']:g}s..."
+            ))
+            threads = max(options['workers'], 1)
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                pending = set()
+                for submission in read_submissions(stream, fmt):
+                    if len(pending) >= threads * READ_AHEAD:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self.write_records(done, output, stats)
+                    pending.add(executor.submit(self.grade, submission))
+                self.write_records(wait(pending).done, output, stats)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+            if isinstance(pool, ExecutionPool):
+                pool.close()
+        self.print_summary(stats, time.perf_counter() - started)
+
+    def grade(self, submission):
+        """Grade one submission (in an executor thread). Never raises: failures are verdicts."""
+        record = {'line': submission['line'], 'submitter': submission['submitter'], 'problem': submission['problem'],
+                  'verdict': VERDICT_INVALID, 'reason': '', 'error': submission['error'], 'elapsed_ms': 0.0, 'cached': False}
+        if record['error']:
+            return record
+        problem = self.problems.get(str(submission['problem'] or '').strip().lower())
+        query = str(submission['query'] or '').strip()
+        if problem is None:
+            record['error'] = f"Unknown problem: {submission['problem']!r}"
+            return record
+        record['problem'] = problem.pk
+        if not query:
+            record['error'] = "Cannot submit an empty query."
+            return record
+        # Same rule as the Submit button
+        classification = classify(query)
+        if not classification.allowed:
+            record['error'] = classification.reason
+            return record
+        if not hasattr(problem, 'solution') or not problem.solution.query:
+            record['error'] = "This problem does not have a solution configured yet."
+            return record
+
+        job_started = time.perf_counter()
+        try:
+            comparison, page = self.service.grade_query(problem, query)
+            record['verdict'] = VERDICT_CORRECT if comparison.correct else VERDICT_INCORRECT
+            record['reason'] = comparison.reason
+            record['cached'] = page.cached
+            if comparison.diff is not None:
+                record['diff'] = comparison.diff.as_dict()
+        except QueryLimitError as e:
+            record['verdict'], record['error'] = VERDICT_TIMEOUT, str(e)
+        except (Error, SandboxBusy) as e:
+            record['verdict'], record['error'] = VERDICT_ERROR, str(e)
+        except Exception as e:
+            record['verdict'], record['error'] = VERDICT_ERROR, f"An unexpected application error occurred: {e}"
+        record['elapsed_ms'] = round((time.perf_counter() - job_started) * 1000, 3)
+        return record
+
+    def write_records(self, futures, output, stats):
+        for future in futures:
+            record = future.result()
+            output.write(json.dumps(record, default=str) + '\n')
+            stats.setdefault(str(record['problem']), ProblemStats()).add(record)
+
+    def print_summary(self, stats, elapsed):
+        total = sum(len(problem_stats.latencies) for problem_stats in stats.values())
+        self.stderr.write(self.style.SUCCESS(
+            f"\nGraded {total} submissions in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f}/s)."
+        ))
+        titles = {str(problem.pk): problem.title for problem in self.problems.values()}
+        for problem_id, problem_stats in sorted(stats.items()):
+            latencies = sorted(problem_stats.latencies)
+            busy_s = sum(latencies) / 1000
+            verdicts = ', '.join(f"{count} {verdict}" for verdict, count in sorted(problem_stats.verdicts.items()))
+            self.stderr.write(
+                f"  {titles.get(problem_id, problem_id)}: {len(latencies)} graded ({verdicts}); "
+                f"{len(latencies) / busy_s if busy_s else 0:.1f}/s per worker, "
+                f"p50 {percentile(latencies, 50)} ms, p95 {percentile(latencies, 95)} ms"
+            )
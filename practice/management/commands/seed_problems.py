@@ -1,28 +1,197 @@
 # --- START OF FILE practice/management/commands/seed_problems.py ---
+#
+# Loads every folder under practice/problems/ into Problem / Solution / Schema rows.
+#
+# Seeding is incremental: each folder is hashed, and folders whose hash matches
+# Problem.source_hash are skipped. Changed problems are written with bulk
+# queries in a single transaction, then their data schemas and expected results
+# are (re)built. Use --force to reload everything and --verbose for the full
+# per-file debug output. With --skip-schema-build the new hash isn't stored, so
+# the next run without it still sees the problem as changed and builds it.
+#
+# An optional problem.json holds per-problem settings, e.g. {"engine": "sqlite"}.
+# SQLite problems are checked to give the same solution result on both engines.
+#
+# Bulk data lives in data/<table>.csv|.tsv|.json (CSV/TSV files or generator
+# specs) and indexes*.sql scripts run after it is loaded; see practice/dataload.py.
 
-import os
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 
 from django.core.management.base import BaseCommand
-from practice.models import Problem, Schema, Solution
+from django.db import Error, transaction
+from practice.dataload import DATA_FILE_KINDS, DATA_KIND_GENERATOR, PROBLEMS_DIR, generator_sql
+from practice.models import DataSource, Problem, Schema, Solution
+from practice.grading import refresh_expected_result
+from practice.rendering import prerender_markdown
+from practice.result_cache import invalidate_problem
+from practice.sandbox import build_problem_schema
+from practice.engines import ENGINE_POSTGRES, ENGINE_SQLITE
+from practice.sqlite_engine import validate_engines
+
+
+@dataclass
+class ProblemSource:
+    """Everything read from one problem folder."""
+    folder: Path
+    title: str
+    source_hash: str = ''
+    description: str = ''
+    solution_explanation: str = ''
+    solution: str = ''
+    schema_files: list = field(default_factory=list)    # [(file name, script), ...]
+    index_files: list = field(default_factory=list)     # [(file name, script), ...], run after the data
+    data_files: list = field(default_factory=list)      # [DataSource (unsaved), ...]
+    engine: str = ENGINE_POSTGRES
+    error: str = ''
+    warnings: list = field(default_factory=list)
+
+
+def data_source_order(source, table):
+    """Load tables in the order the schema scripts create them, so foreign keys are satisfied."""
+    scripts = '\n'.join(script for _, script in source.schema_files)
+    match = re.search(rf'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?"?{re.escape(table)}\b', scripts, re.IGNORECASE)
+    return match.start() if match else len(scripts)
+
+
+def read_problem_folder(problem_folder):
+    """Read (and hash) one problem folder. Runs in a worker thread."""
+    source = ProblemSource(folder=problem_folder, title=problem_folder.name.replace('_', ' ').title())
+
+    # Hash every file in the folder, so any change (including new data files) is noticed.
+    # Files are hashed in chunks: data files can be far bigger than memory.
+    digest = hashlib.sha256()
+    file_hashes = {}
+    for path in sorted(p for p in problem_folder.rglob('*') if p.is_file()):
+        with open(path, 'rb') as f:
+            file_hashes[path] = hashlib.file_digest(f, 'sha256').hexdigest()
+        digest.update(str(path.relative_to(problem_folder)).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(file_hashes[path].encode('ascii'))
+        digest.update(b'\0')
+    source.source_hash = digest.hexdigest()
+
+    # --- 1. Read Problem Description ---
+    description_file = problem_folder / 'description.md'
+    if not description_file.is_file():
+        source.error = "description.md NOT FOUND"
+        return source
+    source.description = description_file.read_text(encoding='utf-8')
+
+    # --- 2. Read Solution Explanation ---
+    explanation_file = problem_folder / 'solution_explanation.md'
+    if explanation_file.is_file():
+        source.solution_explanation = explanation_file.read_text(encoding='utf-8')
+    else:
+        source.warnings.append("solution_explanation.md not found. Solution explanation will be empty.")
+
+    # --- 3. Read Solution Query ---
+    solution_file = problem_folder / 'solution.sql'
+    if not solution_file.is_file():
+        source.error = "solution.sql NOT FOUND"
+        return source
+    source.solution = solution_file.read_text(encoding='utf-8')
+
+    # --- 4. Read Schema Scripts ---
+    for schema_file in sorted(problem_folder.glob('schema*.sql')):
+        script = schema_file.read_text(encoding='utf-8')
+        if not script.strip():
+            source.warnings.append(f"Schema file '{schema_file.name}' is empty or only whitespace! Skipped.")
+            continue
+        source.schema_files.append((schema_file.name, script))
+    if not source.schema_files:
+        source.warnings.append("No 'schema*.sql' files found.")
+
+    # --- 5. Index scripts, run once the data is loaded ---
+    for index_file in sorted(problem_folder.glob('indexes*.sql')):
+        script = index_file.read_text(encoding='utf-8')
+        if script.strip():
+            source.index_files.append((index_file.name, script))
+
+    # --- 6. Bulk data: data/<table>.csv, .tsv (COPY) or .json (generator spec) ---
+    data_dir = problem_folder / 'data'
+    for data_file in sorted(data_dir.iterdir() if data_dir.is_dir() else []):
+        kind = DATA_FILE_KINDS.get(data_file.suffix.lower())
+        if kind is None or not data_file.is_file():
+            source.warnings.append(f"Ignoring data file '{data_file.name}' (expected .csv, .tsv or .json).")
+            continue
+        data_source = DataSource(table=data_file.stem, kind=kind, content_hash=file_hashes[data_file])
+        if kind == DATA_KIND_GENERATOR:
+            try:
+                data_source.spec = json.loads(data_file.read_text(encoding='utf-8'))
+                generator_sql(data_source.table, data_source.spec)
+            except ValueError as e:
+                source.error = f"data/{data_file.name}: {e}"
+                return source
+        elif data_file.is_relative_to(PROBLEMS_DIR):
+            data_source.path = data_file.relative_to(PROBLEMS_DIR).as_posix()
+        else:
+            # A --problems-dir elsewhere: PROBLEMS_DIR / an absolute path is that path
+            data_source.path = data_file.resolve().as_posix()
+        source.data_files.append(data_source)
+    source.data_files.sort(key=lambda data_source: data_source_order(source, data_source.table))
+
+    # --- 7. Read optional per-problem settings ---
+    settings_file = problem_folder / 'problem.json'
+    if settings_file.is_file():
+        try:
+            problem_settings = json.loads(settings_file.read_text(encoding='utf-8'))
+        except ValueError as e:
+            source.error = f"problem.json is not valid JSON ({e})"
+            return source
+        source.engine = problem_settings.get('engine', ENGINE_POSTGRES)
+        if source.engine not in (ENGINE_POSTGRES, ENGINE_SQLITE):
+            source.error = f"problem.json: unknown engine '{source.engine}'"
+    return source
+
 
 class Command(BaseCommand):
     help = 'Seeds initial SQL problems, schemas, and solutions from structured files.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-schema-build',
+            action='store_true',
+            help="Only load the problem rows; don't build each problem's tables into its own Postgres schema.",
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Reload every problem, even those whose folder hasn't changed.",
+        )
+        parser.add_argument(
+            '--verbose',
+            action='store_true',
+            help="Print the full per-file debug output, including schema script contents.",
+        )
+        parser.add_argument(
+            '--problems-dir',
+            type=Path,
+            default=PROBLEMS_DIR,
+            help="Folder holding one sub-folder per problem (default: practice/problems).",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help="Threads used to read problem folders (default: 8).",
+        )
+
+    def debug(self, message):
+        if self.verbose:
+            self.stdout.write(self.style.NOTICE(message))
+
     def handle(self, *args, **options):
-        # Adjusting the path for Docker context or local runs if needed
-        # Assuming 'problems' directory is sibling to 'practice' app directory
-        # If running from app root, it should be 'practice/problems'
-        # If running from project root, it should be 'practice/problems'
-        # Let's try to make this robust:
-        
-        # This resolves to your 'practice' app directory, then navigates to 'problems'
-        # If your 'problems' directory is directly under your Django project root, adjust this.
-        # Assuming structure: your_project_root/practice/problems/
-        problems_dir = Path(__file__).resolve().parent.parent.parent / 'problems'
-
-        # --- DEBUG: Print the resolved path to problems_dir ---
-        self.stdout.write(self.style.NOTICE(f"Resolved problems directory: {problems_dir}"))
+        self.verbose = options['verbose']
+        started = time.perf_counter()
+
+        problems_dir = options['problems_dir'].resolve()
+        self.debug(f"Resolved problems directory: {problems_dir}")
 
         if not problems_dir.is_dir():
             self.stdout.write(self.style.ERROR(f"Problem definitions directory NOT FOUND at: {problems_dir}"))
@@ -31,90 +200,166 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.MIGRATE_HEADING("Starting problem data seeding..."))
 
-        for problem_folder in sorted(problems_dir.iterdir()):
-            if problem_folder.is_dir():
-                problem_title = problem_folder.name.replace('_', ' ').title()
-                self.stdout.write(self.style.MIGRATE_HEADING(f"\nProcessing problem: {problem_title}"))
-
-                # --- 1. Read Problem Description ---
-                description_file = problem_folder / 'description.md'
-                description_content = ""
-                if description_file.is_file():
-                    description_content = description_file.read_text(encoding='utf-8')
-                    self.stdout.write(self.style.NOTICE(f"  Found description.md for '{problem_title}'. Length: {len(description_content)} chars."))
-                else:
-                    self.stdout.write(self.style.ERROR(f"  ERROR: description.md NOT FOUND for '{problem_title}'. Description will be empty."))
-                    continue
+        # --- 1. Read all problem folders in parallel ---
+        folders = sorted(path for path in problems_dir.iterdir() if path.is_dir())
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+            sources = list(pool.map(read_problem_folder, folders))
 
-                # --- 2. Read Solution Explanation ---
-                explanation_file = problem_folder / 'solution_explanation.md'
-                explanation_content = ""
-                if explanation_file.is_file():
-                    explanation_content = explanation_file.read_text(encoding='utf-8')
-                    self.stdout.write(self.style.NOTICE(f"  Found solution_explanation.md for '{problem_title}'. Length: {len(explanation_content)} chars."))
-                else:
-                    self.stdout.write(self.style.WARNING(f"  solution_explanation.md not found for '{problem_title}'. Solution explanation will be empty."))
-
-                # --- 3. Read Solution Query ---
-                solution_file = problem_folder / 'solution.sql'
-                solution_content = ""
-                if solution_file.is_file():
-                    solution_content = solution_file.read_text(encoding='utf-8')
-                    self.stdout.write(self.style.NOTICE(f"  Found solution.sql for '{problem_title}'. Length: {len(solution_content)} chars."))
-                else:
-                    self.stdout.write(self.style.ERROR(f"  ERROR: solution.sql NOT FOUND for '{problem_title}'. Skipping problem."))
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        existing = {problem.title: problem for problem in Problem.objects.select_related('solution')}
+        changed = []
+
+        for source in sources:
+            self.debug(f"\nProcessing problem: {source.title} ({source.folder})")
+            for warning in source.warnings:
+                self.stdout.write(self.style.WARNING(f"  {source.title}: {warning}"))
+            if source.error:
+                self.stdout.write(self.style.ERROR(f"  ERROR: {source.title}: {source.error}. Skipping problem."))
+                counts['failed'] += 1
+                continue
+            if self.verbose:
+                self.dump_source(source)
+
+            problem = existing.get(source.title)
+            if problem is not None and problem.source_hash == source.source_hash and not options['force']:
+                counts['unchanged'] += 1
+                continue
+            changed.append(source)
+
+        # --- 2. Write every changed problem in one transaction, with bulk queries ---
+        saved = self.save_problems(changed, existing, counts, store_hash=not options['skip_schema_build'])
+        # Results cached in a shared (PRACTICE_RESULT_CACHE_BACKEND = 'django') cache are stale now
+        for problem in saved:
+            invalidate_problem(problem.pk)
+
+        # --- 3. Build data schemas and expected results ---
+        if not options['skip_schema_build']:
+            # Unchanged problems whose schema was never built get built too
+            saved_titles = {problem.title for problem in saved}
+            loaded_titles = {source.title for source in sources if not source.error}
+            to_build = saved + [
+                problem for title, problem in existing.items()
+                if title in loaded_titles and title not in saved_titles
+                and not problem.data_schema and hasattr(problem, 'solution')
+            ]
+            for problem in to_build:
+                try:
+                    build_started = time.perf_counter()
+                    schema_name = build_problem_schema(problem)
+                    expected = refresh_expected_result(problem.solution)
+                    self.debug(f"  Built data schema '{schema_name}' for '{problem.title}' in {time.perf_counter() - build_started:.2f}s ({expected.row_count} expected rows).")
+                except (Error, OSError) as e:
+                    self.stdout.write(self.style.ERROR(f"  ERROR: Could not build data schema or expected result for '{problem.title}': {e}"))
+                    # Not up to date: the next run must try again, not skip it as unchanged
+                    type(problem).objects.filter(pk=problem.pk).update(source_hash='')
+                    counts['failed'] += 1
                     continue
+                if problem.engine == ENGINE_SQLITE:
+                    self.validate_sqlite(problem, expected, counts)
 
-                # --- 4. Create/Update Problem and Solution Instances ---
-                problem, created_problem = Problem.objects.update_or_create(
-                    title=problem_title,
-                    defaults={
-                        'description': description_content,
-                        'solution_explanation': explanation_content,
-                    }
-                )
-                if created_problem:
-                    self.stdout.write(self.style.SUCCESS(f"  Created new Problem: '{problem.title}'"))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"\nFinished seeding: {counts['added']} added, {counts['updated']} updated, "
+            f"{counts['unchanged']} unchanged, {counts['failed']} failed in {elapsed:.2f}s."
+        ))
+
+    def save_problems(self, sources, existing, counts, store_hash=True):
+        """
+        Create/update the Problem, Solution and Schema rows for `sources`. Returns the
+        saved problems. Without `store_hash` (the schemas won't be built now) their
+        source_hash is left empty, so they still count as changed on the next run.
+        """
+        if not sources:
+            return []
+
+        new_problems, updated_problems = [], []
+        for source in sources:
+            problem = existing.get(source.title) or Problem(title=source.title)
+            problem.description = source.description
+            problem.solution_explanation = source.solution_explanation
+            problem.source_hash = source.source_hash if store_hash else ''
+            problem.engine = source.engine
+            # bulk_create/bulk_update skip save(), so render the markdown here
+            prerender_markdown(problem)
+            (updated_problems if problem.pk else new_problems).append(problem)
+
+        with transaction.atomic():
+            Problem.objects.bulk_create(new_problems)
+            Problem.objects.bulk_update(updated_problems, [
+                'description', 'solution_explanation', 'source_hash', 'engine',
+                'description_html', 'solution_explanation_html', 'markdown_hash',
+            ])
+            problems = {problem.title: problem for problem in [*new_problems, *updated_problems]}
+
+            # --- Solutions ---
+            new_solutions, updated_solutions = [], []
+            for source in sources:
+                problem = problems[source.title]
+                if hasattr(problem, 'solution'):
+                    problem.solution.query = source.solution
+                    problem.solution.expected_result = None
+                    updated_solutions.append(problem.solution)
                 else:
-                    self.stdout.write(self.style.SUCCESS(f"  Updated existing Problem: '{problem.title}'"))
+                    problem.solution = Solution(problem=problem, query=source.solution)
+                    new_solutions.append(problem.solution)
+            Solution.objects.bulk_create(new_solutions)
+            Solution.objects.bulk_update(updated_solutions, ['query', 'expected_result'])
 
-                Solution.objects.update_or_create(
-                    problem=problem,
-                    defaults={
-                        'query': solution_content
-                    }
+            # --- Schemas: replace every changed problem's scripts in two queries ---
+            Schema.objects.filter(problem__in=updated_problems).delete()
+            Schema.objects.bulk_create([
+                Schema(problem=problems[source.title], script=script, order=idx, runs_after_data=runs_after_data)
+                for source in sources
+                for idx, (runs_after_data, script) in enumerate(
+                    [(False, script) for _, script in source.schema_files]
+                    + [(True, script) for _, script in source.index_files]
                 )
-                self.stdout.write(self.style.SUCCESS(f"  Solution for '{problem.title}' seeded/updated."))
-
-                # --- 5. Handle Schema Scripts ---
-                problem.schemas.all().delete()
-                self.stdout.write(self.style.WARNING(f"  Cleared existing schemas for '{problem.title}'."))
-
-                schema_files = sorted(problem_folder.glob('schema*.sql'))
-
-                if not schema_files:
-                    self.stdout.write(self.style.WARNING(f"  No 'schema*.sql' files found for '{problem_title}'."))
-
-                for idx, schema_file in enumerate(schema_files):
-                    # --- DEBUG: Print schema file path and content before saving ---
-                    self.stdout.write(self.style.NOTICE(f"  Processing schema file: {schema_file.name} at path: {schema_file}"))
-                    
-                    schema_script_content = schema_file.read_text(encoding='utf-8')
-                    
-                    self.stdout.write(self.style.NOTICE(f"  Read schema content (length: {len(schema_script_content)}):"))
-                    self.stdout.write(self.style.NOTICE(f"  --- START RAW SCHEMA CONTENT ---"))
-                    self.stdout.write(self.style.NOTICE(schema_script_content.strip())) # Print stripped content for readability
-                    self.stdout.write(self.style.NOTICE(f"  --- END RAW SCHEMA CONTENT ---"))
-                    
-                    if not schema_script_content.strip(): # Check if content is truly empty
-                        self.stdout.write(self.style.ERROR(f"  ERROR: Schema file '{schema_file.name}' is empty or only whitespace!"))
-                        continue # Skip this schema if it's empty
-
-                    Schema.objects.create(
-                        problem=problem,
-                        script=schema_script_content,
-                        order=idx
-                    )
-                    self.stdout.write(self.style.SUCCESS(f"  Added schema script: '{schema_file.name}' for '{problem.title}' (Order: {idx})."))
-
-        self.stdout.write(self.style.SUCCESS('\nFinished seeding all problems!'))
\ No newline at end of file
+            ])
+
+            # --- Data sources: the same ---
+            DataSource.objects.filter(problem__in=updated_problems).delete()
+            for source in sources:
+                for idx, data_source in enumerate(source.data_files):
+                    data_source.problem = problems[source.title]
+                    data_source.order = idx
+            DataSource.objects.bulk_create([data_source for source in sources for data_source in source.data_files])
+
+        counts['added'] += len(new_problems)
+        counts['updated'] += len(updated_problems)
+        for problem in new_problems:
+            self.stdout.write(self.style.SUCCESS(f"  Created new Problem: '{problem.title}'"))
+        for problem in updated_problems:
+            self.stdout.write(self.style.SUCCESS(f"  Updated existing Problem: '{problem.title}'"))
+        return list(problems.values())
+
+    def validate_sqlite(self, problem, postgres_expected, counts):
+        """SQLite problems must give the same solution result as Postgres; otherwise they stay on Postgres."""
+        try:
+            mismatch = validate_engines(problem, postgres_expected)
+        except Error as e:
+            mismatch = str(e)
+        if not mismatch:
+            self.debug(f"  '{problem.title}' gives the same result on SQLite and Postgres.")
+            return
+        self.stdout.write(self.style.ERROR(f"  ERROR: '{problem.title}' can't run on SQLite: {mismatch}. Using Postgres instead."))
+        problem.engine = ENGINE_POSTGRES
+        type(problem).objects.filter(pk=problem.pk).update(engine=ENGINE_POSTGRES, source_hash='')
+        counts['failed'] += 1
+
+    def dump_source(self, source):
+        """The old per-file debug output, kept behind --verbose."""
+        self.debug(f"  Found description.md for '{source.title}'. Length: {len(source.description)} chars.")
+        self.debug(f"  Found solution_explanation.md for '{source.title}'. Length: {len(source.solution_explanation)} chars.")
+        self.debug(f"  Found solution.sql for '{source.title}'. Length: {len(source.solution)} chars.")
+        for file_name, script in source.schema_files:
+            self.debug(f"  Processing schema file: {file_name} at path: {source.folder / file_name}")
+            self.debug(f"  Read schema content (length: {len(script)}):")
+            self.debug("  --- START RAW SCHEMA CONTENT ---")
+            self.debug(script.strip())
+            self.debug("  --- END RAW SCHEMA CONTENT ---")
+        for file_name, script in source.index_files:
+            self.debug(f"  Found index script: {file_name} (length: {len(script)})")
+        for data_source in source.data_files:
+            self.debug(f"  Found {data_source.get_kind_display()} for table '{data_source.table}'"
+                       + (f": {data_source.path}" if data_source.path else f" ({data_source.spec.get('rows')} rows)"))
+        self.debug(f"  Folder hash: {source.source_hash}")
@@ -0,0 +1,262 @@
+# practice/metrics.py
+#
+# Where does the time in a Run/Submit go? Each phase of the hot path (problem
+# lookup, markdown, admission, schema setup, the user's query, the solution
+# query, the comparison, template rendering) is timed with `phase(...)`, and
+# every request with `track_request(...)`.
+#
+# The numbers go into in-process latency histograms and counters (verdicts,
+# errors, timeouts), labelled per problem, served in the Prometheus text format
+# by the `metrics` view (/metrics). Requests slower than PRACTICE_SLOW_REQUEST_MS
+# are also logged to 'practice.slow_requests' with their phase breakdown.
+#
+# Label values come from a bounded set, so made-up requests can't grow the
+# series without end: the action is one of TRACED_ACTIONS (else 'other'), and
+# the problem label is only set once the problem has been loaded (label_problem),
+# so ids that match no problem are counted under ''.
+#
+# Metrics live in the memory of each process: with several web processes, scrape
+# each one (or run one process per metrics target).
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+import asyncpg
+from django.conf import settings
+from django.db import Error
+
+logger = logging.getLogger('practice.slow_requests')
+
+# Seconds; covers a sub-millisecond cached lookup up to a query hitting its timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+TRACED_ACTIONS = ('view', 'run', 'submit', 'explain', 'export')
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        escaped = str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> (count per bucket, +Inf last; sum of observations)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + seconds)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip([*map(repr, self.buckets), '+Inf'], counts):
+                    cumulative += count
+                    labels = _label_text((*self.labelnames, 'le'), (*key, bound))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram(
+    'practice_request_seconds', "Time spent handling a Run/Submit/Explain request.", ['action', 'problem'])
+PHASE_SECONDS = Histogram(
+    'practice_phase_seconds', "Time spent in each phase of a Run/Submit/Explain request.", ['phase', 'problem'])
+VERDICTS = Counter(
+    'practice_verdicts_total', "Graded submissions, by verdict.", ['problem', 'verdict'])
+ERRORS = Counter(
+    'practice_errors_total', "Requests that ended in an error, by kind (sql, busy, limit, internal).",
+    ['action', 'problem', 'kind'])
+TIMEOUTS = Counter(
+    'practice_query_limits_total', "User queries stopped by a timeout or resource limit, by limit.",
+    ['problem', 'limit'])
+
+
+def render_metrics():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+# --- Tracing one request ---
+
+class RequestTrace:
+    """The phases (name, seconds) of the request being handled, and its problem label."""
+
+    def __init__(self, action, problem=''):
+        self.action = action
+        self.problem = problem
+        self.phases = []
+
+    def error(self, exc):
+        # Imported here: sandbox.py times its own phases with this module
+        from .sandbox import QueryLimitError, SandboxBusy
+
+        if isinstance(exc, SandboxBusy):
+            kind = 'busy'
+        elif isinstance(exc, QueryLimitError):
+            kind = 'limit'
+            TIMEOUTS.inc(problem=self.problem, limit=exc.limit)
+        elif isinstance(exc, (Error, asyncpg.PostgresError, asyncpg.InterfaceError)):
+            kind = 'sql'
+        else:
+            kind = 'internal'
+        ERRORS.inc(action=self.action, problem=self.problem, kind=kind)
+
+
+_current_trace = ContextVar('practice_request_trace', default=None)
+
+
+def slow_request_ms():
+    return getattr(settings, 'PRACTICE_SLOW_REQUEST_MS', 1000)
+
+
+@contextmanager
+def track_request(action, problem_id):
+    """Time a whole request; the phases timed inside it are collected on the yielded RequestTrace."""
+    trace = RequestTrace(action)
+    token = _current_trace.set(trace)
+    started = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_trace.reset(token)
+        REQUEST_SECONDS.observe(elapsed, action=action, problem=trace.problem)
+        if slow_request_ms() and elapsed * 1000 >= slow_request_ms():
+            phases_ms = {}
+            for name, seconds in trace.phases:
+                phases_ms[name] = round(phases_ms.get(name, 0) + seconds * 1000, 2)
+            logger.warning(json.dumps({
+                'action': action,
+                'problem_id': problem_id,
+                'total_ms': round(elapsed * 1000, 2),
+                'phases_ms': phases_ms,
+            }))
+
+
+def label_problem(problem):
+    """Label the current request's metrics with `problem`, now that it is known to exist."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.problem = problem.pk
+
+
+def record_phase(name, seconds):
+    trace = _current_trace.get()
+    PHASE_SECONDS.observe(seconds, phase=name, problem=trace.problem if trace else '')
+    if trace is not None:
+        trace.phases.append((name, seconds))
+
+
+@contextmanager
+def phase(name):
+    """Time one phase of the current request (outside a request it only feeds the histogram)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+def count_verdict(correct):
+    trace = _current_trace.get()
+    VERDICTS.inc(problem=trace.problem if trace else '', verdict='correct' if correct else 'incorrect')
+
+
+def count_error(exc):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.error(exc)
+
+
+def traced(action=None):
+    """
+    Decorator for (sync or async) views taking a `problem_id`: runs them inside
+    track_request. Without an `action`, the POSTed 'action' field is used ('view' for
+    GETs; 'other' for values not in TRACED_ACTIONS).
+    """
+    def decorator(view):
+        def request_action(request):
+            if action:
+                return action
+            if request.method == 'POST':
+                posted = request.POST.get('action') or 'view'
+                return posted if posted in TRACED_ACTIONS else 'other'
+            return 'view'
+
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, problem_id, *args, **kwargs):
+                with track_request(request_action(request), problem_id):
+                    return await view(request, problem_id, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, problem_id, *args, **kwargs):
+            with track_request(request_action(request), problem_id):
+                return view(request, problem_id, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect_phases():
+    """
+    Collect the phases timed in this block into a list, without a request around
+    them (used by execution workers, which send them back to the web process).
+    """
+    trace = RequestTrace('')
+    token = _current_trace.set(trace)
+    try:
+        yield trace.phases
+    finally:
+        _current_trace.reset(token)
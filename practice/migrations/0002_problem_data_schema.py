@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='data_schema',
+            field=models.CharField(blank=True, editable=False, help_text="Pre-built Postgres schema holding this problem's tables. Empty means the schema scripts run on every request.", max_length=63),
+        ),
+    ]
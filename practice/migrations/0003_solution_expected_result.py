@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0002_problem_data_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solution',
+            name='expected_result',
+            field=models.BinaryField(blank=True, help_text="Compressed summary (columns, row count, fingerprint) of the solution's result, computed at seed/save time.", null=True),
+        ),
+    ]
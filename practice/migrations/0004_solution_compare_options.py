@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0003_solution_expected_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solution',
+            name='check_column_names',
+            field=models.BooleanField(default=False, help_text="Column names (aliases) must match the solution's."),
+        ),
+        migrations.AddField(
+            model_name='solution',
+            name='float_digits',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Round numeric values to this many decimal places before comparing. Leave empty for an exact comparison.', null=True),
+        ),
+        migrations.AddField(
+            model_name='solution',
+            name='ordered',
+            field=models.BooleanField(default=False, help_text="Row order must match the solution's (for problems that ask for an ORDER BY)."),
+        ),
+    ]
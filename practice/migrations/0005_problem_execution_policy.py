@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0004_solution_compare_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='statement_timeout_ms',
+            field=models.PositiveIntegerField(blank=True, help_text='Statement timeout for queries on this problem, in milliseconds. Leave empty to use the site default.', null=True),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='temp_file_limit',
+            field=models.CharField(blank=True, help_text="Postgres temp_file_limit for queries on this problem (e.g. '1GB'). Requires a superuser connection.", max_length=16),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='work_mem',
+            field=models.CharField(blank=True, help_text="Postgres work_mem for queries on this problem (e.g. '64MB'). Leave empty to use the site default.", max_length=16),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:55
+
+from django.db import migrations, models
+
+from practice.rendering import prerender_markdown
+
+
+def prerender_existing_problems(apps, schema_editor):
+    Problem = apps.get_model('practice', 'Problem')
+    for problem in Problem.objects.all():
+        prerender_markdown(problem)
+        problem.save(update_fields=['description_html', 'solution_explanation_html', 'markdown_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0005_problem_execution_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='description_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='markdown_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the markdown the HTML fields were rendered from.', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='solution_explanation_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(prerender_existing_problems, migrations.RunPython.noop),
+    ]
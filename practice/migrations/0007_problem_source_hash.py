@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0006_problem_rendered_markdown'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, help_text="Hash of the problem's folder the last time seed_problems loaded it.", max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0007_problem_source_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='engine',
+            field=models.CharField(choices=[('postgres', 'PostgreSQL'), ('sqlite', 'SQLite (in-memory snapshot)')], default='postgres', help_text='Where user queries run. SQLite gives each query a private in-memory copy of the (small) dataset; seed_problems checks the solution gives the same result on both.', max_length=16),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0008_problem_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schema',
+            name='runs_after_data',
+            field=models.BooleanField(default=False, help_text="Run after the problem's data sources are loaded (CREATE INDEX, constraints), so indexes are built once over all the rows."),
+        ),
+        migrations.CreateModel(
+            name='DataSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(help_text="The table the rows are loaded into. It must be created by the problem's schema scripts.", max_length=63)),
+                ('kind', models.CharField(choices=[('csv', 'CSV file'), ('tsv', 'TSV file'), ('generator', 'Generator spec')], help_text='How the rows are produced.', max_length=16)),
+                ('path', models.CharField(blank=True, help_text='CSV/TSV file, relative to practice/problems/. Its first line names the columns.', max_length=255)),
+                ('spec', models.JSONField(blank=True, help_text='Generator spec: row count, seed and one entry per column (see dataload.py).', null=True)),
+                ('content_hash', models.CharField(blank=True, help_text="Hash of the file or spec; part of the problem's schema version.", max_length=64)),
+                ('order', models.PositiveIntegerField(default=0, help_text='Order in which data sources are loaded (tables referenced by foreign keys first).')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='data_sources', to='practice.problem')),
+            ],
+            options={
+                'ordering': ['order'],
+                'unique_together': {('problem', 'order')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0009_problem_data_sources'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Submission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, help_text="The visitor's session, for anonymous history.", max_length=40)),
+                ('action', models.CharField(choices=[('run', 'Run'), ('submit', 'Submit')], max_length=16)),
+                ('query', models.TextField(help_text='The SQL exactly as it was sent.')),
+                ('verdict', models.CharField(choices=[('correct', 'Correct'), ('incorrect', 'Incorrect'), ('ok', 'Ran'), ('error', 'Error'), ('timeout', 'Timed out')], max_length=16)),
+                ('duration_ms', models.FloatField(help_text='Time to run (or grade) the query, in milliseconds.')),
+                ('row_count', models.PositiveIntegerField(blank=True, help_text='Rows the query returned, when known.', null=True)),
+                ('error_class', models.CharField(blank=True, help_text='Exception class of a failed query (e.g. ProgrammingError, QueryLimitError).', max_length=64)),
+                ('created_at', models.DateTimeField(help_text='When the query was sent (not when it was written).')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='practice.problem')),
+                ('user', models.ForeignKey(blank=True, help_text='Empty for anonymous visitors, who are told apart by their session.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='practice_submissions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at'], name='practice_sub_user_recent'), models.Index(fields=['session_key', '-created_at'], name='practice_sub_session_recent'), models.Index(fields=['problem', 'action', 'verdict'], name='practice_sub_problem_verdict')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from practice.rendering import prerender_markdown
+
+
+def rerender_problems(apps, schema_editor):
+    # Code blocks are now highlighted when the markdown is rendered
+    Problem = apps.get_model('practice', 'Problem')
+    for problem in Problem.objects.all():
+        if prerender_markdown(problem):
+            problem.save(update_fields=['description_html', 'solution_explanation_html', 'markdown_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practice', '0010_submission'),
+    ]
+
+    operations = [
+        migrations.RunPython(rerender_problems, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,39 @@
 # --- START OF FILE models.py ---
 
 # practice/models.py
+from django.conf import settings
 from django.db import models
 
+from .dataload import DATA_KIND_CHOICES
+from .engines import ENGINE_CHOICES, ENGINE_POSTGRES
+from .history import ACTION_CHOICES, VERDICT_CHOICES
+from .rendering import RENDERED_FIELDS, prerender_markdown
+
 # Create your models here.
 
 class Problem(models.Model):
     title = models.CharField(max_length=200, unique=True, help_text="A unique title for the problem")
     description = models.TextField(help_text="The markdown description of the SQL problem.") # Keep as description
     solution_explanation = models.TextField(help_text="The detailed, step-by-step breakdown of the solution logic.")
-    
+    # Per-problem overrides of settings.PRACTICE_EXECUTION_POLICY, for problems with heavier data
+    statement_timeout_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Statement timeout for queries on this problem, in milliseconds. Leave empty to use the site default.")
+    work_mem = models.CharField(max_length=16, blank=True, help_text="Postgres work_mem for queries on this problem (e.g. '64MB'). Leave empty to use the site default.")
+    temp_file_limit = models.CharField(max_length=16, blank=True, help_text="Postgres temp_file_limit for queries on this problem (e.g. '1GB'). Requires a superuser connection.")
+    data_schema = models.CharField(max_length=63, blank=True, editable=False, help_text="Pre-built Postgres schema holding this problem's tables. Empty means the schema scripts run on every request.")
+    engine = models.CharField(max_length=16, choices=ENGINE_CHOICES, default=ENGINE_POSTGRES, help_text="Where user queries run. SQLite gives each query a private in-memory copy of the (small) dataset; seed_problems checks the solution gives the same result on both.")
+
+    source_hash = models.CharField(max_length=64, blank=True, editable=False, help_text="Hash of the problem's folder the last time seed_problems loaded it.")
+
+    # Pre-rendered HTML of the markdown fields above (see rendering.py), refreshed on save
+    description_html = models.TextField(blank=True, editable=False)
+    solution_explanation_html = models.TextField(blank=True, editable=False)
+    markdown_hash = models.CharField(max_length=16, blank=True, editable=False, help_text="Hash of the markdown the HTML fields were rendered from.")
+
+    def save(self, *args, **kwargs):
+        if prerender_markdown(self) and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], *RENDERED_FIELDS.values(), 'markdown_hash'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
@@ -17,6 +41,7 @@ class Schema(models.Model):
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='schemas')
     script = models.TextField(help_text="The CREATE TABLE and INSERT INTO statements for one table.")
     order = models.PositiveIntegerField(default=0, help_text="Order in which schema scripts should be executed for a problem.") # THIS IS THE NEW FIELD
+    runs_after_data = models.BooleanField(default=False, help_text="Run after the problem's data sources are loaded (CREATE INDEX, constraints), so indexes are built once over all the rows.")
 
     class Meta:
         ordering = ['order']
@@ -26,9 +51,55 @@ class Schema(models.Model):
     def __str__(self):
         return f"Schema for {self.problem.title} (Order: {self.order})"
 
+class DataSource(models.Model):
+    """Bulk data for one table of a problem: a CSV/TSV file loaded with COPY, or a generator spec."""
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='data_sources')
+    table = models.CharField(max_length=63, help_text="The table the rows are loaded into. It must be created by the problem's schema scripts.")
+    kind = models.CharField(max_length=16, choices=DATA_KIND_CHOICES, help_text="How the rows are produced.")
+    path = models.CharField(max_length=255, blank=True, help_text="CSV/TSV file, relative to practice/problems/. Its first line names the columns.")
+    spec = models.JSONField(null=True, blank=True, help_text="Generator spec: row count, seed and one entry per column (see dataload.py).")
+    content_hash = models.CharField(max_length=64, blank=True, help_text="Hash of the file or spec; part of the problem's schema version.")
+    order = models.PositiveIntegerField(default=0, help_text="Order in which data sources are loaded (tables referenced by foreign keys first).")
+
+    class Meta:
+        ordering = ['order']
+        unique_together = ('problem', 'order')
+
+    def __str__(self):
+        return f"{self.get_kind_display()} data for {self.problem.title}.{self.table}"
+
 class Solution(models.Model):
     problem = models.OneToOneField(Problem, on_delete=models.CASCADE, related_name='solution') # Keep related_name
     query = models.TextField(help_text="The correct SQL query to solve the problem.")
+    ordered = models.BooleanField(default=False, help_text="Row order must match the solution's (for problems that ask for an ORDER BY).")
+    float_digits = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Round numeric values to this many decimal places before comparing. Leave empty for an exact comparison.")
+    check_column_names = models.BooleanField(default=False, help_text="Column names (aliases) must match the solution's.")
+    expected_result = models.BinaryField(null=True, blank=True, editable=False, help_text="Compressed summary (columns, row count, fingerprint) of the solution's result, computed at seed/save time.")
+
+    def __str__(self):
+        return f"Solution for {self.problem.title}"
+
+class Submission(models.Model):
+    """One Run or Submit, recorded through the write-behind buffer in history.py."""
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='submissions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='practice_submissions', help_text="Empty for anonymous visitors, who are told apart by their session.")
+    session_key = models.CharField(max_length=40, blank=True, help_text="The visitor's session, for anonymous history.")
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    query = models.TextField(help_text="The SQL exactly as it was sent.")
+    verdict = models.CharField(max_length=16, choices=VERDICT_CHOICES)
+    duration_ms = models.FloatField(help_text="Time to run (or grade) the query, in milliseconds.")
+    row_count = models.PositiveIntegerField(null=True, blank=True, help_text="Rows the query returned, when known.")
+    error_class = models.CharField(max_length=64, blank=True, help_text="Exception class of a failed query (e.g. ProgrammingError, QueryLimitError).")
+    created_at = models.DateTimeField(help_text="When the query was sent (not when it was written).")
+
+    class Meta:
+        indexes = [
+            # "My recent attempts", logged in or not
+            models.Index(fields=['user', '-created_at'], name='practice_sub_user_recent'),
+            models.Index(fields=['session_key', '-created_at'], name='practice_sub_session_recent'),
+            # Per-problem solve rates
+            models.Index(fields=['problem', 'action', 'verdict'], name='practice_sub_problem_verdict'),
+        ]
 
     def __str__(self):
-        return f"Solution for {self.problem.title}"
\ No newline at end of file
+        return f"{self.get_action_display()} of {self.problem_id} ({self.verdict}) at {self.created_at:%Y-%m-%d %H:%M:%S}"
@@ -0,0 +1,8 @@
+ALTER TABLE regions ADD PRIMARY KEY (id);
+ALTER TABLE customers ADD PRIMARY KEY (id);
+ALTER TABLE customers ADD FOREIGN KEY (region_id) REFERENCES regions (id);
+ALTER TABLE orders ADD PRIMARY KEY (id);
+ALTER TABLE orders ADD FOREIGN KEY (customer_id) REFERENCES customers (id);
+
+CREATE INDEX orders_customer_id_idx ON orders (customer_id);
+CREATE INDEX orders_order_date_idx ON orders (order_date);
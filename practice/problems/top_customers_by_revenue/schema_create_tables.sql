@@ -0,0 +1,24 @@
+DROP TABLE IF EXISTS orders CASCADE;
+DROP TABLE IF EXISTS customers CASCADE;
+DROP TABLE IF EXISTS regions CASCADE;
+
+-- No keys or indexes here: they are added by indexes.sql, after the data is loaded
+CREATE TABLE regions (
+    id INTEGER NOT NULL,
+    name VARCHAR(50) NOT NULL
+);
+
+CREATE TABLE customers (
+    id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    region_id INTEGER NOT NULL,
+    signup_date DATE NOT NULL
+);
+
+CREATE TABLE orders (
+    id INTEGER NOT NULL,
+    customer_id INTEGER NOT NULL,
+    order_date DATE NOT NULL,
+    amount DECIMAL(10, 2) NOT NULL,
+    status VARCHAR(10) NOT NULL
+);
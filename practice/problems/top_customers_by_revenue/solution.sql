@@ -0,0 +1,9 @@
+SELECT c.id AS customer_id, c.name AS customer_name, r.name AS region, SUM(o.amount) AS total_revenue
+FROM orders o
+JOIN customers c ON c.id = o.customer_id
+JOIN regions r ON r.id = c.region_id
+WHERE o.status = 'paid'
+  AND o.order_date >= DATE '2023-01-01' AND o.order_date < DATE '2024-01-01'
+GROUP BY c.id, c.name, r.name
+ORDER BY total_revenue DESC, c.id
+LIMIT 10;
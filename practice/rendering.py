@@ -0,0 +1,78 @@
+# practice/rendering.py
+#
+# Problem descriptions and solution explanations are markdown. Converting them is
+# one of the most expensive steps of a page view, so it happens once: Problem.save()
+# stores the HTML next to the markdown, along with a hash of the markdown.
+#
+# Page views read the HTML through the cache. The cache key includes that hash, so
+# editing a problem (which changes the hash) automatically stops old entries from
+# being served.
+#
+# Code blocks are highlighted here too, with Pygments (the codehilite extension),
+# so pages need no highlighting script; the styles for HIGHLIGHT_CSS_CLASS are in
+# the editor.css bundle (see assets.py).
+
+import hashlib
+
+import markdown
+from django.conf import settings
+from django.core.cache import cache
+
+HIGHLIGHT_CSS_CLASS = 'highlight'
+
+MARKDOWN_EXTENSIONS = ['tables', 'fenced_code', 'codehilite']
+MARKDOWN_EXTENSION_CONFIGS = {
+    # Blocks without a language (```) are left as plain text rather than guessed
+    'codehilite': {'css_class': HIGHLIGHT_CSS_CLASS, 'guess_lang': False},
+}
+
+# Part of markdown_hash: bump it when the HTML rendered from the same markdown changes
+RENDERER_VERSION = 2
+
+# Problem fields holding markdown, and where their rendered HTML is stored
+RENDERED_FIELDS = {
+    'description': 'description_html',
+    'solution_explanation': 'solution_explanation_html',
+}
+
+
+def render_markdown(text):
+    return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS, extension_configs=MARKDOWN_EXTENSION_CONFIGS)
+
+
+def markdown_hash(problem):
+    digest = hashlib.sha256(f"{RENDERER_VERSION}\0".encode())
+    for source_field in RENDERED_FIELDS:
+        digest.update((getattr(problem, source_field) or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def prerender_markdown(problem):
+    """Render the problem's markdown fields into their *_html fields, if the markdown changed."""
+    new_hash = markdown_hash(problem)
+    if new_hash == problem.markdown_hash and all(getattr(problem, html_field) for html_field in RENDERED_FIELDS.values()):
+        return False
+    for source_field, html_field in RENDERED_FIELDS.items():
+        setattr(problem, html_field, render_markdown(getattr(problem, source_field) or ''))
+    problem.markdown_hash = new_hash
+    return True
+
+
+def cache_key(problem_id, content_hash):
+    return f"practice:problem-html:{problem_id}:{content_hash}"
+
+
+def problem_html(problem):
+    """
+    The problem's rendered HTML as {'description': ..., 'solution_explanation': ...},
+    served from the cache. Only the HTML columns are read on a cache miss, so callers
+    may load `problem` with its large text fields deferred.
+    """
+    key = cache_key(problem.pk, problem.markdown_hash)
+    html = cache.get(key)
+    if html is None:
+        stored = type(problem).objects.filter(pk=problem.pk).values(*RENDERED_FIELDS.values()).first() or {}
+        html = {source_field: stored.get(html_field, '') for source_field, html_field in RENDERED_FIELDS.items()}
+        cache.set(key, html, getattr(settings, 'PRACTICE_MARKDOWN_CACHE_TIMEOUT', 24 * 60 * 60))
+    return html
@@ -0,0 +1,289 @@
+# practice/result_cache.py
+#
+# Students press Run (and Submit) with the same query over and over. Results
+# of deterministic, read-only queries are cached, keyed by:
+#
+#   - the query, normalized: comments removed, runs of whitespace collapsed
+#     to one space and everything outside string literals / quoted identifiers
+#     lower-cased (Postgres folds unquoted identifiers anyway), so reformatting
+#     a query still hits the cache. Literals are kept byte for byte, and tokens
+#     that were apart stay apart (`a < > b` is not `a <> b`);
+#   - the problem's data version: its pre-built schema name, which already
+#     carries a hash of its Schema scripts and data sources (or that hash
+#     itself in legacy mode), plus the engine;
+#   - for Submit, the solution query and compare options;
+#   - everything else that shapes the result page (offset, page size, ...).
+#
+# A problem whose scripts, data or solution change therefore gets new keys on
+# its own, in every process; stale entries just age out. Saves in the admin and
+# seed_problems also invalidate a problem's entries explicitly.
+#
+# Two backends: 'local', an in-process LRU bounded by entry count and bytes,
+# and 'django', the Django cache framework (PRACTICE_RESULT_CACHE_ALIAS), shared
+# between processes. Both expire entries after PRACTICE_RESULT_CACHE_TTL seconds.
+# Hits, misses and uncacheable queries are counted in practice_result_cache_total.
+
+import hashlib
+import json
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .classifier import TokenizeError, tokenize
+from .metrics import Counter
+
+CACHE_EVENTS = Counter(
+    'practice_result_cache_total', "Result cache lookups, by outcome (hit, miss, skip = not cacheable).",
+    ['action', 'result'])
+
+# --- Normalizing a query ---
+
+# Literals, quoted identifiers and comments, for `cacheable`
+_TOKENS = re.compile(r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<literal>
+          [eE]'(?:[^'\\]|\\.|'')*'      # escape string
+        | '(?:[^']|'')*'                # string
+        | "(?:[^"]|"")*"                # quoted identifier
+        | (?P<tag>\$[A-Za-z_0-9]*\$).*?(?P=tag)  # dollar-quoted string
+      )
+""", re.VERBOSE | re.DOTALL)
+_LITERALS = ('string', 'ident', 'dollar')
+
+
+def normalize_sql(sql):
+    """The query with comments removed, whitespace collapsed and everything outside literals lower-cased."""
+    try:
+        tokens = list(tokenize(sql))
+    except TokenizeError:
+        # Not a query that will run (the classifier rejects it); no need to match reformattings
+        return sql.strip()
+    parts = []
+    for kind, text in tokens:
+        if kind in ('space', 'comment'):
+            # A comment separates tokens like whitespace does
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        else:
+            parts.append(text if kind in _LITERALS else text.lower())
+    # Trailing semicolons don't change the query (a literal always ends in its quote)
+    return ''.join(parts).rstrip('; ')
+
+
+# --- Which queries may be cached ---
+
+# Functions whose result changes between calls (or reads changing server state)
+VOLATILE_FUNCTIONS = {
+    'random', 'setseed', 'gen_random_uuid', 'uuid_generate_v4', 'nextval', 'currval', 'lastval', 'setval',
+    'now', 'clock_timestamp', 'statement_timestamp', 'transaction_timestamp', 'timeofday',
+    'current_date', 'current_time', 'current_timestamp', 'localtime', 'localtimestamp',
+    'pg_sleep', 'txid_current', 'pg_current_xact_id', 'pg_backend_pid', 'inet_client_addr',
+    'randomblob', 'changes', 'last_insert_rowid', 'total_changes', 'julianday',
+}
+WRITE_KEYWORDS = {
+    'insert', 'update', 'delete', 'merge', 'copy', 'create', 'drop', 'alter', 'truncate',
+    'grant', 'revoke', 'lock', 'call', 'do', 'set', 'reset', 'vacuum', 'analyze', 'refresh',
+}
+_WORD = re.compile(r'[a-z_][a-z0-9_$]*')
+
+
+def cacheable(sql):
+    """Only deterministic, read-only queries are cached."""
+    code = _TOKENS.sub(' ', sql).lower()
+    for word in _WORD.findall(code):
+        if word in VOLATILE_FUNCTIONS or word in WRITE_KEYWORDS:
+            return False
+        # System catalogs and statistics views change under our feet
+        if word.startswith('pg_') or word in ('information_schema', 'sqlite_master', 'sqlite_schema'):
+            return False
+    # SELECT ... FOR UPDATE/SHARE takes locks
+    return not re.search(r'\bfor\s+(?:no\s+key\s+)?(?:update|share|key\s+share)\b', code)
+
+
+# --- Backends ---
+
+class LocalResultCache:
+    """In-process LRU cache of pickled results, bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()       # key -> (problem_id, expires_at, pickled value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, problem_id, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, problem_id, key, data):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (problem_id, time.monotonic() + self.ttl, data)
+            self._bytes += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, problem_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] == problem_id]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        self._bytes -= len(self._entries.pop(key)[2])
+
+
+class DjangoResultCache:
+    """Results in a Django cache; a per-problem generation number makes invalidation O(1)."""
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _generation_key(self, problem_id):
+        return f"practice:result-cache-generation:{problem_id}"
+
+    def _key(self, problem_id, key):
+        return f"{key}:{self.cache.get(self._generation_key(problem_id), 0)}"
+
+    def get(self, problem_id, key):
+        return self.cache.get(self._key(problem_id, key))
+
+    def set(self, problem_id, key, data):
+        self.cache.set(self._key(problem_id, key), data, self.ttl)
+
+    def invalidate(self, problem_id):
+        generation_key = self._generation_key(problem_id)
+        try:
+            self.cache.incr(generation_key)
+        except ValueError:
+            self.cache.set(generation_key, 1, None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def result_cache():
+    """This process's result cache backend, or None when caching is off."""
+    global _backend
+    kind = getattr(settings, 'PRACTICE_RESULT_CACHE_BACKEND', 'local')
+    if not kind:
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                ttl = getattr(settings, 'PRACTICE_RESULT_CACHE_TTL', 300)
+                if kind == 'django':
+                    _backend = DjangoResultCache(getattr(settings, 'PRACTICE_RESULT_CACHE_ALIAS', 'default'), ttl)
+                elif kind == 'local':
+                    _backend = LocalResultCache(
+                        max_entries=getattr(settings, 'PRACTICE_RESULT_CACHE_MAX_ENTRIES', 1000),
+                        max_bytes=getattr(settings, 'PRACTICE_RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+                        ttl=ttl,
+                    )
+                else:
+                    raise ValueError(f"Unknown PRACTICE_RESULT_CACHE_BACKEND: {kind!r}")
+    return _backend
+
+
+def max_entry_bytes():
+    return getattr(settings, 'PRACTICE_RESULT_CACHE_MAX_ENTRY_BYTES', 1024 * 1024)
+
+
+# --- Keys ---
+
+def data_version(problem):
+    """Changes whenever the problem's tables or data change."""
+    if problem.data_schema:
+        return problem.data_schema
+    # Legacy mode: hash the scripts and data sources themselves
+    from .sandbox import schema_version
+
+    return schema_version([
+        *(schema.script for schema in problem.schemas.all()),
+        *(f"{source.kind}:{source.table}:{source.content_hash}" for source in problem.data_sources.all()),
+    ])
+
+
+def cache_key(action, problem, normalized_sql, offset=0):
+    # Imported here: execution.py uses this module
+    from .execution import count_rows_limit, count_total_rows, result_byte_limit, result_page_size
+    from .grading import query_hash
+    from .result_diff import diff_max_rows
+    from .stats import explain_runs
+
+    parts = [
+        action, problem.pk, problem.engine, data_version(problem), normalized_sql, offset,
+        result_page_size(), result_byte_limit(), count_total_rows(), count_rows_limit(), explain_runs(),
+    ]
+    if action == 'submit':
+        solution = problem.solution
+        parts += [query_hash(solution.query), solution.ordered, solution.float_digits,
+                  solution.check_column_names, diff_max_rows()]
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+    return f"practice:result:{problem.pk}:{digest}"
+
+
+# --- Lookups ---
+
+def lookup(action, problem, user_query, offset=0):
+    """
+    (cache key, cached result). The key is None when the query can't be cached,
+    and the result None on a miss.
+    """
+    backend = result_cache()
+    if backend is None:
+        return None, None
+    if not cacheable(user_query):
+        CACHE_EVENTS.inc(action=action, result='skip')
+        return None, None
+    key = cache_key(action, problem, normalize_sql(user_query), offset)
+    data = backend.get(problem.pk, key)
+    if data is None:
+        CACHE_EVENTS.inc(action=action, result='miss')
+        return key, None
+    CACHE_EVENTS.inc(action=action, result='hit')
+    return key, pickle.loads(data)
+
+
+def store(key, problem, result):
+    backend = result_cache()
+    if key is None or backend is None:
+        return
+    data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) <= max_entry_bytes():
+        backend.set(problem.pk, key, data)
+
+
+def invalidate_problem(problem_id):
+    """Forget every cached result of a problem (its data, scripts or solution changed)."""
+    backend = result_cache()
+    if backend is not None:
+        backend.invalidate(problem_id)
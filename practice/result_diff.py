@@ -0,0 +1,199 @@
+# practice/result_diff.py
+#
+# What exactly is wrong with a wrong submission? The row-level diff lists:
+#
+#   - missing rows  (in the expected result, not in the user's)
+#   - extra rows    (in the user's result, not in the expected one)
+#   - rows with the wrong multiplicity (both have them, a different number of times)
+#   - column count / name mismatches
+#
+# Both queries are streamed once more, side by side, and rows are counted by
+# their grading hash (grading.row_hash), so equal rows compare equal exactly as
+# they do for the verdict. To keep memory bounded, only rows in the hash
+# buckets that grading already found to differ are counted (a bucket whose
+# count and fingerprint match holds no difference), no more than
+# PRACTICE_DIFF_MAX_TRACKED_ROWS distinct rows are ever held, and only the first
+# PRACTICE_DIFF_MAX_ROWS differences are reported. When grading stopped
+# reading early (e.g. the user's query returned far too many rows), there is no
+# row diff at all: it would have to read both results in full.
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.conf import settings
+
+from .grading import DIFF_BUCKETS, check_columns, iter_batches, row_hash
+
+DIFF_MISSING = 'missing'
+DIFF_EXTRA = 'extra'
+DIFF_COUNT = 'count'
+
+
+def diff_max_rows():
+    return getattr(settings, 'PRACTICE_DIFF_MAX_ROWS', 20)
+
+
+def diff_max_tracked_rows():
+    return getattr(settings, 'PRACTICE_DIFF_MAX_TRACKED_ROWS', 50000)
+
+
+@dataclass
+class RowDifference:
+    kind: str           # DIFF_MISSING, DIFF_EXTRA or DIFF_COUNT
+    row: tuple
+    expected: int       # times the row appears in the expected result
+    actual: int         # ... and in the user's
+
+    def as_dict(self):
+        return {'kind': self.kind, 'row': list(self.row), 'expected': self.expected, 'actual': self.actual}
+
+
+@dataclass
+class ResultDiff:
+    expected_columns: list
+    columns: list
+    column_error: str = ''                      # column count/name mismatch, if any
+    differences: list = field(default_factory=list)
+    truncated: bool = False                     # there may be more differences than listed
+    first_order_mismatch: Optional[int] = None  # 1-based row where the order first differs (ordered problems)
+
+    def as_dict(self):
+        return {
+            'expected_columns': self.expected_columns,
+            'columns': self.columns,
+            'column_error': self.column_error,
+            'differences': [difference.as_dict() for difference in self.differences],
+            'truncated': self.truncated,
+            'first_order_mismatch': self.first_order_mismatch,
+        }
+
+
+def choose_buckets(differing_buckets, expected, max_differences, max_tracked):
+    """
+    The buckets to count rows in: differing buckets (each holds at least one
+    difference), as many as the tracking budget allows. None means "every bucket".
+    """
+    if differing_buckets is None:
+        return None
+    chosen, tracked = set(), 0
+    for bucket in differing_buckets[:max_differences]:
+        size = expected.bucket_counts[bucket] if expected is not None and expected.bucket_counts else 0
+        if chosen and tracked + size > max_tracked:
+            break
+        chosen.add(bucket)
+        tracked += size
+    return chosen
+
+
+class RowDiffer:
+    """
+    Multiset difference of two row streams, fed in batches (driver-agnostic,
+    like grading.ExpectedMatcher). Only rows in the chosen differing buckets of
+    the failed `comparison` are counted (every row, if it has none), and at most
+    `max_tracked` distinct rows.
+    """
+
+    def __init__(self, comparison, options, expected=None, max_differences=None, max_tracked=None):
+        self.options = options
+        self.max_differences = diff_max_rows() if max_differences is None else max_differences
+        self.max_tracked = diff_max_tracked_rows() if max_tracked is None else max_tracked
+        self.buckets = choose_buckets(comparison.differing_buckets, expected, self.max_differences, self.max_tracked)
+        # Differing buckets left out: there are differences that won't be counted
+        self.skipped_buckets = self.buckets is not None and len(self.buckets) < len(comparison.differing_buckets)
+        self.counts = {}            # row hash -> [row, expected count, actual count], in first-seen order
+        self.overflow = False       # some rows weren't counted: the tracking budget ran out
+        # Row hashes of whichever side is ahead, to find the first out-of-order row
+        self._pending = deque()
+        self._pending_side = None
+        self._position = 0
+        self.first_order_mismatch = None
+
+    def _add(self, rows, side):
+        float_digits = self.options.float_digits
+        for row in rows:
+            digest = row_hash(row, float_digits)
+            if self.options.ordered and self.first_order_mismatch is None:
+                self._track_order(digest, side)
+            if self.buckets is not None and digest % DIFF_BUCKETS not in self.buckets:
+                continue
+            entry = self.counts.get(digest)
+            if entry is None:
+                # Once the budget is spent no new rows are tracked, on either side, so the
+                # counts of the rows that are tracked stay exact
+                if len(self.counts) >= self.max_tracked:
+                    self.overflow = True
+                    continue
+                entry = self.counts[digest] = [row, 0, 0]
+            entry[side] += 1
+
+    def _track_order(self, digest, side):
+        if not self._pending or self._pending_side == side:
+            if len(self._pending) >= self.max_tracked:
+                # One side is far ahead of the other; give up on the order check
+                self.first_order_mismatch = 0
+                return
+            self._pending.append(digest)
+            self._pending_side = side
+            return
+        self._position += 1
+        if self._pending.popleft() != digest:
+            self.first_order_mismatch = self._position
+
+    def feed_expected(self, rows):
+        self._add(rows, 1)
+
+    def feed_actual(self, rows):
+        self._add(rows, 2)
+
+    def finish(self, expected_columns, columns):
+        diff = ResultDiff(expected_columns=expected_columns, columns=columns,
+                          column_error=check_columns(columns, expected_columns, self.options))
+        for row, expected, actual in self.counts.values():
+            if expected == actual:
+                continue
+            kind = DIFF_MISSING if not actual else DIFF_EXTRA if not expected else DIFF_COUNT
+            if len(diff.differences) == self.max_differences:
+                diff.truncated = True
+                break
+            diff.differences.append(RowDifference(kind, row, expected, actual))
+        # Missing rows first, then extra rows, then wrong counts
+        order = {DIFF_MISSING: 0, DIFF_EXTRA: 1, DIFF_COUNT: 2}
+        diff.differences.sort(key=lambda difference: order[difference.kind])
+        diff.truncated = diff.truncated or self.overflow or self.skipped_buckets
+        if self.first_order_mismatch:
+            diff.first_order_mismatch = self.first_order_mismatch
+        return diff
+
+
+def column_diff(comparison, expected_columns, options):
+    """A ResultDiff for results whose columns can't be compared row by row (None if they can)."""
+    error = check_columns(comparison.columns, expected_columns, options)
+    if error and len(comparison.columns) != len(expected_columns):
+        return ResultDiff(expected_columns=expected_columns, columns=comparison.columns, column_error=error)
+    return None
+
+
+def diff_cursors(user_cursor, solution_cursor, comparison, options, expected=None):
+    """
+    Stream two freshly executed cursors (user, solution) side by side into a
+    ResultDiff. `comparison` is the failed grading Comparison.
+    """
+    differ = RowDiffer(comparison, options, expected)
+    solution_batches = iter_batches(solution_cursor, options.batch_size)
+    user_batches = iter_batches(user_cursor, options.batch_size)
+    columns = None
+    while True:
+        solution_rows, user_rows = next(solution_batches, None), next(user_batches, None)
+        if columns is None:
+            # Server-side cursors only have a description after the first fetch
+            expected_columns = [col[0] for col in solution_cursor.description or []]
+            columns = [col[0] for col in user_cursor.description or []]
+            if len(columns) != len(expected_columns):
+                return ResultDiff(expected_columns=expected_columns, columns=columns,
+                                  column_error=check_columns(columns, expected_columns, options))
+        if solution_rows is None and user_rows is None:
+            break
+        differ.feed_expected(solution_rows or [])
+        differ.feed_actual(user_rows or [])
+    return differ.finish(expected_columns, columns)
@@ -0,0 +1,79 @@
+# practice/routers.py
+#
+# Sending user SQL to a read replica.
+#
+# Queries on a pre-built problem schema only ever read: the classifier (see
+# classifier.py) turns everything else away before it reaches a database, and
+# the sandbox transaction is READ ONLY. So they can run on a streaming replica
+# of the main database instead of the primary, and sandbox load can grow by
+# adding replicas behind that address.
+#
+# PRACTICE_SANDBOX_REPLICA_ALIAS names the replica's DATABASES entry
+# ('sandbox_replica', defined in project/settings.py when SANDBOX_REPLICA_HOST
+# is set). When it can't be reached, user SQL goes to the primary's 'sandbox'
+# alias for PRACTICE_SANDBOX_REPLICA_RETRY_INTERVAL seconds, then the replica
+# is tried again. Legacy-mode problems (schema scripts run on every request)
+# have to write, so they always stay on 'default'.
+#
+# SandboxRouter is the Django side of this (DATABASE_ROUTERS): the ORM and
+# migrations never touch the replica.
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import Counter
+
+logger = logging.getLogger('practice.routers')
+
+REPLICA_FALLBACKS = Counter(
+    'practice_sandbox_replica_fallbacks_total', "Times the read replica couldn't be reached and user SQL went to the primary.")
+
+_unavailable_until = {}         # alias -> time.monotonic() when it may be tried again
+_lock = threading.Lock()
+
+
+def replica_alias():
+    """The read replica's database alias, or None if there is none."""
+    alias = getattr(settings, 'PRACTICE_SANDBOX_REPLICA_ALIAS', 'sandbox_replica')
+    return alias if alias and alias in settings.DATABASES else None
+
+
+def replica_available(alias):
+    with _lock:
+        retry_at = _unavailable_until.get(alias)
+        if retry_at is None:
+            return True
+        if retry_at <= time.monotonic():
+            del _unavailable_until[alias]
+            return True
+        return False
+
+
+def mark_unavailable(alias, error=None):
+    """Stop sending user SQL to `alias` for PRACTICE_SANDBOX_REPLICA_RETRY_INTERVAL seconds."""
+    interval = getattr(settings, 'PRACTICE_SANDBOX_REPLICA_RETRY_INTERVAL', 30)
+    with _lock:
+        _unavailable_until[alias] = time.monotonic() + interval
+    REPLICA_FALLBACKS.inc()
+    logger.warning("Read replica %r is unavailable (%s); using the primary for %ss", alias, error, interval)
+
+
+class SandboxRouter:
+    """Keeps the ORM and migrations off the read replica."""
+
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
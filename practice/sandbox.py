@@ -0,0 +1,322 @@
+# practice/sandbox.py
+#
+# Where user SQL actually runs.
+#
+# Every problem's tables are built ONCE (by `seed_problems` or an admin save)
+# into their own Postgres schema, e.g. `problem_3_v1a2b3c4d5e6`. Run/Submit then
+# point `search_path` at that schema inside a READ ONLY transaction, so a request
+# never executes DROP/CREATE/INSERT and users on the same problem never block
+# each other on table locks.
+#
+# Problems that have not been built yet (empty `Problem.data_schema`) keep the
+# old behaviour: their schema scripts are executed at the start of every request.
+# Problems with bulk data (DataSource rows) are refused in that mode: reloading
+# a million generated rows per request would take seconds each time.
+#
+# Bulk data (CSV/TSV files and generator specs, see dataload.py) is loaded into
+# the pre-built schema with COPY / set-based INSERTs, followed by the index
+# scripts and ANALYZE.
+#
+# Every sandbox transaction also gets an ExecutionPolicy (statement timeout,
+# work_mem, ...) so a runaway query can't hold a worker or backend forever.
+#
+# User SQL runs on the separate `sandbox` database alias (its own persistent
+# connections, ideally a read-only role), behind an admission gate, so a burst
+# of heavy queries never starves the ORM's connection for sessions and lookups.
+# When a read replica is configured, it runs there instead (see routers.py).
+
+import hashlib
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.db.models import prefetch_related_objects
+
+from .dataload import build_maintenance_work_mem, load_problem_data
+from .metrics import phase, record_phase
+from .routers import mark_unavailable, replica_alias, replica_available
+
+SCHEMA_PREFIX = 'problem_'
+SANDBOX_DB_ALIAS = 'sandbox'
+
+
+def sandbox_alias():
+    """The database alias user SQL runs on; falls back to 'default' if 'sandbox' isn't configured."""
+    return SANDBOX_DB_ALIAS if SANDBOX_DB_ALIAS in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def read_alias():
+    """Where read-only user SQL runs: the read replica when there is one and it's up, else sandbox_alias()."""
+    replica = replica_alias()
+    if replica and replica_available(replica):
+        return replica
+    return sandbox_alias()
+
+
+def sandbox_connection(problem):
+    """The connection `problem_cursor` runs `problem`'s queries on."""
+    if not (problem.data_schema and prebuilt_schemas_enabled()):
+        # Legacy mode needs to run DDL, so it stays on the (privileged) default connection
+        return connections[DEFAULT_DB_ALIAS]
+    alias = read_alias()
+    db = connections[alias]
+    if alias != sandbox_alias():
+        try:
+            db.ensure_connection()
+        except OperationalError as e:
+            mark_unavailable(alias, e)
+            db = connections[sandbox_alias()]
+    return db
+
+
+class SandboxBusy(Exception):
+    """Too many user queries are running or waiting in this process."""
+
+
+class AdmissionGate:
+    """
+    Lets at most `max_concurrent` callers in at once. Up to `max_waiting` more
+    may queue for `wait_timeout` seconds; anyone beyond that is turned away
+    immediately with SandboxBusy.
+    """
+
+    def __init__(self, max_concurrent, max_waiting, wait_timeout):
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_waiting:
+                    raise SandboxBusy("Too many queries are queued.")
+                self._waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                raise SandboxBusy("Timed out waiting for a free query slot.")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+admission_gate = AdmissionGate(
+    max_concurrent=getattr(settings, 'PRACTICE_SANDBOX_MAX_CONCURRENT', 8),
+    max_waiting=getattr(settings, 'PRACTICE_SANDBOX_MAX_WAITING', 16),
+    wait_timeout=getattr(settings, 'PRACTICE_SANDBOX_WAIT_TIMEOUT', 2),
+)
+
+
+def schema_version(scripts):
+    """Short hash of a problem's schema scripts (and data fingerprints); changes whenever the data changes."""
+    digest = hashlib.sha256()
+    for script in scripts:
+        digest.update(script.strip().encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:12]
+
+
+def schema_name_for(problem, scripts):
+    return f"{SCHEMA_PREFIX}{problem.pk}_v{schema_version(scripts)}"
+
+
+def prebuilt_schemas_enabled():
+    return getattr(settings, 'PRACTICE_PREBUILT_SCHEMAS', True)
+
+
+def prefetch_problem_data(problems):
+    """
+    Legacy mode sets a problem's tables up from its Schema and DataSource rows on
+    every query (and the result cache hashes them): load them once, up front, in
+    two queries for all of `problems`, instead of once per use.
+    """
+    legacy = [problem for problem in problems if not (problem.data_schema and prebuilt_schemas_enabled())]
+    if legacy:
+        prefetch_related_objects(legacy, 'schemas', 'data_sources')
+
+
+def build_problem_schema(problem):
+    """
+    (Re)build the dedicated Postgres schema for `problem` and record its name on
+    the Problem row. Older versions of the schema are dropped in the same transaction.
+    """
+    schemas = list(problem.schemas.all())
+    data_sources = list(problem.data_sources.all())
+    name = schema_name_for(problem, [
+        *(schema.script for schema in schemas),
+        *(f"{source.kind}:{source.table}:{source.content_hash}" for source in data_sources),
+    ])
+    quoted = connection.ops.quote_name(name)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {quoted} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {quoted}")
+        cursor.execute(f"SET LOCAL search_path TO {quoted}")
+        cursor.execute("SELECT set_config('maintenance_work_mem', %s, true)", [build_maintenance_work_mem()])
+        # Tables, then COPY/generated data, then indexes. The tables are created in this
+        # transaction, so with wal_level=minimal the COPY doesn't even need to be WAL-logged.
+        load_problem_data(cursor, schemas, data_sources)
+
+        # --- Fresh statistics, so the first user query already gets a sensible plan ---
+        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s", [name])
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"ANALYZE {quoted}.{connection.ops.quote_name(table)}")
+
+        # --- Remove stale versions of this problem's schema ---
+        cursor.execute(
+            "SELECT nspname FROM pg_namespace WHERE nspname ~ %s AND nspname <> %s",
+            [rf'^{re.escape(SCHEMA_PREFIX)}{problem.pk}_v[0-9a-f]+$', name],
+        )
+        for (stale_name,) in cursor.fetchall():
+            cursor.execute(f"DROP SCHEMA {connection.ops.quote_name(stale_name)} CASCADE")
+
+        # --- Let the sandbox role read it (when it's a different, restricted role) ---
+        sandbox_user = settings.DATABASES[sandbox_alias()].get('USER')
+        if sandbox_user and sandbox_user != connection.settings_dict.get('USER'):
+            role = connection.ops.quote_name(sandbox_user)
+            cursor.execute(f"GRANT USAGE ON SCHEMA {quoted} TO {role}")
+            cursor.execute(f"GRANT SELECT ON ALL TABLES IN SCHEMA {quoted} TO {role}")
+
+        cursor.execute("SET LOCAL search_path TO DEFAULT")
+        type(problem).objects.filter(pk=problem.pk).update(data_schema=name)
+
+    problem.data_schema = name
+    return name
+
+
+@dataclass(frozen=True)
+class ExecutionPolicy:
+    """
+    Limits applied (with SET LOCAL semantics) to every sandbox transaction.
+    Empty values leave the server default in place.
+    """
+    statement_timeout_ms: int = 5000
+    lock_timeout_ms: int = 1000
+    idle_in_transaction_timeout_ms: int = 10000
+    work_mem: str = '16MB'
+    # Only superusers may change temp_file_limit; with a restricted role set it
+    # on the role instead (ALTER ROLE ... SET temp_file_limit = ...).
+    temp_file_limit: str = ''
+
+    def settings(self):
+        values = {
+            'statement_timeout': self.statement_timeout_ms,
+            'lock_timeout': self.lock_timeout_ms,
+            'idle_in_transaction_session_timeout': self.idle_in_transaction_timeout_ms,
+            'work_mem': self.work_mem,
+            'temp_file_limit': self.temp_file_limit,
+        }
+        return {name: str(value) for name, value in values.items() if value not in (None, '')}
+
+
+def execution_policy(problem):
+    """The site-wide policy (settings.PRACTICE_EXECUTION_POLICY) with the problem's own overrides."""
+    policy = ExecutionPolicy(**getattr(settings, 'PRACTICE_EXECUTION_POLICY', {}))
+    overrides = {
+        'statement_timeout_ms': problem.statement_timeout_ms,
+        'work_mem': problem.work_mem,
+        'temp_file_limit': problem.temp_file_limit,
+    }
+    return replace(policy, **{name: value for name, value in overrides.items() if value})
+
+
+class QueryLimitError(OperationalError):
+    """A query was cancelled for exceeding one of the ExecutionPolicy limits (named by `limit`)."""
+
+    def __init__(self, message, limit='statement_timeout'):
+        super().__init__(message)
+        self.limit = limit
+
+
+def limit_error(sqlstate, policy):
+    """The QueryLimitError for a Postgres SQLSTATE, or None if it isn't a policy limit."""
+    if sqlstate == '57014':     # query_canceled
+        return QueryLimitError(f"Your query exceeded {policy.statement_timeout_ms} ms and was cancelled.")
+    if sqlstate == '55P03':     # lock_not_available
+        return QueryLimitError(f"Your query waited more than {policy.lock_timeout_ms} ms for a lock and was cancelled.", 'lock_timeout')
+    if sqlstate == '53400':     # configuration_limit_exceeded (temp_file_limit)
+        return QueryLimitError(f"Your query used more than {policy.temp_file_limit} of temporary disk space and was cancelled.", 'temp_file_limit')
+    return None
+
+
+def prebuilt_settings(problem):
+    """Transaction settings that pin a pre-built problem's sandbox transaction to its schema, read-only."""
+    return {
+        'transaction_read_only': 'on',
+        'search_path': connection.ops.quote_name(problem.data_schema),
+    }
+
+
+@contextmanager
+def problem_cursor(problem):
+    """
+    Yield a cursor whose unqualified table names resolve to `problem`'s data,
+    with the problem's ExecutionPolicy applied to the transaction.
+
+    Raises SandboxBusy when the process is already running (and queueing) as
+    many user queries as PRACTICE_SANDBOX_MAX_CONCURRENT/MAX_WAITING allow.
+    """
+    policy = execution_policy(problem)
+    config = policy.settings()
+    prebuilt = bool(problem.data_schema) and prebuilt_schemas_enabled()
+    if not prebuilt and problem.data_sources.all():
+        raise OperationalError(
+            "This problem's data is only loaded when its schema is pre-built; "
+            "run seed_problems with PRACTICE_PREBUILT_SCHEMAS on."
+        )
+    db = sandbox_connection(problem)
+
+    started = time.perf_counter()
+    try:
+        with admission_gate.slot(), transaction.atomic(using=db.alias), db.cursor() as cursor:
+            # Waiting for a slot (and, if needed, connecting)
+            record_phase('acquire', time.perf_counter() - started)
+
+            with phase('schema_setup'):
+                if prebuilt:
+                    config.update(prebuilt_settings(problem))
+                else:
+                    # Legacy mode: set up the tables in the shared schema on every request
+                    load_problem_data(cursor, problem.schemas.all(), problem.data_sources.all())
+
+                # Apply every setting in a single round-trip (set_config(..., true) == SET LOCAL)
+                if config:
+                    cursor.execute(
+                        "SELECT " + ", ".join(["set_config(%s, %s, true)"] * len(config)),
+                        [item for name_value in config.items() for item in name_value],
+                    )
+            yield cursor
+    except OperationalError as e:
+        pgcode = getattr(e.__cause__, 'pgcode', None)
+        if pgcode is None and db.alias == replica_alias():
+            # Lost the connection (no SQLSTATE): use the primary until the replica is back
+            mark_unavailable(db.alias, e)
+        error = limit_error(pgcode, policy)
+        if error is None:
+            raise
+        raise error from e
+
+
+@contextmanager
+def streaming_cursor(cursor):
+    """
+    Open a named (server-side) cursor in the same transaction as `cursor`, so a
+    result is pulled from Postgres in `fetchmany` batches instead of all at once.
+    Only single SELECT/WITH statements can run through it.
+    """
+    named = cursor.cursor.connection.cursor(name=f"sandbox_{uuid.uuid4().hex}")
+    # Wrap it like any Django cursor so driver errors surface as django.db.Error
+    with cursor.db.make_cursor(named) as wrapped:
+        yield wrapped
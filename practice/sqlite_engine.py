@@ -0,0 +1,250 @@
+# practice/sqlite_engine.py
+#
+# In-memory SQLite execution for small, self-contained problems
+# (Problem.engine == 'sqlite').
+#
+# The problem's pre-built Postgres schema stays the source of truth: its tables
+# are copied ONCE per process into an in-memory SQLite database, whose
+# serialized image is cached here together with the solution's expected result
+# on SQLite. Every Run/Submit then gets its own private copy of the image
+# (`sqlite3.Connection.deserialize`), so setup takes microseconds, requests
+# can't see each other, and Postgres isn't touched at all.
+#
+# `seed_problems` checks that the solution gives the same result on both
+# engines before a problem is allowed to run on SQLite.
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from django.db import DatabaseError
+
+from .engines import ENGINE_SQLITE
+from .grading import ResultSummary, compare_options, compare_with_expected, summarize_cursor
+from .result_diff import column_diff, diff_cursors, diff_max_rows
+from .sandbox import QueryLimitError, execution_policy, prebuilt_schemas_enabled, problem_cursor
+from .stats import QueryStats
+
+# Postgres data types -> SQLite column types. TIMESTAMP/DATE columns are read
+# back as datetime/date (see the converters below), so results look the same
+# as on Postgres.
+SQLITE_TYPES = {
+    'smallint': 'INTEGER', 'integer': 'INTEGER', 'bigint': 'INTEGER',
+    'numeric': 'NUMERIC', 'real': 'REAL', 'double precision': 'REAL',
+    'boolean': 'INTEGER',
+    'date': 'DATE',
+    'timestamp without time zone': 'TIMESTAMP', 'timestamp with time zone': 'TIMESTAMP',
+}
+
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+
+# The only things a user query may do on its copy of the data
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# VM instructions between two deadline checks
+PROGRESS_INTERVAL = 10000
+
+
+def sqlite_supported(problem):
+    """SQLite snapshots are copied from the pre-built Postgres schema, so it must exist."""
+    return problem.engine == ENGINE_SQLITE and bool(problem.data_schema) and prebuilt_schemas_enabled()
+
+
+@dataclass
+class Snapshot:
+    data_schema: str            # the Postgres schema the image was copied from
+    image: bytes
+    expected: ResultSummary     # the solution's result, on SQLite
+    solution_hash: str
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _authorizer(action, *args):
+    return sqlite3.SQLITE_OK if action in ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _sqlite_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, (int, float, str, bytes)) or value is None:
+        return value
+    # Decimal, UUID, ...: NUMERIC/TEXT affinity takes care of the rest
+    return str(value)
+
+
+def copy_problem_data(problem):
+    """Copy every table of the problem's pre-built Postgres schema into a new in-memory SQLite database."""
+    target = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    with problem_cursor(problem) as cursor:
+        cursor.execute(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = %s ORDER BY table_name, ordinal_position",
+            [problem.data_schema],
+        )
+        tables = {}
+        for table, column, data_type in cursor.fetchall():
+            tables.setdefault(table, []).append((column, SQLITE_TYPES.get(data_type, 'TEXT')))
+
+        for table, columns in tables.items():
+            quoted_table = '"' + table.replace('"', '""') + '"'
+            column_sql = ', '.join('"' + name.replace('"', '""') + '" ' + sqlite_type for name, sqlite_type in columns)
+            target.execute(f"CREATE TABLE {quoted_table} ({column_sql})")
+            cursor.execute(f"SELECT * FROM {cursor.db.ops.quote_name(table)}")
+            placeholders = ', '.join('?' * len(columns))
+            while rows := cursor.fetchmany(1000):
+                target.executemany(
+                    f"INSERT INTO {quoted_table} VALUES ({placeholders})",
+                    [[_sqlite_value(value) for value in row] for row in rows],
+                )
+    target.commit()
+    return target
+
+
+def build_snapshot(problem):
+    """Build the SQLite image of `problem` and the solution's expected result on it."""
+    source = copy_problem_data(problem)
+    image = source.serialize()
+    source.close()
+
+    solution = problem.solution
+    with sqlite_connection(problem, image) as conn:
+        cursor = conn.execute(solution.query)
+        expected = summarize_cursor(cursor, compare_options(solution))
+    return Snapshot(problem.data_schema, image, expected, solution.query)
+
+
+def get_snapshot(problem):
+    """This process's snapshot of `problem`, (re)built when the data or solution changed."""
+    snapshot = _snapshots.get(problem.pk)
+    if snapshot is None or snapshot.data_schema != problem.data_schema or snapshot.solution_hash != problem.solution.query:
+        with _snapshots_lock:
+            snapshot = _snapshots.get(problem.pk)
+            if snapshot is None or snapshot.data_schema != problem.data_schema or snapshot.solution_hash != problem.solution.query:
+                snapshot = _snapshots[problem.pk] = build_snapshot(problem)
+    return snapshot
+
+
+@contextmanager
+def sqlite_connection(problem, image):
+    """
+    A private, writable-but-locked-down copy of `image`, with the problem's
+    statement timeout enforced through a progress handler.
+    """
+    policy = execution_policy(problem)
+    conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    try:
+        conn.deserialize(image)
+        conn.set_authorizer(_authorizer)
+        deadline = time.monotonic() + policy.statement_timeout_ms / 1000 if policy.statement_timeout_ms else None
+        if deadline:
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_INTERVAL)
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if deadline and str(e) == 'interrupted':
+                raise QueryLimitError(f"Your query exceeded {policy.statement_timeout_ms} ms and was cancelled.") from e
+            raise DatabaseError(str(e)) from e
+        except sqlite3.Error as e:
+            # Surface SQLite errors like Postgres ones (django.db.Error) to the views
+            raise DatabaseError(str(e)) from e
+    finally:
+        conn.close()
+
+
+def run_query(problem, user_query, offset=0):
+    """`execution.run_query` on the problem's SQLite snapshot."""
+    # Imported here: execution.py dispatches to this module
+    from .execution import PageBuilder, count_rows_limit, count_total_rows
+
+    snapshot = get_snapshot(problem)
+    builder = PageBuilder(offset)
+    with sqlite_connection(problem, snapshot.image) as conn:
+        started = time.perf_counter()
+        cursor = conn.execute(user_query)
+        skipped = 0
+        while skipped < offset and (rows := cursor.fetchmany(min(offset - skipped, 1000))):
+            skipped += len(rows)
+        while builder.wanted():
+            rows = cursor.fetchmany(builder.wanted())
+            if not rows:
+                break
+            builder.add(rows)
+        rows_after = None
+        if count_total_rows():
+            rows_after, limit = 0, count_rows_limit()
+            while rows_after <= limit and (rows := cursor.fetchmany(1000)):
+                rows_after += len(rows)
+        columns = [col[0] for col in cursor.description or []]
+        page = builder.finish(columns, rows_after)
+        page.stats = QueryStats(elapsed_ms=round((time.perf_counter() - started) * 1000, 2), rows=page.row_count)
+    return page
+
+
+def grade_query(problem, user_query):
+    """`execution.grade_query` on the problem's SQLite snapshot."""
+    from .execution import comparison_page, result_page_size
+
+    snapshot = get_snapshot(problem)
+    options = compare_options(problem.solution)
+    with sqlite_connection(problem, snapshot.image) as conn:
+        cursor = conn.execute(user_query)
+        comparison = compare_with_expected(cursor, snapshot.expected, options, keep_rows=result_page_size())
+        if not comparison.correct and diff_max_rows():
+            comparison.diff = column_diff(comparison, snapshot.expected.columns, options)
+            if comparison.diff is None and comparison.complete:
+                try:
+                    comparison.diff = diff_cursors(
+                        conn.execute(user_query), conn.execute(problem.solution.query), comparison, options, snapshot.expected)
+                except sqlite3.Error:
+                    pass
+    return comparison, comparison_page(comparison)
+
+
+def explain_query(problem, user_query):
+    """`execution.explain_query` on SQLite: EXPLAIN QUERY PLAN, plus one timed execution."""
+    snapshot = get_snapshot(problem)
+    with sqlite_connection(problem, snapshot.image) as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + user_query).fetchall()
+        started = time.perf_counter()
+        cursor = conn.execute(user_query)
+        rows = 0
+        while batch := cursor.fetchmany(1000):
+            rows += len(batch)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    # (id, parent, notused, detail) rows -> an indented tree
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in plan:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + ('->  ' if depth[node_id] else '') + detail)
+    return QueryStats(elapsed_ms=elapsed_ms, rows=rows, execution_ms=elapsed_ms, plan='\n'.join(lines))
+
+
+def validate_engines(problem, postgres_expected):
+    """
+    Compare the solution's result on SQLite with its stored Postgres result.
+    Returns '' when they match, otherwise why they don't.
+    """
+    try:
+        snapshot = build_snapshot(problem)
+    except DatabaseError as e:
+        return f"the solution fails on SQLite: {e}"
+    with _snapshots_lock:
+        _snapshots[problem.pk] = snapshot
+    sqlite_expected = snapshot.expected
+    if sqlite_expected.row_count != postgres_expected.row_count:
+        return f"SQLite returns {sqlite_expected.row_count} rows, Postgres {postgres_expected.row_count}"
+    if len(sqlite_expected.columns) != len(postgres_expected.columns):
+        return f"SQLite returns {len(sqlite_expected.columns)} columns, Postgres {len(postgres_expected.columns)}"
+    field = 'ordered_fingerprint' if problem.solution.ordered else 'fingerprint'
+    if getattr(sqlite_expected, field) != getattr(postgres_expected, field):
+        return "the rows differ between SQLite and Postgres"
+    return ''
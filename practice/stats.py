@@ -0,0 +1,151 @@
+# practice/stats.py
+#
+# How expensive was a query? Every Run records its wall-clock time and row
+# count; the Explain action (and every Run, with PRACTICE_EXPLAIN_RUNS) also
+# runs EXPLAIN (ANALYZE, BUFFERS) for planning/execution time, buffer and temp
+# I/O, and the plan tree.
+#
+# The same numbers are written, one JSON object per line, to the
+# 'practice.query_stats' logger, keyed by problem and by a fingerprint of the
+# query with its literals removed, so the slowest query patterns per problem
+# can be found with a log search.
+
+import hashlib
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import ProgrammingError
+
+logger = logging.getLogger('practice.query_stats')
+
+EXPLAIN_PREFIX = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+
+
+def explain_runs():
+    return getattr(settings, 'PRACTICE_EXPLAIN_RUNS', False)
+
+
+@dataclass
+class QueryStats:
+    """What running one query cost. The EXPLAIN fields are None unless it was explained."""
+    elapsed_ms: float = 0.0                 # wall-clock time in the sandbox, as seen by Django
+    rows: Optional[int] = None              # rows the query returned (None if not counted)
+    planning_ms: Optional[float] = None
+    execution_ms: Optional[float] = None
+    shared_hit_blocks: Optional[int] = None
+    shared_read_blocks: Optional[int] = None
+    temp_read_blocks: Optional[int] = None
+    temp_written_blocks: Optional[int] = None
+    plan: str = ''                          # the plan tree, EXPLAIN ANALYZE-style text
+
+    @property
+    def explained(self):
+        return self.execution_ms is not None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+# --- Making sure only one statement gets explained ---
+
+# Everything that may contain a ';' without ending the statement
+_SKIPPED = re.compile(r"""
+      --[^\n]*                          # line comment
+    | /\*.*?\*/                         # block comment
+    | [eE]'(?:[^'\\]|\\.|'')*'          # escape string
+    | '(?:[^']|'')*'                    # string
+    | "(?:[^"]|"")*"                    # quoted identifier
+    | (\$[A-Za-z_0-9]*\$).*?\1          # dollar-quoted string
+""", re.VERBOSE | re.DOTALL)
+
+
+def single_statement(sql):
+    """
+    `sql` without its trailing semicolons. EXPLAIN runs on a plain cursor, which
+    would happily execute `SELECT 1; COMMIT; ...`, so anything after a ';' is refused.
+    """
+    sql = sql.strip().rstrip(';').strip()
+    if ';' in _SKIPPED.sub('', sql):
+        raise ProgrammingError("Only a single SELECT statement can be explained.")
+    return sql
+
+
+# --- Reading EXPLAIN output ---
+
+def _plan_line(node):
+    label = node['Node Type']
+    if 'Relation Name' in node:
+        label += f" on {node['Relation Name']}"
+        if node.get('Alias') and node['Alias'] != node['Relation Name']:
+            label += f" {node['Alias']}"
+    label += f"  (cost={node['Startup Cost']:.2f}..{node['Total Cost']:.2f} rows={node['Plan Rows']})"
+    if 'Actual Total Time' in node:
+        label += (f" (actual time={node['Actual Startup Time']:.3f}..{node['Actual Total Time']:.3f}"
+                  f" rows={node['Actual Rows']} loops={node['Actual Loops']})")
+    return label
+
+
+def plan_text(node, depth=0):
+    """Render a FORMAT JSON plan node (and its children) like EXPLAIN's text format."""
+    indent = '      ' * (depth - 1) + '  ->  ' if depth else ''
+    lines = [indent + _plan_line(node)]
+    detail_indent = '      ' * depth + '  '
+    for key in ('Hash Cond', 'Join Filter', 'Index Cond', 'Filter', 'Sort Key', 'Group Key'):
+        if key in node:
+            value = node[key]
+            lines.append(f"{detail_indent}{key}: {', '.join(value) if isinstance(value, list) else value}")
+    if node.get('Shared Hit Blocks') or node.get('Shared Read Blocks'):
+        lines.append(f"{detail_indent}Buffers: shared hit={node.get('Shared Hit Blocks', 0)} read={node.get('Shared Read Blocks', 0)}")
+    for child in node.get('Plans', []):
+        lines.append(plan_text(child, depth + 1))
+    return '\n'.join(lines)
+
+
+def stats_from_explain(explain_output, elapsed_ms=0.0):
+    """QueryStats from the result of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON): a list, or its JSON text."""
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    result = explain_output[0]
+    plan = result['Plan']
+    return QueryStats(
+        elapsed_ms=round(elapsed_ms, 2),
+        rows=plan.get('Actual Rows'),
+        planning_ms=result.get('Planning Time'),
+        execution_ms=result.get('Execution Time'),
+        # The top node's buffer counts include those of every node below it
+        shared_hit_blocks=plan.get('Shared Hit Blocks', 0),
+        shared_read_blocks=plan.get('Shared Read Blocks', 0),
+        temp_read_blocks=plan.get('Temp Read Blocks', 0),
+        temp_written_blocks=plan.get('Temp Written Blocks', 0),
+        plan=plan_text(plan),
+    )
+
+
+def explain_analyze(cursor, sql, elapsed_ms=0.0):
+    """EXPLAIN ANALYZE `sql` on a (Django) sandbox cursor and return its QueryStats."""
+    statement = single_statement(sql)
+    # The legacy (non-pre-built) sandbox transaction isn't read-only yet
+    cursor.execute("SET TRANSACTION READ ONLY")
+    cursor.execute(EXPLAIN_PREFIX + statement)
+    return stats_from_explain(cursor.fetchone()[0], elapsed_ms)
+
+
+# --- Structured logging ---
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def query_pattern(sql):
+    """Fingerprint of a query with its literals and layout removed, to group similar queries."""
+    normalized = ' '.join(_LITERALS.sub('?', sql).lower().split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def log_query_stats(problem, action, stats, sql):
+    record = {'problem_id': problem.pk, 'action': action, 'query_pattern': query_pattern(sql)}
+    record.update({name: value for name, value in stats.as_dict().items() if name != 'plan'})
+    logger.info(json.dumps(record), extra={'query_stats': record})
@@ -1,10 +1,12 @@
-import markdown
 from django import template
 from django.template.defaultfilters import stringfilter
 
+from practice.rendering import render_markdown
+
 register = template.Library()
 
 @register.filter(name='convert_markdown')
 @stringfilter
 def convert_markdown(value):
-    return markdown.markdown(value, extensions=['tables', 'fenced_code'])
\ No newline at end of file
+    # Problem pages use the pre-rendered HTML instead (see practice/rendering.py)
+    return render_markdown(value)
\ No newline at end of file
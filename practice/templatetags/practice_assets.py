@@ -0,0 +1,12 @@
+from django import template
+from django.urls import reverse
+
+from practice.assets import get_bundle
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset_url(name):
+    """URL of an editor bundle, e.g. {% asset_url 'editor.js' %} -> /assets/editor.<hash>.js"""
+    return reverse('asset', args=[get_bundle(name).hashed_name])
@@ -1,3 +1,930 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import asdict
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+from ipaddress import ip_address
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import request_finished
+from django.db import DatabaseError, OperationalError, close_old_connections, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import sqlite_engine
+from .api import page_payload
+from .assets import get_bundle
+from .async_sandbox import AsyncAdmissionGate, close_pools, grade_query_async
+from .classifier import classify_sql
+from .dataload import DATA_KIND_CSV, DATA_KIND_GENERATOR, DATA_KIND_TSV, copy_file, generate_rows, load_problem_data
+from .engines import ENGINE_POSTGRES, ENGINE_SQLITE
+from .execution import ResultPage, grade_query, run_query
+from .grading import (
+    CompareOptions, ResultSummary, compare_cursors, compare_options, compare_with_expected, load_expected_result,
+    query_hash, refresh_expected_result, summarize_cursor,
+)
+from .history import (
+    ACTION_RUN, ACTION_SUBMIT, HISTORY_WRITES, VERDICT_CORRECT, VERDICT_INCORRECT, VERDICT_OK, WriteBehindBuffer,
+    record_attempt, recent_attempts, solve_counts,
+)
+from .metrics import render_metrics
+from .models import DataSource, Problem, Schema, Solution, Submission
+from .rendering import HIGHLIGHT_CSS_CLASS, render_markdown
+from .result_cache import normalize_sql
+from .sandbox import AdmissionGate, QueryLimitError, SandboxBusy, build_problem_schema
+from .workers import CANCEL_GRACE, ExecutionPool
+
+
+SCHEMA = """
+DROP TABLE IF EXISTS pets CASCADE;
+CREATE TABLE pets (id integer PRIMARY KEY, name text);
+INSERT INTO pets VALUES (1, 'Rex'), (2, 'Tom');
+"""
+
+
+# Legacy mode: the tables are set up from the Schema rows on every query, the
+# path where the schema scripts used to be loaded more than once per request.
+# No result cache or history buffer, so every request does all of its work.
+@override_settings(
+    PRACTICE_PREBUILT_SCHEMAS=False,
+    PRACTICE_RESULT_CACHE_BACKEND='',
+    PRACTICE_SUBMISSION_HISTORY=False,
+    PRACTICE_EXPLAIN_RUNS=False,
+    PRACTICE_CATALOG_PAGE_SIZE=5,
+)
+class QueryCountTests(TestCase):
+    """Database round-trips per page, on the default connection."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('student')
+        cls.problem = Problem.objects.create(title='Pets', description='List the pets.', solution_explanation='SELECT them.')
+        Schema.objects.create(problem=cls.problem, script=SCHEMA, order=0)
+        Solution.objects.create(problem=cls.problem, query='SELECT id, name FROM pets')
+
+    def setUp(self):
+        # Markdown HTML and solve counts are cached between requests
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('practice:problem_detail', args=[self.problem.pk])
+
+    def test_detail_page(self):
+        # Problem, its rendered HTML (cache miss), session, user, recent attempts
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+    def test_run(self):
+        # Problem + solution, schemas, data sources, rendered HTML, session, user,
+        # then in a savepoint: the schema script, the limits, counting the rest
+        # of the rows; and the recent attempts
+        with self.assertNumQueries(12):
+            response = self.client.post(self.url, {'user_query': 'SELECT * FROM pets', 'action': 'run'})
+        self.assertEqual(response.context['result_page'].total_rows, 2)
+
+    def test_submit(self):
+        # As for Run, but the user and solution queries are compared instead of counted
+        with self.assertNumQueries(11):
+            response = self.client.post(self.url, {'user_query': 'SELECT id, name FROM pets', 'action': 'submit'})
+        self.assertIsNone(response.context['query_error'])
+        self.assertEqual(response.context['result_page'].total_rows, 2)
+
+    def test_catalog(self):
+        for number in range(12):
+            Problem.objects.create(title=f'Problem {number:02}', description='', solution_explanation='')
+        # Session, user, one page of problems, their solve counts
+        with self.assertNumQueries(4):
+            self.client.get(reverse('practice:problem_list'))
+        # The solve counts now come from the cache
+        with self.assertNumQueries(3):
+            self.client.get(reverse('practice:problem_list'))
+
+
+@override_settings(PRACTICE_CATALOG_PAGE_SIZE=5, PRACTICE_SUBMISSION_HISTORY=False)
+class CatalogTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('student')
+        cls.problems = [
+            Problem.objects.create(title=f'Problem {number:02}', description='', solution_explanation='')
+            for number in range(12)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def titles(self, response):
+        return [problem.title for problem in response.context['problems']]
+
+    def test_keyset_pages(self):
+        url = reverse('practice:problem_list')
+        first = self.client.get(url)
+        self.assertEqual(self.titles(first), [f'Problem {number:02}' for number in range(5)])
+        self.assertEqual(first.context['previous_query'], '')
+
+        second = self.client.get(f"{url}?{first.context['next_query']}")
+        self.assertEqual(self.titles(second), [f'Problem {number:02}' for number in range(5, 10)])
+
+        last = self.client.get(f"{url}?{second.context['next_query']}")
+        self.assertEqual(self.titles(last), ['Problem 10', 'Problem 11'])
+        self.assertEqual(last.context['next_query'], '')
+
+        back = self.client.get(f"{url}?{last.context['previous_query']}")
+        self.assertEqual(self.titles(back), self.titles(second))
+
+    def test_filters(self):
+        response = self.client.get(reverse('practice:problem_list'), {'q': 'problem 1'})
+        self.assertEqual(self.titles(response), ['Problem 10', 'Problem 11'])
+
+        Submission.objects.create(problem=self.problems[3], user=self.user, action=ACTION_SUBMIT, query='SELECT 1',
+                                  verdict=VERDICT_CORRECT, duration_ms=1, created_at='2026-01-01T00:00Z')
+        response = self.client.get(reverse('practice:problem_list'), {'status': 'solved'})
+        self.assertEqual(self.titles(response), ['Problem 03'])
+
+    def test_solve_counts(self):
+        for verdict in (VERDICT_CORRECT, VERDICT_INCORRECT, VERDICT_INCORRECT, VERDICT_CORRECT):
+            Submission.objects.create(problem=self.problems[0], user=self.user, action=ACTION_SUBMIT, query='SELECT 1',
+                                      verdict=verdict, duration_ms=1, created_at='2026-01-01T00:00Z')
+        problem = self.client.get(reverse('practice:problem_list')).context['problems'][0]
+        self.assertEqual((problem.attempts, problem.solved, problem.solve_rate), (4, 2, 50))
+
+
+@override_settings(PRACTICE_PREBUILT_SCHEMAS=False, PRACTICE_RESULT_CACHE_BACKEND='', PRACTICE_SUBMISSION_HISTORY=False)
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('student')
+        cls.problem = Problem.objects.create(title='Pets', description='', solution_explanation='')
+        Schema.objects.create(problem=cls.problem, script=SCHEMA, order=0)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('practice_api:export', args=[self.problem.pk])
+
+    def export(self, query, fmt, **extra):
+        response = self.client.post(self.url, {'query': query, 'format': fmt, **extra})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        query = "SELECT id, name, NULL AS owner, '' AS note, 2.50::numeric AS fee, timestamp '2024-01-02 03:04:05' AS seen FROM pets ORDER BY id"
+        self.assertEqual(self.export(query, 'csv').decode(), (
+            'id,name,owner,note,fee,seen\n'
+            '1,Rex,,"",2.50,2024-01-02T03:04:05\n'
+            '2,Tom,,"",2.50,2024-01-02T03:04:05\n'
+        ))
+
+    def test_ndjson_gzip(self):
+        body = gzip.decompress(self.export("SELECT id, name, NULL AS owner FROM pets ORDER BY id", 'ndjson', gzip='1'))
+        self.assertEqual(body.decode(), '{"id":1,"name":"Rex","owner":null}\n{"id":2,"name":"Tom","owner":null}\n')
+
+    def test_unread_export_is_released(self):
+        response = self.client.post(self.url, {'query': 'SELECT * FROM pets', 'format': 'csv'})
+        self.assertEqual(self.open_cursors(), 1)
+        # Closed without sending a byte (e.g. the client went away): the cursor goes too.
+        # As in the test client, keep request_finished from closing the test's connection
+        request_finished.disconnect(close_old_connections)
+        try:
+            response.close()
+        finally:
+            request_finished.connect(close_old_connections)
+        self.assertEqual(self.open_cursors(), 0)
+
+    def open_cursors(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_cursors WHERE name LIKE 'sandbox%%'")
+            return cursor.fetchone()[0]
+
+    def test_errors(self):
+        self.assertEqual(self.client.post(self.url, {'query': 'SELECT nope FROM pets'}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'query': 'SELECT 1', 'format': 'xml'}).status_code, 400)
+
+
+class RowCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.problem = Problem.objects.create(title='Series', description='', solution_explanation='')
+
+    def run_query(self, query):
+        response = self.client.post(reverse('practice_api:run', args=[self.problem.pk]), {'query': query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    @override_settings(PRACTICE_RESULT_CACHE_BACKEND='', PRACTICE_SUBMISSION_HISTORY=False,
+                       PRACTICE_RESULT_PAGE_SIZE=10, PRACTICE_COUNT_ROWS_LIMIT=50)
+    def test_count_is_bounded(self):
+        data = self.run_query('SELECT generate_series(1, 1000) AS n')
+        self.assertEqual((data['total_rows'], data['total_rows_capped'], data['has_more']), (60, True, True))
+        data = self.run_query('SELECT generate_series(1, 60) AS n')
+        self.assertEqual((data['total_rows'], data['total_rows_capped'], data['has_more']), (60, False, True))
+
+
+class PayloadTests(SimpleTestCase):
+
+    def test_rows_are_json_safe(self):
+        page = ResultPage(columns=['b', 'm', 'ip', 'f', 'n', 'a'],
+                          rows=[(b'\x01\xff', memoryview(b'\x00'), ip_address('10.0.0.1'), float('nan'), Decimal('2.50'),
+                                 [b'\x02', None])])
+        payload = json.loads(json.dumps(page_payload(page), cls=DjangoJSONEncoder, allow_nan=False))
+        self.assertEqual(payload['rows'], [['\\x01ff', '\\x00', '10.0.0.1', 'nan', '2.50', ['\\x02', None]]])
+
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.problem = Problem.objects.create(title='Broken', description='', solution_explanation='', source_hash='abc')
+
+    def test_failed_rebuild_is_reported(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:practice_schema_add'), {
+                'problem': self.problem.pk, 'script': 'CREATE TABLE broken (', 'order': 0,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Schema.objects.filter(problem=self.problem).count(), 1)
+        # Left for seed_problems to rebuild, and the admin says what went wrong
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.source_hash, self.problem.data_schema), ('', ''))
+        errors = [str(message) for message in get_messages(response.wsgi_request) if message.level == messages.ERROR]
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Could not build data schema or expected result for 'Broken'", errors[0])
+
+
+class MetricsTests(TestCase):
+
+    def test_labels_are_bounded(self):
+        response = self.client.post(reverse('practice:problem_detail', args=[987654]), {'action': 'made-up'})
+        self.assertEqual(response.status_code, 404)
+        text = render_metrics()
+        self.assertIn('practice_request_seconds_count{action="other",problem=""}', text)
+        self.assertNotIn('987654', text)
+        self.assertNotIn('made-up', text)
+
+
+class AssetTests(TestCase):
+
+    def test_bundle(self):
+        url = reverse('asset', args=[get_bundle('editor.js').hashed_name])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(response.content), get_bundle('editor.js').content)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('asset', args=['editor.000000000000.js'])).status_code, 404)
+
+    def test_highlighted_markdown(self):
+        html = render_markdown("```sql\nSELECT 1\n```")
+        self.assertIn(f'<div class="{HIGHLIGHT_CSS_CLASS}">', html)
+        self.assertIn('<span class="k">SELECT</span>', html)
+
+
+class ListCursor:
+    """Just enough of a cursor for grading: fixed rows, read in batches."""
+
+    def __init__(self, rows, columns=('value',)):
+        self.rows = list(rows)
+        self.description = [(name, None) for name in columns]
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+class GradingTests(SimpleTestCase):
+
+    def grade(self, rows, expected_rows, **options):
+        options = CompareOptions(batch_size=2, **options)
+        expected = summarize_cursor(ListCursor(expected_rows), options)
+        return compare_with_expected(ListCursor(rows), expected, options)
+
+    def test_order(self):
+        rows, expected = [(1,), (2,), (3,)], [(3,), (1,), (2,)]
+        self.assertTrue(self.grade(rows, expected).correct)
+        self.assertFalse(self.grade(rows, expected, ordered=True).correct)
+        self.assertTrue(self.grade(rows, rows, ordered=True).correct)
+        # Live solution cursor: an ordered problem stops at the first differing row
+        comparison = compare_cursors(ListCursor(rows), ListCursor(expected), CompareOptions(ordered=True))
+        self.assertEqual((comparison.correct, comparison.complete, comparison.row_count), (False, False, 1))
+
+    def test_float_digits(self):
+        self.assertTrue(self.grade([(100.5,)], [(Decimal('100.500'),)]).correct)
+        self.assertFalse(self.grade([(2 / 3,)], [(Decimal('0.67'),)]).correct)
+        self.assertTrue(self.grade([(2 / 3,)], [(Decimal('0.67'),)], float_digits=2).correct)
+        self.assertFalse(self.grade([(2 / 3,)], [(Decimal('0.67'),)], float_digits=3).correct)
+
+    def test_large_numerics(self):
+        # Wider than the decimal module's default 28 digits
+        big = Decimal('12345678901234567890123456789.5')
+        self.assertTrue(self.grade([(big,)], [(big,)], float_digits=2).correct)
+        self.assertTrue(self.grade([(Decimal('1e30'),)], [(10 ** 30,)], float_digits=2).correct)
+        self.assertFalse(self.grade([(big,)], [(big + 1,)]).correct)
+        self.assertFalse(self.grade([(big,)], [(big + Decimal('0.001'),)], float_digits=3).correct)
+
+    def test_null_is_not_an_empty_string(self):
+        self.assertFalse(self.grade([(None,)], [('',)]).correct)
+        self.assertFalse(self.grade([(None, 'a')], [('', 'a')]).correct)
+        self.assertTrue(self.grade([(None,), ('',)], [('',), (None,)]).correct)
+
+    def test_duplicates(self):
+        # Results are multisets: how many times a row appears matters
+        self.assertFalse(self.grade([(1,), (1,), (2,)], [(1,), (2,), (2,)]).correct)
+        comparison = self.grade([(1,), (1,), (1,)], [(1,)])
+        self.assertFalse(comparison.correct or comparison.complete)
+        self.assertFalse(self.grade([(1,)], [(1,), (1,)]).correct)
+        self.assertTrue(self.grade([(1,), (2,), (1,)], [(1,), (1,), (2,)]).correct)
+
+    def test_unknown_stored_fields_are_ignored(self):
+        # e.g. a result stored by a newer version of the code
+        summary = summarize_cursor(ListCursor([(1,), (2,)]), CompareOptions())
+        stored = zlib.compress(json.dumps({**asdict(summary), 'added_later': [23]}).encode('utf-8'))
+        self.assertEqual(ResultSummary.from_bytes(stored), summary)
+
+    def test_stale_expected_result(self):
+        solution = Solution(problem=Problem(data_schema='p_1_abc'), query='SELECT 1', float_digits=None)
+        summary = summarize_cursor(ListCursor([(1,)]), compare_options(solution))
+        summary.data_schema, summary.query_hash = 'p_1_abc', query_hash(solution.query)
+        solution.expected_result = summary.to_bytes()
+        self.assertEqual(load_expected_result(solution), summary)
+        # Reformatted at the ends only: still the same query
+        solution.query = '  SELECT 1\n'
+        self.assertEqual(load_expected_result(solution), summary)
+        for field_name, value in [('query', 'SELECT 2'), ('float_digits', 2)]:
+            with self.subTest(field=field_name):
+                stale = Solution(problem=solution.problem, query=solution.query, float_digits=None,
+                                 expected_result=solution.expected_result)
+                setattr(stale, field_name, value)
+                self.assertIsNone(load_expected_result(stale))
+        rebuilt = Solution(problem=Problem(data_schema='p_1_def'), query=solution.query,
+                           expected_result=solution.expected_result)
+        self.assertIsNone(load_expected_result(rebuilt))
+        self.assertIsNone(load_expected_result(Solution(problem=solution.problem, query=solution.query)))
+
+
+class NormalizeSqlTests(SimpleTestCase):
+
+    def test_reformatting_is_ignored(self):
+        self.assertEqual(normalize_sql("SELECT  id,\n\tName -- the name\nFROM /* a /* nested */ comment */ Pets ;;"),
+                         "select id, name from pets")
+        self.assertEqual(normalize_sql("select id, name from pets"), normalize_sql("SELECT id,   NAME\nFROM pets;"))
+
+    def test_literals_are_kept(self):
+        self.assertEqual(normalize_sql("SELECT 'A  B', \"Mixed  Case\", $x$ Keep  THIS $x$, E'a\\'  b'"),
+                         "select 'A  B', \"Mixed  Case\", $x$ Keep  THIS $x$, E'a\\'  b'")
+        self.assertNotEqual(normalize_sql("SELECT 'a b'"), normalize_sql("SELECT 'a  b'"))
+        self.assertEqual(normalize_sql("SELECT '-- not a comment' ; "), "select '-- not a comment'")
+
+    def test_separate_tokens_stay_separate(self):
+        self.assertNotEqual(normalize_sql("SELECT a < > b"), normalize_sql("SELECT a <> b"))
+        self.assertNotEqual(normalize_sql("SELECT 1 - -1"), normalize_sql("SELECT 1 --1"))
+        self.assertEqual(normalize_sql("SELECT a/**/b"), "select a b")
+
+
+class ClassifierTests(SimpleTestCase):
+
+    def test_allowed(self):
+        for sql in ("SELECT 1;", "/* why */ -- not\n(SELECT 1) UNION SELECT 2", "SELECT 'a; DROP TABLE pets'",
+                    "SELECT $$ ; DELETE $$", "SELECT substring(name FROM 1 FOR 2) FROM pets"):
+            with self.subTest(sql=sql):
+                self.assertTrue(classify_sql(sql).read_only)
+
+    def test_rejected(self):
+        for sql in ("SELECT 1; DROP TABLE pets", "DELETE FROM pets", "WITH gone AS (DELETE FROM pets RETURNING *) SELECT * FROM gone",
+                    "SELECT * INTO copy FROM pets", "SELECT * FROM pets FOR UPDATE", "SELECT set_config('work_mem', '1GB', false)",
+                    "SELECT 'unterminated", "SELECT /* unterminated",
+                    "WITH a AS (SELECT 1) DELETE FROM pets", "WITH a AS (SELECT 1) UPDATE pets SET name = 1",
+                    "SELECT query_to_xml($$DELETE FROM pets$$, true, false, '')"):
+            with self.subTest(sql=sql):
+                self.assertFalse(classify_sql(sql).allowed)
+
+
+# Types psycopg2 and asyncpg decode differently unless told otherwise
+TYPED_SCHEMA = """
+CREATE TABLE readings (id integer PRIMARY KEY, taken_at timestamptz, level real, meta jsonb,
+                       raw json, flags bit(3), mask varbit, span int4range, window_ tstzrange);
+INSERT INTO readings VALUES (1, '2024-01-02 03:04:05+02', 1.1, '{"unit": "m", "tags": [1, 2]}',
+                             '{"b": 1, "a": [1.5, null]}', B'101', B'1', '[1,5)',
+                             '[2024-01-01 00:00+00, 2024-02-01 00:00+00)'),
+                            (2, '2024-06-01 00:00:00+00', 2.7, NULL, '[]', B'000', B'', 'empty', '(,2024-01-01 00:00+00]');
+"""
+
+
+@override_settings(PRACTICE_RESULT_CACHE_BACKEND='', PRACTICE_SUBMISSION_HISTORY=False, PRACTICE_DIFF_MAX_ROWS=0)
+class DriverParityTests(TransactionTestCase):
+    """The stored expected result (psycopg2) must match the same rows read through asyncpg."""
+    databases = {'default', 'sandbox'}
+
+    def setUp(self):
+        self.problem = Problem.objects.create(title='Readings', description='', solution_explanation='')
+        Schema.objects.create(problem=self.problem, script=TYPED_SCHEMA, order=0)
+        Solution.objects.create(problem=self.problem, query='SELECT *, ROW(id, level) AS pair FROM readings ORDER BY id')
+        build_problem_schema(self.problem)
+        self.problem = Problem.objects.select_related('solution').get(pk=self.problem.pk)
+        refresh_expected_result(self.problem.solution)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {connection.ops.quote_name(self.problem.data_schema)} CASCADE")
+
+    def test_same_verdict(self):
+        query = 'SELECT id, taken_at, level, meta, raw, flags, mask, span, window_, (id, level) FROM readings ORDER BY id'
+        comparison, _ = grade_query(self.problem, query)
+        self.assertTrue(comparison.correct, comparison.reason)
+        comparison, _ = async_to_sync(self.grade_async)(query)
+        self.assertTrue(comparison.correct, comparison.reason)
+
+    @override_settings(PRACTICE_DIFF_MAX_ROWS=20)
+    def test_no_row_diff_after_early_stop(self):
+        # More rows than expected: grading stops reading, and the rows aren't diffed
+        query = 'SELECT r.*, ROW(r.id, r.level) FROM readings r, generate_series(1, 3)'
+        for comparison, _ in (grade_query(self.problem, query), async_to_sync(self.grade_async)(query)):
+            self.assertFalse(comparison.correct or comparison.complete)
+            self.assertIsNone(comparison.diff)
+
+    async def grade_async(self, query):
+        try:
+            return await grade_query_async(self.problem, query)
+        finally:
+            await close_pools()
+
+
+@override_settings(PRACTICE_RESULT_CACHE_BACKEND='')
+class SeedTests(TransactionTestCase):
+    """Incremental seeding: what is rebuilt, and what is skipped as unchanged."""
+    databases = {'default', 'sandbox'}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = Path(self.directory.name) / 'tiny_table'
+        self.folder.mkdir()
+        (self.folder / 'description.md').write_text('Select everything.')
+        (self.folder / 'solution_explanation.md').write_text('Just SELECT *.')
+        (self.folder / 'solution.sql').write_text('SELECT * FROM t ORDER BY id')
+        self.write_rows(3)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname LIKE 'problem\\_%%'")
+            for (name,) in cursor.fetchall():
+                cursor.execute(f"DROP SCHEMA {connection.ops.quote_name(name)} CASCADE")
+        self.directory.cleanup()
+
+    def write_rows(self, count):
+        values = ', '.join(f'({number})' for number in range(1, count + 1))
+        (self.folder / 'schema.sql').write_text(f'CREATE TABLE t (id integer PRIMARY KEY);\nINSERT INTO t VALUES {values};')
+
+    def seed(self, *args):
+        out = StringIO()
+        call_command('seed_problems', '--problems-dir', self.directory.name, *args, stdout=out)
+        return out.getvalue()
+
+    def expected_rows(self):
+        solution = Solution.objects.select_related('problem').get(problem__title='Tiny Table')
+        expected = load_expected_result(solution)
+        return expected.row_count if expected else None
+
+    def test_incremental(self):
+        self.assertIn('1 added', self.seed())
+        self.assertEqual(self.expected_rows(), 3)
+        self.assertIn('1 unchanged', self.seed())
+
+        self.write_rows(4)
+        self.assertIn('1 updated', self.seed())
+        self.assertEqual(self.expected_rows(), 4)
+
+    def test_skipped_build_is_built_later(self):
+        self.seed()
+        self.write_rows(4)
+        self.assertIn('1 updated', self.seed('--skip-schema-build'))
+        self.assertIsNone(self.expected_rows())
+        # Not "unchanged": the schema and expected result are built now
+        self.assertIn('1 updated', self.seed())
+        self.assertEqual(self.expected_rows(), 4)
+        self.assertIn('1 unchanged', self.seed())
+
+
+@override_settings(ALLOWED_HOSTS=[], PRACTICE_PREBUILT_SCHEMAS=False, PRACTICE_RESULT_CACHE_BACKEND='',
+                   PRACTICE_SUBMISSION_HISTORY=False)
+class BenchmarkTests(TransactionTestCase):
+
+    def setUp(self):
+        problem = Problem.objects.create(title='Pets', description='', solution_explanation='')
+        Schema.objects.create(problem=problem, script=SCHEMA, order=0)
+        Solution.objects.create(problem=problem, query='SELECT id, name FROM pets')
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = Path(self.directory.name) / 'bench.json'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def benchmark(self, *args):
+        call_command('benchmark', '--requests', '4', '--warmup', '0', '--concurrency', '2', '--mix', 'cheap=1',
+                     '--output', str(self.output), *args, stdout=StringIO())
+
+    def test_in_process(self):
+        # An empty ALLOWED_HOSTS (with DEBUG off) must not turn every request into a 400
+        self.benchmark()
+        report = json.loads(self.output.read_text())
+        self.assertEqual(report['overall']['statuses'], {'200': 4})
+
+    def test_failed_run_is_not_saved(self):
+        with self.assertRaisesMessage(CommandError, 'not saving or comparing this run'):
+            self.benchmark('--url', 'http://127.0.0.1:9')
+        self.assertFalse(self.output.exists())
+
+
+class WorkerTests(TransactionTestCase):
+    """The deadline of an ExecutionPool worker, and what happens to the worker after it."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The workers read the settings afresh: point them at the test database
+        with mock.patch.dict(os.environ, POSTGRES_DB=connection.settings_dict['NAME']):
+            cls.pool = ExecutionPool(size=1, deadline=30, max_waiting=0, wait_timeout=0)
+        cls.worker = cls.pool.workers[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        # No schema: the query runs on the worker's default connection
+        self.problem = Problem.objects.create(title='Sleep', description='', solution_explanation='')
+        # Also waits for the worker to start up
+        self.assertEqual(self.run_query('SELECT 1').rows, [(1,)])
+
+    def run_query(self, query, deadline=30):
+        return self.pool.wait_for(self.worker, ('run', self.problem, (query,)), deadline, self.problem)
+
+    def test_deadline(self):
+        pid = self.worker.process.pid
+        started = time.monotonic()
+        with self.assertRaises(QueryLimitError) as raised:
+            self.run_query('SELECT pg_sleep(4)', deadline=0.5)
+        self.assertEqual(raised.exception.limit, 'deadline')
+        self.assertLess(time.monotonic() - started, 0.5 + CANCEL_GRACE)
+        # Its backend was cancelled, so the worker reported back and takes the next job
+        self.assertEqual(self.worker.process.pid, pid)
+        self.assertEqual(self.run_query('SELECT 2').rows, [(2,)])
+
+    def test_stuck_worker_is_replaced(self):
+        pid = self.worker.process.pid
+        # Frozen mid-query, it can't report back after the cancel
+        threading.Timer(0.2, os.kill, (pid, signal.SIGSTOP)).start()
+        with self.assertRaises(QueryLimitError):
+            self.run_query('SELECT pg_sleep(4)', deadline=0.5)
+        self.assertNotEqual(self.worker.process.pid, pid)
+        self.assertEqual(self.run_query('SELECT 2').rows, [(2,)])
+
+    def test_query_error(self):
+        pid = self.worker.process.pid
+        with self.assertRaisesMessage(DatabaseError, 'no_such_table'):
+            self.run_query('SELECT * FROM no_such_table')
+        # An error doesn't cost the worker
+        self.assertEqual(self.worker.process.pid, pid)
+        self.assertEqual(self.run_query('SELECT 3').rows, [(3,)])
+
+    def test_worker_exits(self):
+        threading.Timer(0.5, self.worker.process.kill).start()
+        with self.assertRaisesMessage(OperationalError, 'exited unexpectedly'):
+            self.run_query('SELECT pg_sleep(4)')
+        self.assertEqual(self.run_query('SELECT 4').rows, [(4,)])
+
+
+@override_settings(PRACTICE_SUBMISSION_HISTORY=True)
+class HistoryTests(TransactionTestCase):
+    """The write-behind buffer: when it writes, and what it drops."""
+
+    def setUp(self):
+        cache.clear()
+        self.problem = Problem.objects.create(title='Pets', description='', solution_explanation='')
+
+    def use_buffer(self, batch_size=100, flush_interval=60, max_pending=100):
+        buffer = WriteBehindBuffer(batch_size, flush_interval, max_pending)
+        patcher = mock.patch('practice.history._buffer', buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return buffer
+
+    def record(self, count, action=ACTION_SUBMIT, verdict=VERDICT_CORRECT, problem=None):
+        for number in range(count):
+            record_attempt(problem or self.problem, action, f'SELECT {number}', verdict, 1.0, session_key='visitor')
+
+    def wait_for_writes(self, count):
+        deadline = time.monotonic() + 5
+        while Submission.objects.count() < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(Submission.objects.count(), count)
+
+    def dropped(self):
+        return HISTORY_WRITES._values.get(('dropped',), 0)
+
+    def test_flush(self):
+        buffer = self.use_buffer()
+        self.record(2)
+        self.record(1, action=ACTION_RUN, verdict=VERDICT_OK)
+        # Nothing is written while the request runs
+        self.assertEqual(Submission.objects.count(), 0)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(buffer.pending(), 0)
+        attempts = recent_attempts(session_key='visitor', problem_id=self.problem.pk)
+        self.assertEqual([(attempt.action, attempt.query) for attempt in attempts],
+                         [(ACTION_RUN, 'SELECT 0'), (ACTION_SUBMIT, 'SELECT 1'), (ACTION_SUBMIT, 'SELECT 0')])
+        self.assertEqual(solve_counts([self.problem.pk]), {self.problem.pk: (2, 2)})
+
+    # The background thread closes its connection after each flush, so the test database can be dropped
+    @mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+    def test_full_batch_is_written(self):
+        self.use_buffer(batch_size=3)
+        self.record(3)
+        self.wait_for_writes(3)
+
+    @mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+    def test_written_after_interval(self):
+        self.use_buffer(flush_interval=0.2)
+        self.record(1)
+        self.wait_for_writes(1)
+
+    def test_oldest_are_dropped(self):
+        buffer = self.use_buffer(max_pending=3)
+        dropped = self.dropped()
+        self.record(5)
+        self.assertEqual(buffer.pending(), 3)
+        self.assertEqual(self.dropped(), dropped + 2)
+        buffer.flush()
+        self.assertEqual(sorted(Submission.objects.values_list('query', flat=True)), ['SELECT 2', 'SELECT 3', 'SELECT 4'])
+
+    def test_failed_write(self):
+        buffer = self.use_buffer()
+        dropped = self.dropped()
+        missing = Problem(pk=self.problem.pk + 1000)
+        self.record(1)
+        self.record(1, problem=missing)
+        with self.assertLogs('practice.history', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        # The batch is dropped, not retried forever
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(self.dropped(), dropped + 2)
+        self.assertEqual(Submission.objects.count(), 0)
+        self.record(1)
+        self.assertEqual(buffer.flush(), 1)
+
+
+SALES_SCHEMA = """
+CREATE TABLE sales (id integer PRIMARY KEY, region text, amount numeric(8, 2), sold_on date, sold_at timestamp);
+INSERT INTO sales VALUES (1, 'north', 10.25, '2024-01-02', '2024-01-02 03:04:05'),
+                         (2, 'south', 20.00, '2024-01-03', '2024-01-03 10:00:00'),
+                         (3, 'north', 20.25, '2024-02-01', '2024-02-01 23:59:59');
+"""
+
+
+@override_settings(PRACTICE_RESULT_CACHE_BACKEND='', PRACTICE_SUBMISSION_HISTORY=False, PRACTICE_DIFF_MAX_ROWS=0)
+class SqliteEngineTests(TransactionTestCase):
+    """Problems with engine='sqlite': the copied snapshot, its lockdown, and grading parity with Postgres."""
+    databases = {'default', 'sandbox'}
+
+    def setUp(self):
+        self.problem = Problem.objects.create(title='Sales', description='', solution_explanation='', engine=ENGINE_SQLITE)
+        Schema.objects.create(problem=self.problem, script=SALES_SCHEMA, order=0)
+        Solution.objects.create(problem=self.problem, query='SELECT id, region, amount, sold_on, sold_at FROM sales')
+        build_problem_schema(self.problem)
+        self.problem = Problem.objects.select_related('solution').get(pk=self.problem.pk)
+        refresh_expected_result(self.problem.solution)
+        patcher = mock.patch.dict(sqlite_engine._snapshots, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {connection.ops.quote_name(self.problem.data_schema)} CASCADE")
+
+    def test_copy(self):
+        conn = sqlite_engine.copy_problem_data(self.problem)
+        try:
+            self.assertEqual(conn.execute('SELECT * FROM sales ORDER BY id').fetchall()[0],
+                             (1, 'north', 10.25, date(2024, 1, 2), datetime(2024, 1, 2, 3, 4, 5)))
+        finally:
+            conn.close()
+        self.assertEqual(run_query(self.problem, 'SELECT count(*) FROM sales').rows, [(3,)])
+
+    def test_writes_are_denied(self):
+        for query in ("DELETE FROM sales", "CREATE TABLE other (id integer)", "ATTACH DATABASE ':memory:' AS other",
+                      "PRAGMA writable_schema = 1"):
+            with self.subTest(query=query), self.assertRaisesMessage(DatabaseError, 'not authorized'):
+                run_query(self.problem, query)
+        self.assertEqual(run_query(self.problem, 'SELECT count(*) FROM sales').rows, [(3,)])
+
+    def test_deadline(self):
+        self.problem.statement_timeout_ms = 200
+        endless = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n'
+        started = time.monotonic()
+        with self.assertRaises(QueryLimitError):
+            run_query(self.problem, endless)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_grading_parity(self):
+        self.assertEqual(sqlite_engine.validate_engines(self.problem, load_expected_result(self.problem.solution)), '')
+        for query, correct in [
+            ('SELECT id, region, amount, sold_on, sold_at FROM sales ORDER BY amount DESC', True),
+            ("SELECT id, region, amount + 0, sold_on, sold_at FROM sales WHERE region <> ''", True),
+            ('SELECT id, region, amount, sold_on, sold_on FROM sales', False),
+            ('SELECT id, region, amount, sold_on, sold_at FROM sales WHERE id < 3', False),
+        ]:
+            with self.subTest(query=query):
+                self.problem.engine = ENGINE_SQLITE
+                self.assertEqual(grade_query(self.problem, query)[0].correct, correct)
+                self.problem.engine = ENGINE_POSTGRES
+                self.assertEqual(grade_query(self.problem, query)[0].correct, correct)
+
+
+GENERATOR_SPEC = {
+    'rows': 500,
+    'seed': 7,
+    'columns': {
+        'id': {'type': 'sequence'},
+        'amount': {'type': 'numeric', 'min': 1, 'max': 500, 'distribution': 'normal', 'scale': 2},
+        'customer': {'type': 'int', 'min': 1, 'max': 50, 'distribution': 'skewed'},
+        'ordered_on': {'type': 'date', 'min': '2023-01-01', 'max': '2023-12-31'},
+        'status': {'type': 'choice', 'values': ['paid', 'refunded'], 'weights': [9, 1]},
+        'note': {'type': 'text', 'null_fraction': 0.5},
+    },
+}
+
+
+class DataLoadTests(TestCase):
+    """Bulk data: generator specs, COPY'd files, and the order the scripts run in."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def generate(self, spec):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE orders (id integer, amount numeric, customer integer, "
+                           "ordered_on date, status text, note text)")
+            generate_rows(cursor, 'orders', spec)
+            cursor.execute("SELECT * FROM orders ORDER BY id")
+            rows = cursor.fetchall()
+            cursor.execute("DROP TABLE orders")
+        return rows
+
+    def test_generator_is_deterministic(self):
+        rows = self.generate(GENERATOR_SPEC)
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(rows, self.generate(GENERATOR_SPEC))
+        self.assertNotEqual(rows, self.generate({**GENERATOR_SPEC, 'seed': 8}))
+        self.assertTrue(all(1 <= row[2] <= 50 and row[4] in ('paid', 'refunded') for row in rows))
+
+    def write(self, name, text):
+        path = Path(self.directory.name) / name
+        path.write_text(text, encoding='utf-8')
+        return path
+
+    def test_copy_file(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE people (id integer, name text, note text)")
+            # The header names the columns, in any order; an empty unquoted field is NULL
+            copy_file(cursor, 'people', self.write('people.csv', 'name,id,note\n"Smith, Jo",1,\nAl,2,""\n'), DATA_KIND_CSV)
+            copy_file(cursor, 'people', self.write('people.tsv', 'id\tname\n3\tTab\n'), DATA_KIND_TSV)
+            cursor.execute("SELECT * FROM people ORDER BY id")
+            self.assertEqual(cursor.fetchall(), [(1, 'Smith, Jo', None), (2, 'Al', ''), (3, 'Tab', None)])
+
+    def test_scripts_after_data(self):
+        schemas = [
+            SimpleNamespace(script="CREATE TEMP TABLE t (id integer); CREATE TEMP TABLE seen (n bigint)", runs_after_data=False),
+            SimpleNamespace(script="INSERT INTO seen SELECT count(*) FROM t; ALTER TABLE t ADD PRIMARY KEY (id)", runs_after_data=True),
+        ]
+        sources = [SimpleNamespace(kind=DATA_KIND_GENERATOR, table='t', spec={'rows': 5, 'columns': {'id': {'type': 'sequence'}}})]
+        with connection.cursor() as cursor:
+            load_problem_data(cursor, schemas, sources)
+            cursor.execute("SELECT n FROM seen")
+            self.assertEqual(cursor.fetchone(), (5,))
+
+    @override_settings(PRACTICE_PREBUILT_SCHEMAS=False)
+    def test_not_loaded_per_request(self):
+        problem = Problem.objects.create(title='Orders', description='', solution_explanation='')
+        Schema.objects.create(problem=problem, script='CREATE TABLE orders (id integer)', order=0)
+        DataSource.objects.create(problem=problem, table='orders', kind=DATA_KIND_GENERATOR,
+                                  spec={'rows': 10, 'columns': {'id': {'type': 'sequence'}}})
+        with self.assertRaisesMessage(OperationalError, 'pre-built'):
+            run_query(problem, 'SELECT count(*) FROM orders')
+
+
+class AdmissionGateTests(SimpleTestCase):
+    """One slot, one place in the queue: the third caller is turned away at once, the second after wait_timeout."""
+
+    def test_gate(self):
+        gate = AdmissionGate(max_concurrent=1, max_waiting=1, wait_timeout=0.3)
+        outcomes = []
+
+        def wait_for_slot():
+            try:
+                with gate.slot():
+                    outcomes.append('ran')
+            except SandboxBusy as e:
+                outcomes.append(str(e))
+
+        with gate.slot():
+            waiter = threading.Thread(target=wait_for_slot)
+            waiter.start()
+            while not gate._waiting:
+                time.sleep(0.01)
+            with self.assertRaisesMessage(SandboxBusy, 'Too many queries are queued.'):
+                with gate.slot():
+                    pass
+            waiter.join()
+        self.assertEqual(outcomes, ['Timed out waiting for a free query slot.'])
+        # A queued caller gets the slot as soon as it is free
+        with gate.slot():
+            waiter = threading.Thread(target=wait_for_slot)
+            waiter.start()
+            while not gate._waiting:
+                time.sleep(0.01)
+        waiter.join()
+        self.assertEqual(outcomes[-1], 'ran')
+
+    async def test_async_gate(self):
+        gate = AsyncAdmissionGate(max_concurrent=1, max_waiting=1, wait_timeout=0.3)
+
+        async def wait_for_slot():
+            async with gate.slot():
+                return 'ran'
+
+        async with gate.slot():
+            waiter = asyncio.ensure_future(wait_for_slot())
+            await asyncio.sleep(0)
+            with self.assertRaisesMessage(SandboxBusy, 'Too many queries are queued.'):
+                async with gate.slot():
+                    pass
+            with self.assertRaisesMessage(SandboxBusy, 'Timed out waiting for a free query slot.'):
+                await waiter
+        async with gate.slot():
+            waiter = asyncio.ensure_future(wait_for_slot())
+            await asyncio.sleep(0)
+        self.assertEqual(await waiter, 'ran')
+
+
+@override_settings(PRACTICE_RESULT_CACHE_BACKEND='', PRACTICE_SUBMISSION_HISTORY=False)
+class BusyTests(TransactionTestCase):
+    """A full admission gate answers 503 with Retry-After, on the page and on the (async) API."""
+    databases = {'default', 'sandbox'}
+
+    def setUp(self):
+        self.problem = Problem.objects.create(title='Pets', description='', solution_explanation='')
+        Schema.objects.create(problem=self.problem, script=SCHEMA, order=0)
+        Solution.objects.create(problem=self.problem, query='SELECT id, name FROM pets')
+        build_problem_schema(self.problem)
+        self.problem = Problem.objects.select_related('solution').get(pk=self.problem.pk)
+        # Async grading needs the stored expected result
+        refresh_expected_result(self.problem.solution)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {connection.ops.quote_name(self.problem.data_schema)} CASCADE")
+
+    def assertBusy(self, response):
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_page(self):
+        gate = AdmissionGate(max_concurrent=1, max_waiting=0, wait_timeout=0)
+        url = reverse('practice:problem_detail', args=[self.problem.pk])
+        with mock.patch('practice.sandbox.admission_gate', gate), gate.slot():
+            for action in ('run', 'submit'):
+                self.assertBusy(self.client.post(url, {'user_query': 'SELECT * FROM pets', 'action': action}))
+        self.assertEqual(self.client.post(url, {'user_query': 'SELECT * FROM pets', 'action': 'run'}).status_code, 200)
+
+    async def test_async_api(self):
+        gate = AsyncAdmissionGate(max_concurrent=1, max_waiting=1, wait_timeout=0.1)
+        try:
+            with mock.patch('practice.async_sandbox.get_gate', return_value=gate):
+                async with gate.slot():
+                    for name in ('run', 'submit'):
+                        url = reverse(f'practice_api:{name}', args=[self.problem.pk])
+                        self.assertBusy(await self.async_client.post(url, {'query': 'SELECT * FROM pets'}))
+                response = await self.async_client.post(reverse('practice_api:run', args=[self.problem.pk]),
+                                                        {'query': 'SELECT * FROM pets'})
+                self.assertEqual(response.status_code, 200)
+        finally:
+            await close_pools()
@@ -5,6 +5,7 @@ from . import views
 app_name = 'practice'
 
 urlpatterns = [
+    path('', views.problem_list, name='problem_list'),
     # This line has the correct function name: 'views.problem_detail'
     path('<int:problem_id>/', views.problem_detail, name='problem_detail'),
 ]
\ No newline at end of file
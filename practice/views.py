@@ -1,35 +1,103 @@
 # practice/views.py
 
+import time
+from urllib.parse import urlencode
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db import connection, transaction, Error
+from django.db import Error
 from django.contrib import messages
+from django.http import Http404, HttpResponse
+from django.conf import settings
+from .assets import CACHE_MAX_AGE, find_bundle, preferred_encoding
+from .classifier import classify
+from .engines import ENGINE_CHOICES
+from .history import (
+    ACTION_RUN, ACTION_SUBMIT, VERDICT_CORRECT, VERDICT_INCORRECT, VERDICT_OK, error_verdict, recent_attempts,
+    record_attempt, solve_counts, solved_by,
+)
 from .models import Problem # Make sure Problem, Schema, Solution are imported
+from .metrics import count_error, count_verdict, label_problem, phase, render_metrics, traced
+from .rendering import RENDERED_FIELDS, problem_html
+from .sandbox import SandboxBusy, prefetch_problem_data
+from .workers import execution_service
+
+# Problem columns the detail page never reads directly
+MARKDOWN_FIELDS = [*RENDERED_FIELDS, *RENDERED_FIELDS.values()]
+
+def render_detail(request, context, status=200):
+    with phase('render'):
+        return render(request, 'practice/problem_detail.html', context, status=status)
+
+def sandbox_busy(request, context):
+    """Fast 503 when this process is already running as many queries as it's allowed to."""
+    context['query_error'] = "The server is busy running other queries right now. Please try again in a few seconds."
+    response = render_detail(request, context, status=503)
+    response['Retry-After'] = '2'
+    return response
+
+def record(request, problem, action, user_query, started, verdict, row_count=None, error=None):
+    """Add this Run/Submit to the history (buffered, see history.py)."""
+    record_attempt(
+        problem, action, user_query, verdict, (time.perf_counter() - started) * 1000,
+        user_id=request.user.pk if request.user.is_authenticated else None,
+        session_key=request.session.session_key, row_count=row_count, error=error,
+    )
 
+def load_problem(problem_id, action):
+    """
+    The problem, with everything `action` will read from it loaded up front: the
+    solution in the same query (its stored expected result only for Submit), and
+    in legacy mode its schema scripts and data sources.
+    """
+    # The markdown (and its HTML) can be large; the HTML comes from the cache instead
+    problems = Problem.objects.defer(*MARKDOWN_FIELDS)
+    if action in ('run', 'submit', 'explain'):
+        problems = problems.select_related('solution')
+        if action != 'submit':
+            problems = problems.defer('solution__expected_result')
+    problem = get_object_or_404(problems, pk=problem_id)
+    label_problem(problem)
+    if action in ('run', 'submit', 'explain'):
+        prefetch_problem_data([problem])
+    return problem
+
+@traced()
 def problem_detail(request, problem_id):
-    problem = get_object_or_404(Problem, pk=problem_id)
+    with phase('load_problem'):
+        problem = load_problem(problem_id, request.POST.get('action') if request.method == 'POST' else None)
+    with phase('markdown'):
+        html = problem_html(problem)
 
     # Initialize context that will be used for rendering the template
     context = {
         'problem': problem,
+        'problem_html': html,
         'user_query': request.session.pop('user_query', ''), # Get query from session if it exists
         'query_results': None,
         'column_headers': [],
+        'result_page': None,
+        'query_stats': None,
         'query_error': None,
+        # Read lazily by the template; may lag a few seconds behind (see history.py)
+        'recent_attempts': recent_attempts(
+            user_id=request.user.pk if request.user.is_authenticated else None,
+            session_key=request.session.session_key, problem_id=problem.id, limit=5,
+        ),
     }
 
     # If it's a GET request, just render the page
     if request.method != 'POST':
-        return render(request, 'practice/problem_detail.html', context)
+        return render_detail(request, context)
 
     # --- POST REQUEST LOGIC ---
 
     user_query = request.POST.get('user_query', '').strip()
     context['user_query'] = user_query # Add user query to context to re-populate editor
 
-    # Validate that the query is a SELECT or WITH statement
-    user_query_lower = user_query.lower()
-    if not (user_query_lower.startswith('select') or user_query_lower.startswith('with')):
-        messages.error(request, "Only SELECT queries (including those starting with WITH) are allowed.")
+    # Validate that the query is a single read-only SELECT or WITH statement
+    classification = classify(user_query)
+    if not classification.allowed:
+        messages.error(request, classification.reason)
         # On validation error, we redirect to clear the POST
         return redirect('practice:problem_detail', problem_id=problem.id)
 
@@ -39,31 +107,41 @@ def problem_detail(request, problem_id):
     if action == 'run':
         if not user_query:
             context['query_error'] = "Cannot execute an empty query."
-            return render(request, 'practice/problem_detail.html', context)
+            return render_detail(request, context)
 
+        started = time.perf_counter()
         try:
-            # Use a transaction to ensure schema setup and query run are atomic
-            with transaction.atomic():
-                # Execute all schema scripts for this problem
-                with connection.cursor() as schema_cursor:
-                    for schema_sql in problem.schemas.all():
-                        schema_cursor.execute(schema_sql.script.strip())
-                
-                # Execute the user's query
-                with connection.cursor() as user_query_cursor:
-                    user_query_cursor.execute(user_query)
-                    context['query_results'] = user_query_cursor.fetchall()
-                    context['column_headers'] = [col[0] for col in user_query_cursor.description] if user_query_cursor.description else []
-                
-                # Re-render the page with the results
-                return render(request, 'practice/problem_detail.html', context)
+            # Only one page of results is fetched; "Next rows" re-runs with an ?offset=
+            try:
+                offset = max(int(request.GET.get('offset', 0)), 0)
+            except ValueError:
+                offset = 0
+
+            # The sandbox points the cursor at this problem's tables (see sandbox.py);
+            # with PRACTICE_EXECUTION_WORKERS set it runs in a worker process (see workers.py)
+            result_page = execution_service().run_query(problem, user_query, offset)
+            record(request, problem, ACTION_RUN, user_query, started, VERDICT_OK, row_count=result_page.row_count)
+            context['result_page'] = result_page
+            context['query_results'] = result_page.rows
+            context['column_headers'] = result_page.columns
+            context['query_stats'] = result_page.stats
+
+            # Re-render the page with the results
+            return render_detail(request, context)
         
+        except SandboxBusy as e:
+            count_error(e)
+            return sandbox_busy(request, context)
         except Error as e:
+            count_error(e)
+            record(request, problem, ACTION_RUN, user_query, started, error_verdict(e), error=e)
             context['query_error'] = str(e)
-            return render(request, 'practice/problem_detail.html', context)
+            return render_detail(request, context)
         except Exception as e:
+            count_error(e)
+            record(request, problem, ACTION_RUN, user_query, started, error_verdict(e), error=e)
             context['query_error'] = f"An unexpected application error occurred: {e}"
-            return render(request, 'practice/problem_detail.html', context)
+            return render_detail(request, context)
 
     # --- BRANCH 2: User clicked "Submit Solution" ---
     elif action == 'submit':
@@ -72,54 +150,157 @@ def problem_detail(request, problem_id):
             messages.error(request, "Cannot submit an empty query.")
             return redirect('practice:problem_detail', problem_id=problem.id)
 
+        # Check if a solution is configured for this problem
+        # (loaded before the sandbox cursor opens, since the ORM can't be used inside it)
+        if not hasattr(problem, 'solution') or not problem.solution.query:
+            messages.error(request, "This problem does not have a solution configured yet.")
+            return redirect('practice:problem_detail', problem_id=problem.id)
+
+        started = time.perf_counter()
         try:
-            with transaction.atomic():
-                # Set up the schema in the database
-                with connection.cursor() as schema_cursor:
-                    for schema_sql in problem.schemas.all():
-                        schema_cursor.execute(schema_sql.script.strip())
-
-                # Execute the user's query and fetch their results
-                with connection.cursor() as user_query_cursor:
-                    user_query_cursor.execute(user_query)
-                    user_results = user_query_cursor.fetchall()
-                    # *** IMPORTANT: Capture user's headers to display results ***
-                    user_column_headers = [col[0] for col in user_query_cursor.description] if user_query_cursor.description else []
-
-                # Check if a solution is configured for this problem
-                if not hasattr(problem, 'solution') or not problem.solution.query:
-                    messages.error(request, "This problem does not have a solution configured yet.")
-                    return redirect('practice:problem_detail', problem_id=problem.id)
-
-                # Execute the official solution query and fetch its results
-                with connection.cursor() as solution_cursor:
-                    solution_cursor.execute(problem.solution.query)
-                    solution_results = solution_cursor.fetchall()
-                
-                # Compare the results (sorting them ensures order doesn't matter)
-                if sorted(user_results) == sorted(solution_results):
-                    messages.success(request, 'Correct! Your solution is accurate.')
-                    # *** On success, add the user's results to the context to be displayed ***
-                    context['query_results'] = user_results
-                    context['column_headers'] = user_column_headers
-                else:
-                    messages.error(request, 'Incorrect. The results did not match the expected solution.')
-                    # *** On incorrect, ALSO show their results so they can debug ***
-                    context['query_results'] = user_results
-                    context['column_headers'] = user_column_headers
-            
+            comparison, result_page = execution_service().grade_query(problem, user_query)
+            count_verdict(comparison.correct)
+            record(request, problem, ACTION_SUBMIT, user_query, started,
+                   VERDICT_CORRECT if comparison.correct else VERDICT_INCORRECT, row_count=comparison.row_count)
+
+            if comparison.correct:
+                messages.success(request, 'Correct! Your solution is accurate.')
+            else:
+                messages.error(request, f'Incorrect. The results did not match the expected solution. {comparison.reason}')
+
+            # *** Show their results either way, so they can debug ***
+            context['result_page'] = result_page
+            context['query_results'] = result_page.rows
+            context['column_headers'] = result_page.columns
+            # What exactly differs from the expected result (see result_diff.py)
+            context['result_diff'] = comparison.diff
+
             # *** RENDER THE TEMPLATE with the messages and results context ***
-            return render(request, 'practice/problem_detail.html', context)
+            return render_detail(request, context)
+
+        except SandboxBusy as e:
+            count_error(e)
+            return sandbox_busy(request, context)
 
         except Error as e: 
             # If a database error happens during submission, display it in the results area
+            count_error(e)
+            record(request, problem, ACTION_SUBMIT, user_query, started, error_verdict(e), error=e)
             context['query_error'] = str(e)
-            return render(request, 'practice/problem_detail.html', context)
+            return render_detail(request, context)
         
         except Exception as e:
             # Handle any other unexpected application errors
+            count_error(e)
+            record(request, problem, ACTION_SUBMIT, user_query, started, error_verdict(e), error=e)
             context['query_error'] = f"An unexpected application error occurred: {e}"
-            return render(request, 'practice/problem_detail.html', context)
+            return render_detail(request, context)
+
+    # --- BRANCH 3: User clicked "Explain" ---
+    elif action == 'explain':
+        if not user_query:
+            context['query_error'] = "Cannot explain an empty query."
+            return render_detail(request, context)
+
+        try:
+            # EXPLAIN ANALYZE runs the query, but only its plan and costs are shown
+            context['query_stats'] = execution_service().explain_query(problem, user_query)
+            return render_detail(request, context)
+
+        except SandboxBusy as e:
+            count_error(e)
+            return sandbox_busy(request, context)
+        except Error as e:
+            count_error(e)
+            context['query_error'] = str(e)
+            return render_detail(request, context)
+        except Exception as e:
+            count_error(e)
+            context['query_error'] = f"An unexpected application error occurred: {e}"
+            return render_detail(request, context)
 
     # Fallback redirect if no action is specified
-    return redirect('practice:problem_detail', problem_id=problem.id)
\ No newline at end of file
+    return redirect('practice:problem_detail', problem_id=problem.id)
+
+
+def positive_int(value):
+    try:
+        return max(int(value), 0) or None
+    except (TypeError, ValueError):
+        return None
+
+def problem_list(request):
+    """
+    The problem catalog, in id order, with keyset pagination (?after=<id> /
+    ?before=<id> instead of an OFFSET, so every page costs the same), filters
+    (?q= title, ?engine=, ?status=solved/unsolved) and per-problem solve counts.
+    """
+    page_size = getattr(settings, 'PRACTICE_CATALOG_PAGE_SIZE', 20)
+    query = request.GET.get('q', '').strip()
+    engine = request.GET.get('engine', '')
+    status = request.GET.get('status', '')
+    after, before = positive_int(request.GET.get('after')), positive_int(request.GET.get('before'))
+
+    # Only the columns the list shows
+    problems = Problem.objects.only('id', 'title', 'engine')
+    if query:
+        problems = problems.filter(title__icontains=query)
+    if engine in dict(ENGINE_CHOICES):
+        problems = problems.filter(engine=engine)
+    user_id = request.user.pk if request.user.is_authenticated else None
+    session_key = request.session.session_key
+    if status in ('solved', 'unsolved') and (user_id is not None or session_key):
+        solved = solved_by(user_id, session_key)
+        problems = problems.filter(solved if status == 'solved' else ~solved)
+
+    # One row more than a page tells whether there is a next (or previous) page
+    if before:
+        page = list(problems.filter(id__lt=before).order_by('-id')[:page_size + 1])
+        has_previous, has_next = len(page) > page_size, True
+        page = page[:page_size][::-1]
+    else:
+        page = list(problems.filter(id__gt=after or 0).order_by('id')[:page_size + 1])
+        has_previous, has_next = bool(after), len(page) > page_size
+        page = page[:page_size]
+
+    counts = solve_counts([problem.pk for problem in page])
+    for problem in page:
+        problem.attempts, problem.solved = counts[problem.pk]
+        problem.solve_rate = round(100 * problem.solved / problem.attempts) if problem.attempts else None
+
+    filters = {name: value for name, value in (('q', query), ('engine', engine), ('status', status)) if value}
+    return render(request, 'practice/problem_list.html', {
+        'problems': page,
+        'query': query,
+        'engine': engine,
+        'status': status,
+        'engine_choices': ENGINE_CHOICES,
+        'can_filter_status': user_id is not None or bool(session_key),
+        'next_query': urlencode({**filters, 'after': page[-1].pk}) if has_next and page else '',
+        'previous_query': urlencode({**filters, 'before': page[0].pk}) if has_previous and page else '',
+    })
+
+
+def metrics(request):
+    """Prometheus text-format metrics (see metrics.py), only for PRACTICE_METRICS_ALLOWED_IPS."""
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'PRACTICE_METRICS_ALLOWED_IPS', ['127.0.0.1', '::1']):
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def asset(request, name):
+    """A hashed editor bundle (see assets.py), precompressed, cacheable forever."""
+    bundle = find_bundle(name)
+    if bundle is None:
+        raise Http404
+    etag = f'"{bundle.hashed_name}"'
+    encoding = preferred_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(bundle.encoded(encoding), content_type=bundle.content_type)
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={CACHE_MAX_AGE}, immutable'
+    response['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,291 @@
+# practice/workers.py
+#
+# Optional out-of-process execution of user SQL.
+#
+# With PRACTICE_EXECUTION_WORKERS > 0, each web process starts that many worker
+# processes, each with its own database connections. Run/Submit jobs are handed
+# to an idle worker over a pipe and the web thread just waits for the answer,
+# with a wall-clock deadline:
+#
+#   1. when the deadline passes, the worker's Postgres backend is cancelled
+#      (pg_cancel_backend) and the worker gets a moment to report back;
+#   2. if it still doesn't answer (hung driver, stuck network), the worker
+#      process is killed and a fresh one is started in its place.
+#
+# Either way the web worker is free again after `deadline + grace` seconds, and
+# grading runs on as many cores as there are workers.
+#
+# With PRACTICE_EXECUTION_WORKERS = 0 (the default) queries run in the web
+# process itself, exactly as execution.run_query / grade_query do.
+#
+# Either way, repeated Runs/Submits are answered from the result cache when
+# possible (see result_cache.py).
+
+import atexit
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, Error, OperationalError, connections
+
+from . import execution, result_cache
+from .metrics import collect_phases, record_phase
+from .sandbox import AdmissionGate, QueryLimitError, SandboxBusy, execution_policy, sandbox_connection
+
+# Seconds a cancelled worker gets to report back before it is killed
+CANCEL_GRACE = 1.0
+
+
+def worker_count():
+    return getattr(settings, 'PRACTICE_EXECUTION_WORKERS', 0)
+
+
+# --- Worker process side ---
+
+JOB_HANDLERS = {
+    'run': execution.run_query,
+    'grade': execution.grade_query,
+    'explain': execution.explain_query,
+}
+
+def worker_main(conn):
+    """Entry point of a worker process: run jobs from `conn` until the pipe closes."""
+    import django
+
+    # Ctrl-C in the terminal is for the parent; it stops us by closing the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
+    from django.db import close_old_connections
+
+    while True:
+        try:
+            action, problem, args = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        try:
+            # The connection sandbox.problem_cursor will use (the replica's, if there is one)
+            db = sandbox_connection(problem)
+            db.ensure_connection()
+            # Tell the parent which backend to cancel if we run past the deadline
+            conn.send(('started', (db.alias, db.connection.get_backend_pid())))
+            # The phases are timed here, but reported by the web process (see metrics.py)
+            with collect_phases() as phases:
+                try:
+                    reply = ('ok', JOB_HANDLERS[action](problem, *args))
+                finally:
+                    conn.send(('phases', phases))
+        except SandboxBusy as e:
+            reply = ('busy', str(e))
+        except QueryLimitError as e:
+            reply = ('limit', (str(e), e.limit))
+        except Error as e:
+            reply = ('error', str(e))
+        except Exception as e:
+            reply = ('crash', f"{type(e).__name__}: {e}")
+        finally:
+            close_old_connections()
+
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # e.g. a value in the result that can't be pickled
+            conn.send(('crash', f"Could not send the result back: {e}"))
+
+
+# --- Web process side ---
+
+class Worker:
+    """One worker process and the parent's end of its pipe."""
+
+    def __init__(self, context):
+        self.context = context
+        self.process = None
+        self.conn = None
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+
+    def restart(self):
+        self.kill()
+        self.start()
+
+
+class ExecutionPool:
+    """
+    A fixed set of Worker processes. `run_query` / `grade_query` / `explain_query` take the same
+    arguments and return the same values as their execution.py counterparts.
+    """
+
+    def __init__(self, size, deadline, max_waiting, wait_timeout):
+        self.deadline = deadline
+        self.gate = AdmissionGate(size, max_waiting, wait_timeout)
+        # 'spawn': forking a process with live database connections isn't safe
+        context = multiprocessing.get_context('spawn')
+        self.idle = queue.SimpleQueue()
+        self.workers = [Worker(context) for _ in range(size)]
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def run_query(self, problem, user_query, offset=0):
+        return self.submit('run', problem, user_query, offset)
+
+    def grade_query(self, problem, user_query):
+        return self.submit('grade', problem, user_query)
+
+    def explain_query(self, problem, user_query):
+        return self.submit('explain', problem, user_query)
+
+    def deadline_for(self, problem):
+        """Seconds a job may take: PRACTICE_EXECUTION_DEADLINE, but never less than the statement timeout."""
+        statement_timeout = execution_policy(problem).statement_timeout_ms / 1000
+        return max(self.deadline, statement_timeout + 1)
+
+    def submit(self, action, problem, *args):
+        with self.gate.slot():
+            worker = self.idle.get_nowait()
+            try:
+                return self.wait_for(worker, (action, problem, args), self.deadline_for(problem), problem)
+            finally:
+                self.idle.put(worker)
+
+    def wait_for(self, worker, job, deadline, problem):
+        if not worker.process.is_alive():
+            worker.restart()
+        worker.conn.send(job)
+
+        backend = None
+        expires = time.monotonic() + deadline
+        while True:
+            remaining = expires - time.monotonic()
+            try:
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    self.stop(worker, backend)
+                    raise QueryLimitError(f"Your query ran for more than {deadline:g} seconds and was stopped.", 'deadline')
+                kind, value = worker.conn.recv()
+            except (EOFError, OSError):
+                worker.restart()
+                raise OperationalError("The query worker exited unexpectedly. Please try again.")
+
+            if kind == 'started':
+                backend = value
+            elif kind == 'phases':
+                for name, seconds in value:
+                    record_phase(name, seconds)
+            elif kind == 'ok':
+                return value
+            elif kind == 'busy':
+                raise SandboxBusy(value)
+            elif kind == 'limit':
+                raise QueryLimitError(*value)
+            else:
+                raise DatabaseError(value)
+
+    def stop(self, worker, backend):
+        """Cancel the worker's running query; kill and replace the worker if that doesn't free it."""
+        if backend is not None:
+            alias, backend_pid = backend
+            try:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute("SELECT pg_cancel_backend(%s)", [backend_pid])
+            except Error:
+                pass
+            # The cancelled job still reports back (with an error); drain it
+            expires = time.monotonic() + CANCEL_GRACE
+            try:
+                while worker.conn.poll(max(expires - time.monotonic(), 0)):
+                    kind, _ = worker.conn.recv()
+                    if kind not in ('started', 'phases'):
+                        return
+            except (EOFError, OSError):
+                pass
+        worker.restart()
+
+    def close(self):
+        for worker in self.workers:
+            worker.kill()
+
+
+class InProcessExecution:
+    """PRACTICE_EXECUTION_WORKERS = 0: run queries in the calling thread."""
+
+    def run_query(self, problem, user_query, offset=0):
+        return execution.run_query(problem, user_query, offset)
+
+    def grade_query(self, problem, user_query):
+        return execution.grade_query(problem, user_query)
+
+    def explain_query(self, problem, user_query):
+        return execution.explain_query(problem, user_query)
+
+
+class CachedExecution:
+    """Answers Run/Submit from the result cache (see result_cache.py) before asking `service`."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def run_query(self, problem, user_query, offset=0):
+        key, page = result_cache.lookup('run', problem, user_query, offset)
+        if page is not None:
+            page.cached = True
+            return page
+        page = self.service.run_query(problem, user_query, offset)
+        result_cache.store(key, problem, page)
+        return page
+
+    def grade_query(self, problem, user_query):
+        key, result = result_cache.lookup('submit', problem, user_query)
+        if result is not None:
+            result[1].cached = True
+            return result
+        result = self.service.grade_query(problem, user_query)
+        result_cache.store(key, problem, result)
+        return result
+
+    def explain_query(self, problem, user_query):
+        # Timings are the point of EXPLAIN: never cached
+        return self.service.explain_query(problem, user_query)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def execution_service():
+    """
+    The ExecutionPool of this process (started on first use), or an
+    InProcessExecution, behind the result cache.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                if worker_count() > 0:
+                    pool = ExecutionPool(
+                        size=worker_count(),
+                        deadline=getattr(settings, 'PRACTICE_EXECUTION_DEADLINE', 15),
+                        max_waiting=getattr(settings, 'PRACTICE_SANDBOX_MAX_WAITING', 16),
+                        wait_timeout=getattr(settings, 'PRACTICE_SANDBOX_WAIT_TIMEOUT', 2),
+                    )
+                    atexit.register(pool.close)
+                    _service = CachedExecution(pool)
+                else:
+                    _service = CachedExecution(InProcessExecution())
+    return _service
@@ -84,9 +84,47 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': os.getenv('POSTGRES_PORT'),
-    }
+        # Keep connections open between requests instead of reconnecting every time
+        'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # User SQL runs on its own connections (see practice/sandbox.py), ideally as a
+    # low-privilege role that can only read the problem schemas:
+    #   CREATE ROLE sandbox LOGIN PASSWORD '...';
+    # seed_problems grants it USAGE/SELECT on every problem schema it builds.
+    'sandbox': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB'),
+        'USER': os.getenv('SANDBOX_DB_USER', os.getenv('POSTGRES_USER')),
+        'PASSWORD': os.getenv('SANDBOX_DB_PASSWORD', os.getenv('POSTGRES_PASSWORD')),
+        'HOST': os.getenv('POSTGRES_HOST'),
+        'PORT': os.getenv('POSTGRES_PORT'),
+        # Persistent: each worker thread keeps one warm sandbox connection
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+# Read-only user SQL (pre-built problem schemas) runs on this read replica of the
+# main database when SANDBOX_REPLICA_HOST is set, e.g. a streaming standby (see
+# practice/routers.py). If it can't be reached, the primary's 'sandbox' alias is
+# used for PRACTICE_SANDBOX_REPLICA_RETRY_INTERVAL seconds before retrying.
+if os.getenv('SANDBOX_REPLICA_HOST'):
+    DATABASES['sandbox_replica'] = {
+        **DATABASES['sandbox'],
+        'HOST': os.getenv('SANDBOX_REPLICA_HOST'),
+        'PORT': os.getenv('SANDBOX_REPLICA_PORT', os.getenv('POSTGRES_PORT')),
+    }
+PRACTICE_SANDBOX_REPLICA_ALIAS = 'sandbox_replica'
+PRACTICE_SANDBOX_REPLICA_RETRY_INTERVAL = int(os.getenv('PRACTICE_SANDBOX_REPLICA_RETRY_INTERVAL', '30'))
+DATABASE_ROUTERS = ['practice.routers.SandboxRouter']
+
+# User queries are checked (single read-only statement) before they reach the
+# database; the verdicts of the last PRACTICE_SQL_CLASSIFIER_CACHE_SIZE distinct
+# queries are kept (see practice/classifier.py).
+PRACTICE_SQL_CLASSIFIER_CACHE_SIZE = int(os.getenv('PRACTICE_SQL_CLASSIFIER_CACHE_SIZE', '4096'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,4 +180,121 @@ MARKDOWNIFY = {
         'h5', 'h6', 'hr', 'br', 'table', 'thead', 'tbody', 'tr', 'th',
         'td', 'details', 'summary'
     ]
-}
\ No newline at end of file
+}
+
+# PRACTICE SANDBOX
+# ==============================================================================
+# Run user queries against each problem's pre-built schema (see practice/sandbox.py).
+# Set to False to go back to executing the schema scripts on every Run/Submit.
+PRACTICE_PREBUILT_SCHEMAS = os.getenv('PRACTICE_PREBUILT_SCHEMAS', 'True') == 'True'
+
+# maintenance_work_mem for building a problem's schema: the index builds after a
+# bulk load (see practice/dataload.py) sort every row of the table at once.
+PRACTICE_BUILD_MAINTENANCE_WORK_MEM = os.getenv('PRACTICE_BUILD_MAINTENANCE_WORK_MEM', '256MB')
+
+# Run shows one page of the result at a time; a page is also cut short once its
+# rows add up to PRACTICE_RESULT_BYTE_LIMIT (roughly, as displayed text).
+PRACTICE_RESULT_PAGE_SIZE = int(os.getenv('PRACTICE_RESULT_PAGE_SIZE', '100'))
+PRACTICE_RESULT_BYTE_LIMIT = int(os.getenv('PRACTICE_RESULT_BYTE_LIMIT', str(1024 * 1024)))
+# Count the rows after the current page ("showing 1-100 of M"). The rows are
+# skipped server-side, never sent to Django. At most PRACTICE_COUNT_ROWS_LIMIT
+# are counted ("of more than M"), so a huge result doesn't hit the statement timeout.
+PRACTICE_COUNT_TOTAL_ROWS = os.getenv('PRACTICE_COUNT_TOTAL_ROWS', 'True') == 'True'
+PRACTICE_COUNT_ROWS_LIMIT = int(os.getenv('PRACTICE_COUNT_ROWS_LIMIT', '100000'))
+
+# Limits applied to every transaction that runs user SQL (see ExecutionPolicy in
+# practice/sandbox.py). Problems can raise the timeout / work_mem / temp_file_limit
+# individually in the admin.
+PRACTICE_EXECUTION_POLICY = {
+    'statement_timeout_ms': int(os.getenv('PRACTICE_STATEMENT_TIMEOUT_MS', '5000')),
+    'lock_timeout_ms': int(os.getenv('PRACTICE_LOCK_TIMEOUT_MS', '1000')),
+    'idle_in_transaction_timeout_ms': int(os.getenv('PRACTICE_IDLE_IN_TRANSACTION_TIMEOUT_MS', '10000')),
+    'work_mem': os.getenv('PRACTICE_WORK_MEM', '16MB'),
+    # Superuser-only setting; leave empty when connecting as a restricted role
+    'temp_file_limit': os.getenv('PRACTICE_TEMP_FILE_LIMIT', ''),
+}
+
+# Admission control for user SQL, per web process: at most MAX_CONCURRENT queries
+# run at once, at most MAX_WAITING wait (for up to WAIT_TIMEOUT seconds) for a
+# slot, and everyone else gets an immediate 503.
+PRACTICE_SANDBOX_MAX_CONCURRENT = int(os.getenv('PRACTICE_SANDBOX_MAX_CONCURRENT', '8'))
+PRACTICE_SANDBOX_MAX_WAITING = int(os.getenv('PRACTICE_SANDBOX_MAX_WAITING', '16'))
+PRACTICE_SANDBOX_WAIT_TIMEOUT = float(os.getenv('PRACTICE_SANDBOX_WAIT_TIMEOUT', '2'))
+
+# JSON API under ASGI (practice/async_sandbox.py): asyncpg connections per
+# process, and how many more requests may wait for one before getting a 503.
+PRACTICE_ASYNC_POOL_SIZE = int(os.getenv('PRACTICE_ASYNC_POOL_SIZE', '20'))
+PRACTICE_ASYNC_MAX_WAITING = int(os.getenv('PRACTICE_ASYNC_MAX_WAITING', '200'))
+
+# Rendered problem markdown is cached under a key that includes a hash of the
+# markdown, so edits never serve stale HTML. Uses the default cache backend.
+PRACTICE_MARKDOWN_CACHE_TIMEOUT = int(os.getenv('PRACTICE_MARKDOWN_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
+# Run user SQL in a pool of worker processes (practice/workers.py) instead of the
+# web worker itself: 0 = in-process. A job that runs longer than
+# PRACTICE_EXECUTION_DEADLINE seconds has its backend cancelled; if the worker
+# still doesn't answer, it is killed and replaced.
+PRACTICE_EXECUTION_WORKERS = int(os.getenv('PRACTICE_EXECUTION_WORKERS', '0'))
+PRACTICE_EXECUTION_DEADLINE = float(os.getenv('PRACTICE_EXECUTION_DEADLINE', '15'))
+
+# A wrong Submit lists up to PRACTICE_DIFF_MAX_ROWS missing/extra/miscounted rows
+# (0 turns the diff off). At most PRACTICE_DIFF_MAX_TRACKED_ROWS distinct rows are
+# held in memory while computing it (see practice/result_diff.py).
+PRACTICE_DIFF_MAX_ROWS = int(os.getenv('PRACTICE_DIFF_MAX_ROWS', '20'))
+PRACTICE_DIFF_MAX_TRACKED_ROWS = int(os.getenv('PRACTICE_DIFF_MAX_TRACKED_ROWS', '50000'))
+
+# Results of deterministic, read-only Run/Submit queries are cached, keyed by the
+# normalized query and the problem's data version (see practice/result_cache.py).
+# Backend: 'local' (an in-process LRU bounded by PRACTICE_RESULT_CACHE_MAX_ENTRIES
+# and PRACTICE_RESULT_CACHE_MAX_BYTES), 'django' (the PRACTICE_RESULT_CACHE_ALIAS
+# cache of CACHES, shared between processes) or '' to turn caching off. Results
+# bigger than PRACTICE_RESULT_CACHE_MAX_ENTRY_BYTES (pickled) aren't cached.
+PRACTICE_RESULT_CACHE_BACKEND = os.getenv('PRACTICE_RESULT_CACHE_BACKEND', 'local')
+PRACTICE_RESULT_CACHE_TTL = int(os.getenv('PRACTICE_RESULT_CACHE_TTL', '300'))
+PRACTICE_RESULT_CACHE_MAX_ENTRIES = int(os.getenv('PRACTICE_RESULT_CACHE_MAX_ENTRIES', '1000'))
+PRACTICE_RESULT_CACHE_MAX_BYTES = int(os.getenv('PRACTICE_RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+PRACTICE_RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv('PRACTICE_RESULT_CACHE_MAX_ENTRY_BYTES', str(1024 * 1024)))
+PRACTICE_RESULT_CACHE_ALIAS = os.getenv('PRACTICE_RESULT_CACHE_ALIAS', 'default')
+
+# Every Run/Submit is recorded as a Submission (see practice/history.py), through an
+# in-process buffer written with one bulk INSERT per PRACTICE_HISTORY_BATCH_SIZE
+# submissions or every PRACTICE_HISTORY_FLUSH_INTERVAL seconds. At most
+# PRACTICE_HISTORY_MAX_PENDING wait to be written; beyond that the oldest are dropped.
+PRACTICE_SUBMISSION_HISTORY = os.getenv('PRACTICE_SUBMISSION_HISTORY', 'True') == 'True'
+PRACTICE_HISTORY_BATCH_SIZE = int(os.getenv('PRACTICE_HISTORY_BATCH_SIZE', '200'))
+PRACTICE_HISTORY_FLUSH_INTERVAL = float(os.getenv('PRACTICE_HISTORY_FLUSH_INTERVAL', '2'))
+PRACTICE_HISTORY_MAX_PENDING = int(os.getenv('PRACTICE_HISTORY_MAX_PENDING', '10000'))
+
+# The problem catalog (/problems/) shows PRACTICE_CATALOG_PAGE_SIZE problems per page;
+# their solve counts are cached for PRACTICE_CATALOG_CACHE_TIMEOUT seconds.
+PRACTICE_CATALOG_PAGE_SIZE = int(os.getenv('PRACTICE_CATALOG_PAGE_SIZE', '20'))
+PRACTICE_CATALOG_CACHE_TIMEOUT = int(os.getenv('PRACTICE_CATALOG_CACHE_TIMEOUT', '60'))
+
+# CSV/NDJSON exports (/api/problems/<id>/export) are streamed, and cut off after
+# PRACTICE_EXPORT_MAX_ROWS rows.
+PRACTICE_EXPORT_MAX_ROWS = int(os.getenv('PRACTICE_EXPORT_MAX_ROWS', '1000000'))
+
+# Every Run records its time and row count. With PRACTICE_EXPLAIN_RUNS it is also
+# EXPLAIN ANALYZEd (the query then runs twice); the Explain button always does.
+PRACTICE_EXPLAIN_RUNS = os.getenv('PRACTICE_EXPLAIN_RUNS', 'False') == 'True'
+
+# Per-query stats are logged as one JSON object per line to 'practice.query_stats'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'practice': {
+            'handlers': ['console'],
+            'level': os.getenv('PRACTICE_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+# Phase-level latency histograms and verdict/error/timeout counters (practice/metrics.py),
+# served in the Prometheus text format at /metrics to these addresses only.
+PRACTICE_METRICS_ALLOWED_IPS = os.getenv('PRACTICE_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+# Requests slower than this are logged to 'practice.slow_requests' with their phase breakdown (0 = off)
+PRACTICE_SLOW_REQUEST_MS = int(os.getenv('PRACTICE_SLOW_REQUEST_MS', '1000'))
@@ -21,9 +21,13 @@ def home(request):
 
 from django.contrib import admin
 from django.urls import path, include
+from practice import views as practice_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('problems/', include('practice.urls')),
+    path('api/', include('practice.api_urls')),
+    path('metrics', practice_views.metrics, name='metrics'),
+    path('assets/<str:name>', practice_views.asset, name='asset'),
     # path('', home),  # this maps `/` to the home function
 ]